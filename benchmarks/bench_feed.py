@@ -0,0 +1,47 @@
+"""
+File:           bench_feed.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 2:40 pm
+"""
+import itertools
+
+import pytest
+
+from src.brokerapi.angelbroking.websocketv2 import SmartWebSocketV2
+from src.simulator.market_generator import FrameGenerator
+from src.simulator.smartstream import LTP_MODE, QUOTE, SNAP_QUOTE
+
+
+@pytest.mark.parametrize("mode", [LTP_MODE, QUOTE, SNAP_QUOTE])
+def bench_parse_binary_data(benchmark, market, mode):
+    frames = itertools.cycle(list(itertools.islice(FrameGenerator(market, mode=mode).frames(), 500)))
+    web_socket = SmartWebSocketV2("", "", "", "")
+    benchmark(lambda: web_socket._parse_binary_data(next(frames)))
+
+
+@pytest.mark.parametrize("mode", [LTP_MODE, SNAP_QUOTE])
+def bench_parse_save(benchmark, market, market_feed, mode):
+    web_socket = SmartWebSocketV2("", "", "", "")
+    messages = [
+        web_socket._parse_binary_data(frame)
+        for frame in itertools.islice(FrameGenerator(market, mode=mode).frames(), 500)
+    ]
+    cycle = itertools.cycle(messages)
+
+    def parse_save():
+        message = next(cycle)
+        # Keep the sequence numbers increasing so that replayed messages are not dropped
+        message["sequence_number"] += len(messages)
+        market_feed.parse_save(message)
+
+    benchmark(parse_save)
+
+
+def bench_redis_set(benchmark, redis_backend):
+    data = {"token": "40000", "ltp": 101.35, "timestamp": 1792475400}
+    benchmark(redis_backend.set, "NIFTY20OCT2619500CE", data)
+
+
+def bench_redis_get(benchmark, redis_backend):
+    redis_backend.set("NIFTY20OCT2619500CE", {"token": "40000", "ltp": 101.35, "timestamp": 0})
+    benchmark(redis_backend.get, "NIFTY20OCT2619500CE")
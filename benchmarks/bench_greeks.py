@@ -0,0 +1,15 @@
+"""
+File:           bench_greeks.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 10:30 pm
+"""
+
+
+def bench_chain_greeks(benchmark, price_monitor):
+    snapshot = price_monitor.take_snapshot()
+    benchmark(price_monitor.greeks_engine.compute, snapshot, price_monitor.get_symbol)
+
+
+def bench_get_strike_by_delta(benchmark, price_monitor):
+    with price_monitor.use_snapshot():
+        benchmark(price_monitor.get_strike_by_delta, delta=0.1, option_type="CE")
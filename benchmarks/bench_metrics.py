@@ -0,0 +1,27 @@
+"""
+File:           bench_metrics.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 12:05 am
+"""
+from src.metrics import MetricsRegistry
+
+
+registry = MetricsRegistry()
+ticks = registry.counter("bench_ticks", "Ticks", ("client_id",)).labels("C0")
+redis_write_seconds = registry.histogram("bench_redis_write_seconds", "Redis write time")
+
+
+def bench_tick_metrics(benchmark):
+    """ Metrics updated on every tick by the market feed """
+
+    def update():
+        ticks.inc()
+        redis_write_seconds.observe(0.0002)
+
+    benchmark(update)
+
+
+def bench_render(benchmark):
+    for client_id in range(10):
+        registry.counter("bench_ticks", "Ticks", ("client_id",)).labels(client_id).inc()
+    benchmark(registry.render)
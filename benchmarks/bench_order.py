@@ -0,0 +1,47 @@
+"""
+File:           bench_order.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 11:50 pm
+"""
+import pytest
+
+from src.strategies.instrument import Instrument, Action
+
+
+def get_instrument(expiry, strike: int, option_type: str) -> Instrument:
+    return Instrument(
+        action=Action.SELL,
+        lot_size=500,
+        expiry=expiry,
+        option_type=option_type,
+        strike=strike,
+        index="NIFTY",
+        entry=None,
+        price=0,
+        order_id=""
+    )
+
+
+@pytest.mark.parametrize("option_type", ["CE", "PE"])
+def bench_place_order_cold(benchmark, broker_api, expiry, option_type):
+    """ Decision to HTTP dispatch when the symbol and the payload are resolved on the order path """
+    instrument = get_instrument(expiry, 19500, option_type)
+
+    def setup():
+        broker_api._symbol_data_cache.clear()
+        broker_api._order_templates.clear()
+
+    benchmark.pedantic(
+        broker_api.place_intraday_options_order,
+        args=(instrument,),
+        setup=setup,
+        rounds=200
+    )
+
+
+@pytest.mark.parametrize("option_type", ["CE", "PE"])
+def bench_place_order_template(benchmark, broker_api, expiry, option_type):
+    """ Decision to HTTP dispatch with the payload built by the warm up """
+    instrument = get_instrument(expiry, 19500, option_type)
+    broker_api.get_order_template(instrument)
+    benchmark(broker_api.place_intraday_options_order, instrument)
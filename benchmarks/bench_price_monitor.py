@@ -0,0 +1,26 @@
+"""
+File:           bench_price_monitor.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 2:55 pm
+"""
+import pytest
+
+
+@pytest.mark.parametrize("option_type", ["CE", "PE"])
+@pytest.mark.parametrize("price", [5, 50, 200])
+def bench_get_strike_by_price(benchmark, price_monitor, price, option_type):
+    benchmark(price_monitor.get_strike_by_price, price=price, option_type=option_type)
+
+
+def bench_get_atm_strike(benchmark, price_monitor):
+    benchmark(price_monitor.get_atm_strike)
+
+
+def bench_take_snapshot(benchmark, price_monitor):
+    benchmark(price_monitor.take_snapshot)
+
+
+@pytest.mark.parametrize("option_type", ["CE", "PE"])
+def bench_get_strike_by_price_in_snapshot(benchmark, price_monitor, option_type):
+    with price_monitor.use_snapshot():
+        benchmark(price_monitor.get_strike_by_price, price=5, option_type=option_type)
@@ -0,0 +1,39 @@
+"""
+File:           bench_strategy.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 3:05 pm
+"""
+import pytest
+
+from src.utils.enum import Weekdays
+
+
+def bench_get_pnl_from_orderbook(benchmark, strategy, orderbook):
+    benchmark(strategy.get_pnl_from_orderbook, orderbook)
+
+
+@pytest.mark.parametrize("strike", [19500, 22000])
+def bench_get_symbol_data(benchmark, symbol_parser, expiry, strike):
+    benchmark(
+        symbol_parser.get_symbol_data,
+        ticker="NIFTY",
+        strike=strike,
+        expiry=expiry,
+        option_type="PE"
+    )
+
+
+def bench_config_access(benchmark, strategy):
+    """ Config read by one loop iteration of the strategy """
+    strategy._weekday = Weekdays.THURSDAY
+
+    def read():
+        strategy.refresh_settings()
+        return (
+            strategy.sl_percent,
+            strategy.target_percent,
+            strategy.exit_time,
+            strategy.expected_margin_per_lot
+        )
+
+    benchmark(read)
@@ -0,0 +1,188 @@
+"""
+File:           conftest.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 2:10 pm
+"""
+import datetime
+import os
+import time
+
+import pytest
+import redis
+
+from src import BASE_DIR
+from src.brokerapi.angelbroking.api import AngelBrokingApi, AngelBrokingMarketFeed, \
+    AngelBrokingSymbolParser, TokenSymbolMapper
+from src.price_monitor.price_monitor import PriceMonitor
+from src.simulator.market_generator import ExpiryDayMarket
+from src.strategies.strategy1 import Strategy1
+from src.strategies.strategy_config import StrategyConfigWatcher
+from src.utils import StrategyTicker
+from src.utils.redis_backend import RedisBackend
+
+
+EXPIRY = datetime.date(2026, 10, 20)
+CONFIG_PATH = BASE_DIR / "data" / "config_dummy.json"
+
+
+@pytest.fixture(scope="session")
+def expiry() -> datetime.date:
+    return EXPIRY
+
+
+@pytest.fixture(scope="session")
+def redis_client():
+    """
+    Use the local redis server when BENCHMARK_REDIS=1 so that network round trips are part of
+    the numbers, else fall back to fakeredis.
+    """
+    if os.environ.get("BENCHMARK_REDIS") == "1":
+        client = redis.Redis(
+            host=os.environ.get("REDIS_HOST", "localhost"),
+            port=int(os.environ.get("REDIS_PORT", 6379))
+        )
+        client.ping()
+        return client
+    import fakeredis
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture(scope="session")
+def redis_backend(redis_client) -> RedisBackend:
+    backend = RedisBackend()
+    backend._redis = redis_client
+    return backend
+
+
+@pytest.fixture(scope="session")
+def market() -> ExpiryDayMarket:
+    StrategyTicker.get_instance().ticker = "NIFTY"
+    return ExpiryDayMarket(expiry=EXPIRY, strikes_each_side=60, seed=7)
+
+
+@pytest.fixture(scope="session")
+def token_symbol_mapper(market) -> TokenSymbolMapper:
+    """ Map tokens to redis keys the same way MarketFeeds.setup does """
+    mapper = TokenSymbolMapper()
+    for instrument in market.instruments:
+        mapper[instrument.token] = instrument.symbol if instrument.strike else "NIFTY"
+    return mapper
+
+
+@pytest.fixture()
+def chain_in_redis(redis_backend, market, token_symbol_mapper) -> ExpiryDayMarket:
+    """ Write the whole option chain to redis in the format written by parse_save """
+    received_at = int(time.time() * 1000)
+    for instrument in market.instruments:
+        redis_backend.set(
+            token_symbol_mapper[instrument.token],
+            {
+                "token": instrument.token,
+                "ltp": instrument.ltp,
+                "timestamp": received_at // 1000,
+                "received_at": received_at,
+                "exchange_timestamp": received_at
+            }
+        )
+    return market
+
+
+@pytest.fixture()
+def price_monitor(redis_backend, chain_in_redis) -> PriceMonitor:
+    monitor = PriceMonitor()
+    monitor._redis_backend = redis_backend
+    monitor._expiry = EXPIRY
+    monitor._expiry_str = EXPIRY.strftime("%d%b%y").upper()
+    return monitor
+
+
+@pytest.fixture()
+def market_feed(redis_backend, market, token_symbol_mapper) -> AngelBrokingMarketFeed:
+    feed = AngelBrokingMarketFeed(api_key="", auth_token="", feed_token="", client_id="")
+    feed._redis_backend = redis_backend
+    feed.index_tokens = [x.token for x in market.instruments if x.strike is None]
+    feed.options_tokens = [x.token for x in market.instruments if x.strike is not None]
+    return feed
+
+
+@pytest.fixture(scope="session")
+def symbol_parser() -> AngelBrokingSymbolParser:
+    """ Symbol parser loaded with 8 weekly expiries, roughly the size of the NIFTY scrip master """
+    parser = AngelBrokingSymbolParser()
+    instruments = []
+    for week in range(8):
+        expiry = EXPIRY + datetime.timedelta(days=7 * week)
+        instruments += ExpiryDayMarket(expiry=expiry, strikes_each_side=100).scrip_master()
+    parser._nifty_instruments = instruments
+    return parser
+
+
+@pytest.fixture()
+def strategy(price_monitor) -> Strategy1:
+    StrategyTicker.get_instance().quantity = 50
+    return Strategy1(
+        api_key="",
+        client_id="",
+        password="",
+        totp_key="",
+        price_monitor=price_monitor,
+        config=StrategyConfigWatcher(CONFIG_PATH, Strategy1.STRATEGY_CODE),
+        bot=None,
+        dry_run=True
+    )
+
+
+@pytest.fixture()
+def orderbook(market) -> list:
+    """
+    Order book of a busy expiry day. Hedges and straddle entry followed by 10 straddle shifts and
+    remaining lot orders.
+    """
+    orders = []
+    atm = round(market.spot / 50) * 50
+
+    def add(strike: int, option_type: str, action: str, quantity: int):
+        symbol = f"NIFTY{EXPIRY.strftime('%d%b%y').upper()}{strike}{option_type}"
+        instrument = market.get_by_symbol(symbol)
+        orders.append(
+            {
+                "tradingsymbol": instrument.symbol,
+                "transactiontype": action,
+                "filledshares": str(quantity),
+                "averageprice": instrument.ltp,
+                "expirydate": EXPIRY.strftime("%d%b%Y").upper(),
+                "updatetime": "20-Oct-2026 10:10:00",
+                "optiontype": option_type,
+                "strikeprice": float(strike),
+                "orderid": str(len(orders) + 1)
+            }
+        )
+
+    add(atm + 600, "CE", "BUY", 500)
+    add(atm - 600, "PE", "BUY", 500)
+    strike = atm
+    for shift in range(10):
+        add(strike, "CE", "SELL", 500 if shift <= 2 else 750)
+        add(strike, "PE", "SELL", 500 if shift <= 2 else 750)
+        if shift == 2:
+            add(strike, "CE", "SELL", 250)
+            add(strike, "PE", "SELL", 250)
+            add(atm + 600, "CE", "BUY", 250)
+            add(atm - 600, "PE", "BUY", 250)
+        quantity = 750 if shift >= 2 else 500
+        add(strike, "CE", "BUY", quantity)
+        add(strike, "PE", "BUY", quantity)
+        strike += 50 if shift % 2 == 0 else -100
+    add(strike, "CE", "SELL", 750)
+    add(strike, "PE", "SELL", 750)
+    return orders
+
+
+@pytest.fixture(scope="session")
+def broker_api(symbol_parser) -> AngelBrokingApi:
+    """ Broker API whose HTTP layer returns an order id without sending the request """
+    api = AngelBrokingApi(api_key="", client_id="", password="", totp_key="")
+    api._symbol_parser = symbol_parser
+    api._smart_connect._request = lambda route, method, params=None: \
+        {"status": True, "data": {"orderid": "1"}}
+    return api
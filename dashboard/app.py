@@ -6,13 +6,14 @@ Created on:     07/11/22, 9:56 pm
 import datetime
 import time
 
-from dash import Dash, html, dcc, Input, Output, State
+from dash import Dash, html, dcc, Input, Output, State, callback_context
 import dash_daq as daq
 import dash_bootstrap_components as dbc
 import dash_auth
 
 from dashboard.db import SessionLocal
 from dashboard.db.db_api import DBApi
+from src.control import CommandStream, CommandType, CommandStreamError
 from src.utils.redis_backend import RedisBackend
 
 
@@ -23,6 +24,7 @@ VALID_USERNAME_PASSWORD_PAIRS = {
 
 redis_backend = RedisBackend()
 redis_backend.connect()
+command_stream = CommandStream(redis_backend)
 
 app = Dash(
     __name__, meta_tags=[{"name": "viewport", "content": "width=device-width"}],
@@ -113,6 +115,48 @@ def manual_entry_exit_buttons():
     )
 
 
+def shifting_buttons():
+    return html.Div(
+        className="shifting-btn",
+        children=[
+            html.Div(
+                className="six columns",
+                children=[
+                    html.Button("Pause Shifting", id="pause-shifting-btn", n_clicks=0)
+                ]
+            ),
+            html.Div(
+                className="six columns",
+                children=[
+                    html.Button("Resume Shifting", id="resume-shifting-btn", n_clicks=0)
+                ]
+            ),
+        ]
+    )
+
+
+def sl_target_inputs():
+    return html.Div(
+        className="sl-target-input",
+        children=[
+            html.Div(
+                className="six columns",
+                children=[
+                    dcc.Input(id="sl-input", type="number", placeholder="SL amount"),
+                    html.Button("Set SL", id="set-sl-btn", n_clicks=0)
+                ]
+            ),
+            html.Div(
+                className="six columns",
+                children=[
+                    dcc.Input(id="target-input", type="number", placeholder="Target amount"),
+                    html.Button("Set Target", id="set-target-btn", n_clicks=0)
+                ]
+            ),
+        ]
+    )
+
+
 def manual_execution():
     return html.Div(
         className="manual-execution",
@@ -120,7 +164,16 @@ def manual_execution():
             html.Div(
                 children=[
                     html.H3("Manual Execution"),
-                    html.Div(className="row", children=manual_entry_exit_buttons())
+                    # Commands are sent to all the accounts if the client id is empty
+                    html.Div(
+                        className="row",
+                        children=dcc.Input(id="client-id-input", placeholder="Client ID (all)")
+                    ),
+                    html.Div(className="row", children=manual_entry_exit_buttons()),
+                    html.Div(className="row", children=shifting_buttons()),
+                    html.Div(className="row", children=sl_target_inputs()),
+                    html.P(id="command-message"),
+                    html.Div(id="command-acks")
                 ]
             )
         ]
@@ -155,8 +208,6 @@ app.layout = html.Div(
                 html.Div(children="", id="display-message", style={"display": "none"}),
                 # Dummy div for power button callback
                 html.Div(children="", id="power-btn-callback", style={"display": "none"}),
-                # Dummy div for manual exit callback
-                html.Div(children="", id="manual-exit-callback", style={"display": "none"}),
                 # Live update trigger
                 # Interval is in milliseconds
                 dcc.Interval(id="interval-component", interval=1*1000, n_intervals=0)
@@ -283,17 +334,65 @@ def load_initial_power_state(children):
 
 @app.callback(
     [
-        Output("manual-exit-callback", "children")
+        Output("command-message", "children")
+    ],
+    [
+        Input("manual-entry-btn", "n_clicks"),
+        Input("manual-exit-btn", "n_clicks"),
+        Input("pause-shifting-btn", "n_clicks"),
+        Input("resume-shifting-btn", "n_clicks"),
+        Input("set-sl-btn", "n_clicks"),
+        Input("set-target-btn", "n_clicks"),
     ],
     [
-        Input("manual-exit-btn", "n_clicks")
+        State("client-id-input", "value"),
+        State("sl-input", "value"),
+        State("target-input", "value"),
     ]
 )
-def manual_exit_callback(n_clicks):
-    if not n_clicks:
+def command_callback(*args):
+    """ Send the command of the clicked button to the strategies """
+    triggered = callback_context.triggered
+    if not triggered or not triggered[0]["value"]:
         return [""]
-    redis_backend.set("MANUAL_EXIT", "True")
-    return [""]
+    client_id, sl, target = args[-3:]
+    button_commands = {
+        "manual-entry-btn": (CommandType.MANUAL_ENTRY, None),
+        "manual-exit-btn": (CommandType.MANUAL_EXIT, None),
+        "pause-shifting-btn": (CommandType.PAUSE_SHIFTING, None),
+        "resume-shifting-btn": (CommandType.RESUME_SHIFTING, None),
+        "set-sl-btn": (CommandType.SET_SL, sl),
+        "set-target-btn": (CommandType.SET_TARGET, target),
+    }
+    command_type, value = button_commands[triggered[0]["prop_id"].split(".")[0]]
+    try:
+        command_id = command_stream.send(
+            command_type, client_id=client_id or CommandStream.ALL_ACCOUNTS, value=value
+        )
+    except CommandStreamError as err:
+        return [str(err)]
+    return [f"Sent {command_type.value} {command_id}"]
+
+
+@app.callback(
+    [
+        Output("command-acks", "children")
+    ],
+    [
+        Input("interval-component", "n_intervals")
+    ]
+)
+def command_acks_update(n):
+    acks = command_stream.get_acks()
+    return [
+        [
+            html.P(
+                f"{x['client_id']} {x['type']} {x['status']} in {x['latency_ms']} ms. "
+                f"{x['message']}"
+            )
+            for x in acks
+        ]
+    ]
 
 
 @app.callback(
@@ -5,13 +5,23 @@ Created on:     29/08/22, 1:31 am
 """
 from typing import Optional
 import argparse
+import concurrent.futures
+import datetime
+import sys
 import traceback
 
 from src import BASE_DIR
 from src.market_feeds.market_feeds import MarketFeeds
+from src.market_feeds.supervisor import FeedSupervisor
+from src.market_feeds.readiness import FEED_READY_KEY
+from src.process_supervisor.process_supervisor import ProcessSupervisor
+from src.metrics import MetricsServer
+from src.profiler import SamplingProfiler
 from src.strategies.strategy1 import Strategy1
+from src.strategies.strategy_config import StrategyConfigWatcher
 from src.price_monitor.price_monitor import PriceMonitor
 from src.brokerapi.angelbroking import AngelBrokingSymbolParser
+from src.brokerapi.angelbroking.feed_health import STALENESS_KEY
 from src.utils.redis_backend import RedisBackend
 from src.utils.config_reader import ConfigReader
 from src.utils.logger import LogFacade
@@ -30,6 +40,36 @@ def clean_up():
     redis_backend = RedisBackend()
     redis_backend.connect()
     redis_backend.cleanup(pattern=f"*NIFTY*")
+    redis_backend.delete(STALENESS_KEY)
+    redis_backend.delete(FEED_READY_KEY)
+    # Runtime profiler switches of the previous session
+    redis_backend.cleanup(pattern="PROFILER_*")
+
+
+def start_metrics_server(logger: LogFacade, port_key: str):
+    """
+    Serve the metrics of this process in Prometheus format if the port is in the config. The
+    process runs without metrics if the server cannot start, e.g. when the port is in use.
+    """
+    metrics_config = config.get("metrics", dict())
+    port = metrics_config.get(port_key)
+    if port is not None:
+        try:
+            MetricsServer(port=port, host=metrics_config.get("host", "127.0.0.1")).start()
+        except OSError as err:
+            logger.error(f"Unable to start the metrics server on port {port}. {err}")
+
+
+def start_profiler(name: str) -> SamplingProfiler:
+    """ Start the sampling profiler of this process. Switched at runtime by PROFILER_<NAME> """
+    profiler_config = config.get("profiler", dict())
+    profiler = SamplingProfiler(
+        name=name,
+        interval=profiler_config.get("interval_ms", 10) / 1000,
+        enabled=profiler_config.get("enabled", True)
+    )
+    profiler.start()
+    return profiler
 
 
 def run_market_feed(market_feed_logger: LogFacade, option_type: Optional[str] = None):
@@ -43,6 +83,12 @@ def run_market_feed(market_feed_logger: LogFacade, option_type: Optional[str] =
     ticker_inst = StrategyTicker.get_instance()
     ticker_inst.ticker = ticker_data["symbol"]
     ticker_inst.quantity = ticker_data["quantity"]
+    # Optional. {"index": "LTP", "options": "SNAP_QUOTE"}
+    subscription_mode = market_feeds_accounts.get("subscription_mode", {})
+    index_mode = subscription_mode.get("index", "LTP")
+    options_mode = subscription_mode.get("options", "SNAP_QUOTE")
+    # Number of strikes the ATM can move before the strike window is re-centred
+    recentre_strikes = market_feeds_accounts.get("recentre_strikes", 5)
     if option_type is None:
         market_feed_logger.info(f"Setting up market feeds for both CE or PE strikes")
         account = market_feeds_accounts["CE"]
@@ -53,6 +99,9 @@ def run_market_feed(market_feed_logger: LogFacade, option_type: Optional[str] =
             totp_key=account["totp_key"],
             symbol_parser=symbol_parser,
             only_ce_or_pe=False,
+            index_mode=index_mode,
+            options_mode=options_mode,
+            recentre_strikes=recentre_strikes
         )
         market_feeds.setup()
     else:
@@ -65,11 +114,51 @@ def run_market_feed(market_feed_logger: LogFacade, option_type: Optional[str] =
             totp_key=account["totp_key"],
             symbol_parser=symbol_parser,
             only_ce_or_pe=True,
-            option_type=option_type
+            option_type=option_type,
+            index_mode=index_mode,
+            options_mode=options_mode,
+            recentre_strikes=recentre_strikes
         )
         market_feeds.setup()
 
 
+def run_feed_supervisor(market_feed_logger: LogFacade):
+    """ Run the market feed of all the accounts from one process """
+    market_feeds_accounts = config["market_feeds"]
+    symbol_parser = AngelBrokingSymbolParser.instance()
+    now = istnow()
+    weekday = Weekdays(now.weekday())
+    strategy_config = config["strategies"][Strategy1.STRATEGY_CODE]
+    ticker_data = strategy_config["ticker"][weekday.name.lower()]
+    ticker_inst = StrategyTicker.get_instance()
+    ticker_inst.ticker = ticker_data["symbol"]
+    ticker_inst.quantity = ticker_data["quantity"]
+    subscription_mode = market_feeds_accounts.get("subscription_mode", {})
+    # Accounts are either a list or the CE and PE accounts used by run_market_feed
+    accounts = market_feeds_accounts.get("accounts")
+    if accounts is None:
+        accounts = [market_feeds_accounts[x] for x in ("CE", "PE") if x in market_feeds_accounts]
+    tickers = market_feeds_accounts.get("tickers", [ticker_inst.ticker])
+    market_feed_logger.info(
+        f"Setting up feed supervisor for {tickers} with {len(accounts)} accounts"
+    )
+    supervisor = FeedSupervisor(
+        accounts=accounts,
+        symbol_parser=symbol_parser,
+        tickers=tickers,
+        index_mode=subscription_mode.get("index", "LTP"),
+        options_mode=subscription_mode.get("options", "SNAP_QUOTE"),
+        recentre_strikes=market_feeds_accounts.get("recentre_strikes", 5),
+        max_tokens_per_connection=market_feeds_accounts.get(
+            "max_tokens_per_connection", FeedSupervisor.MAX_TOKENS_PER_CONNECTION
+        ),
+        use_asyncio=market_feeds_accounts.get("use_asyncio", False)
+    )
+    start_metrics_server(market_feed_logger, "feed_supervisor_port")
+    supervisor.setup()
+    supervisor.run()
+
+
 def run_strategy1(logger: LogFacade, dry_run: bool):
     """ Run strategy1 """
     now = istnow()
@@ -82,9 +171,24 @@ def run_strategy1(logger: LogFacade, dry_run: bool):
     ticker_inst.ticker = ticker_data["symbol"]
     ticker_inst.quantity = ticker_data["quantity"]
     bot = Bot(config=telegram_config)
-    price_monitor = PriceMonitor()
+    start_metrics_server(logger, "trading_port")
+    price_monitor_config = config.get("price_monitor", dict())
+    price_monitor = PriceMonitor(
+        trading_max_age_ms=price_monitor_config.get(
+            "trading_max_age_ms", PriceMonitor.TRADING_MAX_AGE_MS
+        ),
+        display_max_age_ms=price_monitor_config.get(
+            "display_max_age_ms", PriceMonitor.DISPLAY_MAX_AGE_MS
+        ),
+        max_exchange_lag_ms=price_monitor_config.get("max_exchange_lag_ms"),
+        publish_greeks=price_monitor_config.get("publish_greeks", False)
+    )
     price_monitor.setup()
     price_monitor.run_in_background()
+    # Typed strategy config, reloaded when the config file is modified during the session
+    config_watcher = StrategyConfigWatcher(config_path, Strategy1.STRATEGY_CODE)
+    config_watcher.start()
+    strategies = []
     for account in trading_accounts:
         meta = account["meta"]
         if Strategy1.STRATEGY_CODE not in meta["strategies"]:
@@ -93,21 +197,42 @@ def run_strategy1(logger: LogFacade, dry_run: bool):
                 f"{Strategy1.STRATEGY_CODE} is missing in meta['strategies']"
             )
             continue
+        strategy = Strategy1(
+            api_key=account["api_key"],
+            client_id=account["client_id"],
+            password=account["password"],
+            totp_key=account["totp_key"],
+            price_monitor=price_monitor,
+            config=config_watcher,
+            bot=bot,
+            dry_run=dry_run
+        )
+        strategies.append((account, strategy))
+    # Commands left from the previous process are reported as not delivered
+    for account, strategy in strategies:
+        try:
+            strategy.skip_command_backlog()
+        except Exception as err:
+            logger.error(f"Unable to skip the command backlog of {account['client_id']}")
+            logger.error(err)
+    # Login and prefetch for all the accounts concurrently before the entry time. A strategy whose
+    # warm up fails does the setup again when it is executed.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(strategies), 1)) as executor:
+        futures = {executor.submit(x.warm_up): y for y, x in strategies}
+        for future in concurrent.futures.as_completed(futures):
+            account = futures[future]
+            try:
+                future.result()
+            except Exception as err:
+                logger.error(f"Warm up failed for client id {account['client_id']}")
+                logger.error(err)
+    for account, strategy in strategies:
+        meta = account["meta"]
         logger.info(
             f"Running {Strategy1.STRATEGY_CODE} for account {meta['name']} with client id "
             f"{account['client_id']}"
         )
         try:
-            strategy = Strategy1(
-                api_key=account["api_key"],
-                client_id=account["client_id"],
-                password=account["password"],
-                totp_key=account["totp_key"],
-                price_monitor=price_monitor,
-                config=strategy_config,
-                bot=bot,
-                dry_run=dry_run
-            )
             strategy.execute()
         except Exception as err:
             logger.error(
@@ -119,24 +244,74 @@ def run_strategy1(logger: LogFacade, dry_run: bool):
     # Stopping price monitor. Else it will trigger straddle shift
     # Check this logic when implementing multiple trading accounts
     price_monitor.stop_monitor = True
+    config_watcher.stop()
+    # Notifications are sent in the background. Send the queued ones before exiting.
+    bot.flush()
+
+
+def run_process_supervisor(logger: LogFacade, dry_run: bool, profile: bool = False):
+    """ Run clean up, the feed supervisor and trading as child processes for the day """
+    supervisor_config = config.get("process_supervisor", dict())
+    main_file = str(BASE_DIR / "main.py")
+    trading_args = [sys.executable, main_file, "--trading"]
+    feed_args = [sys.executable, main_file, "--feed-supervisor"]
+    if dry_run:
+        trading_args.append("--dry-run")
+    if profile:
+        trading_args.append("--profile")
+        feed_args.append("--profile")
+    clean_up()
+    logger.info(f"Starting process supervisor")
+    supervisor = ProcessSupervisor(
+        feed_args=feed_args,
+        trading_args=trading_args,
+        ready_timeout=supervisor_config.get("ready_timeout_sec", 600),
+        max_restarts=supervisor_config.get("max_restarts", 5),
+        restart_delay=supervisor_config.get("restart_delay_sec", 5),
+        trading_restart_end_time=supervisor_config.get(
+            "trading_restart_end_time", datetime.time(hour=9, minute=15)
+        )
+    )
+    supervisor.run()
 
 
 def main():
     """ Main function """
     parser = argparse.ArgumentParser()
     parser.add_argument("--market-feeds", action="store_true")
+    parser.add_argument(
+        "--feed-supervisor",
+        action="store_true",
+        help="Run market feeds of all the accounts from one process"
+    )
     parser.add_argument("--trading", action="store_true")
+    parser.add_argument(
+        "--supervisor",
+        action="store_true",
+        help="Run clean up, feed supervisor and trading for the day as child processes"
+    )
     parser.add_argument("--dry-run", action="store_true")
     parser.add_argument("--clean-up", action="store_true")
     parser.add_argument("--option-type", type=str, help="Use for market feeds to get strike data")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run the sampling profiler in the trading and feed supervisor processes"
+    )
     args = parser.parse_args()
     if args.trading:
         trading_logger: LogFacade = LogFacade.get_logger("trading_main")
+        profiler = start_profiler("trading") if args.profile else None
         try:
             run_strategy1(logger=trading_logger, dry_run=args.dry_run)
         except Exception as err:
             trading_logger.error(err)
             trading_logger.exception(traceback.print_exc())
+            # Non-zero exit code so that the process supervisor sees a crash and restarts it
+            sys.exit(1)
+        finally:
+            if profiler is not None:
+                profiler.stop()
     if args.market_feeds:
         if args.option_type == "CE":
             market_feed_logger: LogFacade = LogFacade.get_logger("ce_market_feed_main")
@@ -149,10 +324,37 @@ def main():
         except Exception as err:
             market_feed_logger.error(err)
             market_feed_logger.exception(traceback.print_exc())
+            # Non-zero exit code so that the process supervisor sees a crash and restarts it
+            sys.exit(1)
+
+    if args.feed_supervisor:
+        market_feed_logger: LogFacade = LogFacade.get_logger("feed_supervisor_main")
+        profiler = start_profiler("feed_supervisor") if args.profile else None
+        try:
+            run_feed_supervisor(market_feed_logger)
+        except Exception as err:
+            market_feed_logger.error(err)
+            market_feed_logger.exception(traceback.print_exc())
+            # Non-zero exit code so that the process supervisor sees a crash and restarts it
+            sys.exit(1)
+        finally:
+            if profiler is not None:
+                profiler.stop()
 
     if args.clean_up:
         clean_up()
 
+    if args.supervisor:
+        supervisor_logger: LogFacade = LogFacade.get_logger("process_supervisor_main")
+        try:
+            run_process_supervisor(
+                logger=supervisor_logger, dry_run=args.dry_run, profile=args.profile
+            )
+        except Exception as err:
+            supervisor_logger.error(err)
+            supervisor_logger.exception(traceback.print_exc())
+            sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -3,5 +3,5 @@ File:           __init__.py
 Author:         Dibyaranjan Sathua
 Created on:     05/08/22, 9:45 pm
 """
-from .api import AngelBrokingApi, AngelBrokingMarketFeed, AngelBrokingSymbolParser, \
-    TokenSymbolMapper
+from .api import AngelBrokingApi, AngelBrokingMarketFeed, AsyncAngelBrokingMarketFeed, \
+    AngelBrokingSymbolParser, TokenSymbolMapper
@@ -3,25 +3,43 @@ File:           api.py
 Author:         Dibyaranjan Sathua
 Created on:     05/08/22, 9:52 pm
 """
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Callable, Tuple
+import asyncio
 import datetime
+import os
 import time
 import enum
+import json
 import traceback
+from urllib.parse import urljoin
 
 import requests
 import pyotp
 from SmartApi import SmartConnect, SmartWebSocket as SmartWebSocket_
-from SmartApi.smartWebSocketV2 import SmartWebSocketV2
+from SmartApi import smartExceptions as smart_exceptions
 
 from src.brokerapi.base_api import BaseApi, BrokerApiError, BrokerOrderApiError
-# from src.brokerapi.angelbroking.websocketv2 import SmartWebSocketV2
+from src.brokerapi.angelbroking.websocketv2 import SmartWebSocketV2
+from src.brokerapi.angelbroking.async_websocket import AsyncSmartWebSocket
+from src.brokerapi.angelbroking.feed_health import FeedHealth
+from src.market_feeds.tick_events import TICK_CHANNEL_PREFIX, get_tick_channel
+from src.metrics import MetricsRegistry
 from src.strategies.instrument import Instrument, Action
-from src.utils.redis_backend import RedisBackend
+from src.utils.redis_backend import RedisBackend, AsyncRedisBackend
 from src.utils.logger import LogFacade
 
 
 logger: LogFacade = LogFacade.get_logger("angelbroking_api")
+metrics: MetricsRegistry = MetricsRegistry.get_instance()
+FEED_TICKS = metrics.counter("feed_ticks", "Ticks saved to redis", ("client_id",))
+REDIS_WRITE_SECONDS = metrics.histogram(
+    "feed_redis_write_seconds", "Time to write a tick (or a batch of ticks) to redis"
+)
+ORDER_SECONDS = metrics.histogram(
+    "order_latency_seconds", "Time from the order call to the broker response"
+)
+ORDER_RETRIES = metrics.counter("order_retries", "Failed order attempts that were retried")
+ORDER_FAILURES = metrics.counter("order_failures", "Orders failed after all the attempts")
 
 
 class SmartWebSocket(SmartWebSocket_):
@@ -33,6 +51,67 @@ class SmartWebSocket(SmartWebSocket_):
         self._on_close(ws)
 
 
+class PooledSmartConnect(SmartConnect):
+    """
+    SmartConnect sends every REST call with requests.request, which opens a new TCP and TLS
+    connection each time even when a pool is passed. Override _request to send the calls on a
+    persistent keep-alive session of the account.
+    """
+    # An account has at most 4 legs (straddle and hedges) to place at a time
+    POOL_MAXSIZE = 4
+
+    def __init__(self, pool_maxsize: int = POOL_MAXSIZE, **kwargs):
+        super(PooledSmartConnect, self).__init__(**kwargs)
+        self.reqsession = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize, pool_block=False
+        )
+        self.reqsession.mount("https://", adapter)
+        self.reqsession.mount("http://", adapter)
+
+    def _request(self, route, method, parameters=None):
+        """ Same as SmartConnect._request but on the persistent session """
+        params = parameters.copy() if parameters else {}
+        url = urljoin(self.root, self._routes[route].format(**params))
+        headers = self.requestHeaders()
+        if self.access_token:
+            headers["Authorization"] = f"Bearer {self.access_token}"
+        response = self.reqsession.request(
+            method,
+            url,
+            data=json.dumps(params) if method in ["POST", "PUT"] else None,
+            params=json.dumps(params) if method in ["GET", "DELETE"] else None,
+            headers=headers,
+            verify=not self.disable_ssl,
+            allow_redirects=True,
+            timeout=self.timeout,
+            proxies=self.proxies
+        )
+        if "json" in headers["Content-type"]:
+            try:
+                data = json.loads(response.content.decode("utf8"))
+            except ValueError:
+                raise smart_exceptions.DataException(
+                    f"Couldn't parse the JSON response received from the server: "
+                    f"{response.content}"
+                )
+            if data.get("error_type"):
+                if self.session_expiry_hook and response.status_code == 403 and \
+                        data["error_type"] == "TokenException":
+                    self.session_expiry_hook()
+                exception_class = getattr(
+                    smart_exceptions, data["error_type"], smart_exceptions.GeneralException
+                )
+                raise exception_class(data["message"], code=response.status_code)
+            return data
+        elif "csv" in headers["Content-type"]:
+            return response.content
+        raise smart_exceptions.DataException(
+            f"Unknown Content-type ({headers['Content-type']}) with response: "
+            f"({response.content})"
+        )
+
+
 class OrderConstants:
     """ Constants used while placing the order """
     class Variety(enum.Enum):
@@ -69,6 +148,42 @@ class OrderConstants:
         MCX = "MCX"
 
 
+class OrderTemplateCache:
+    """
+    Ready to send intraday options order payloads of a login session keyed by
+    (symbol, transaction type, quantity). The symbol resolution and the enum to string
+    conversions are done once per key, so placing an order is a lookup followed by the send.
+    """
+
+    def __init__(self):
+        self._templates: Dict[Tuple[str, str, int], Dict] = dict()
+
+    def get(self, symbol: str, action: str, quantity: int) -> Optional[Dict]:
+        return self._templates.get((symbol, action, quantity))
+
+    def add(self, symbol_data: Dict, symbol: str, action: str, quantity: int) -> Dict:
+        """ Build the payload. SmartConnect sends it as is, so it can be reused for each order """
+        template = {
+            "tradingsymbol": symbol_data["symbol"],
+            "symboltoken": symbol_data["token"],
+            "exchange": OrderConstants.Exchange.NFO.value,
+            "transactiontype": action,
+            "ordertype": OrderConstants.OrderType.MARKET.value,
+            "quantity": quantity,
+            "producttype": OrderConstants.ProductType.INTRADAY.value,
+            "variety": OrderConstants.Variety.NORMAL.value,
+            "duration": OrderConstants.Duration.DAY.value,
+        }
+        self._templates[(symbol, action, quantity)] = template
+        return template
+
+    def clear(self) -> None:
+        self._templates.clear()
+
+    def __len__(self):
+        return len(self._templates)
+
+
 class AngelBrokingApi(BaseApi):
     """ Class containing methods for connecting to AngelBroking API """
 
@@ -77,12 +192,19 @@ class AngelBrokingApi(BaseApi):
         self._client_id = client_id
         self._password = password
         self._totp_key = totp_key
-        self._smart_connect = SmartConnect(api_key=self._api_key)
+        # ANGELBROKING_API_ROOT points the API to a different host such as the broker simulator
+        self._smart_connect = PooledSmartConnect(
+            api_key=self._api_key, root=os.environ.get("ANGELBROKING_API_ROOT")
+        )
         self._refresh_token: Optional[str] = None
         self._access_token: Optional[str] = None
         self._feed_token: Optional[str] = None
         self._market_feeds: Optional[AngelBrokingMarketFeed] = None
         self._symbol_parser: Optional[AngelBrokingSymbolParser] = None
+        # Cache of (ticker, strike, expiry, option_type) -> broker symbol data. The symbol parser
+        # scans every instrument of the ticker for a lookup.
+        self._symbol_data_cache: Dict[Tuple, Dict] = dict()
+        self._order_templates = OrderTemplateCache()
 
     def login(self):
         """ Login to smart API """
@@ -115,8 +237,19 @@ class AngelBrokingApi(BaseApi):
         self._refresh_token = response["data"]["refreshToken"]
         self._feed_token = self._smart_connect.getfeedToken()
         self._symbol_parser = AngelBrokingSymbolParser.instance()
+        self._order_templates.clear()
         logger.info(f"Login successful")
 
+    def warm_connection(self) -> None:
+        """
+        Make a cheap call (RMS limits) so that the keep-alive connection is open before latency
+        sensitive calls like the entry orders
+        """
+        try:
+            self._smart_connect.rmsLimit()
+        except Exception as err:
+            logger.warning(f"Error warming up the connection to AngelBroking API: {err}")
+
     def get_user_profile(self):
         """ Return user profile """
         response = self._smart_connect.getProfile(self._refresh_token)
@@ -149,40 +282,32 @@ class AngelBrokingApi(BaseApi):
         assert 'data' in response, "data attribute is missing in SmartAPI"
         return response["data"]
 
-    def setup_market_feeds(self):
-        """ Setup market feeds """
-        self._market_feeds = AngelBrokingMarketFeed(
+    def setup_market_feeds(self, use_asyncio: bool = False):
+        """ Setup market feeds. use_asyncio runs the feed on the asyncio websocket client """
+        market_feed_class = AsyncAngelBrokingMarketFeed if use_asyncio else AngelBrokingMarketFeed
+        self._market_feeds = market_feed_class(
             api_key=self._api_key,
             auth_token=self._access_token,
             feed_token=self._feed_token,
             client_id=self._client_id
         )
+        # REST api is used to backfill prices after the websocket reconnects
+        self._market_feeds.rest_api = self
         self._market_feeds.setup()
         # self._market_feeds.connect()
 
     def place_intraday_options_order(self, instrument: Instrument):
         """ Place intraday options order, Return True if order placed successfully else False """
-        # Get the symbol details such as trading symbol and symbol token
-        symbol_data = self.get_symbol_data(instrument)
-        action = OrderConstants.TransactionType.BUY.value if instrument.action == Action.BUY \
-            else OrderConstants.TransactionType.SELL.value
+        orderparams = self.get_order_template(instrument)
+        action = orderparams["transactiontype"]
         logger.info(f"Placing intraday {action} order for {instrument}")
-        orderparams = {
-            "tradingsymbol": symbol_data["symbol"],
-            "symboltoken": symbol_data["token"],
-            "exchange": OrderConstants.Exchange.NFO.value,
-            "transactiontype": action,
-            "ordertype": OrderConstants.OrderType.MARKET.value,
-            "quantity": instrument.lot_size,
-            "producttype": OrderConstants.ProductType.INTRADAY.value,
-            "variety": OrderConstants.Variety.NORMAL.value,
-            "duration": "DAY",
-        }
         attempt = 3
         while attempt > 0:
             response = None
             try:
+                start = time.perf_counter()
                 response = self._smart_connect.placeOrder(orderparams=orderparams)
+                ORDER_SECONDS.observe(time.perf_counter() - start)
                 logger.info(f"Order Parameters: {orderparams}")
                 logger.info(f"Order Response: {response}")
                 instrument.order_id = response
@@ -202,25 +327,43 @@ class AngelBrokingApi(BaseApi):
                 logger.error(err)
                 logger.exception(traceback.print_exc())
             attempt -= 1
+            ORDER_RETRIES.inc()
             logger.warning(f"Order Failed. Trying again after 2 sec. Attempt left {attempt}")
             if response is not None and type(response) == dict and \
                     response.get('message') is not None:
                 logger.error(response['message'])
             time.sleep(2)
         else:
+            ORDER_FAILURES.inc()
             raise BrokerOrderApiError(
                 f"Error placing order to AngelBroking API."
             )
 
+    def get_order_template(self, instrument: Instrument) -> Dict:
+        """ Ready to send order payload of the instrument. Built on the first call for a key """
+        symbol = instrument.symbol
+        action = OrderConstants.TransactionType.BUY.value if instrument.action == Action.BUY \
+            else OrderConstants.TransactionType.SELL.value
+        template = self._order_templates.get(symbol, action, instrument.lot_size)
+        if template is None:
+            # Get the symbol details such as trading symbol and symbol token
+            template = self._order_templates.add(
+                self.get_symbol_data(instrument), symbol, action, instrument.lot_size
+            )
+        return template
+
     def get_symbol_data(self, instrument: Instrument):
         """ Get the broker symbol data """
-        data = self._symbol_parser.get_symbol_data(
-            ticker=instrument.index,
-            strike=instrument.strike,
-            expiry=instrument.expiry,
-            option_type=instrument.option_type
-        )
-        return {"symbol": data["symbol"], "token": data["token"]}
+        key = (instrument.index, instrument.strike, instrument.expiry, instrument.option_type)
+        if key not in self._symbol_data_cache:
+            data = self._symbol_parser.get_symbol_data(
+                ticker=instrument.index,
+                strike=instrument.strike,
+                expiry=instrument.expiry,
+                option_type=instrument.option_type
+            )
+            self._symbol_data_cache[key] = {"symbol": data["symbol"], "token": data["token"]}
+        return self._symbol_data_cache[key]
 
     def get_order_book(self) -> list:
         """ Return order book data """
@@ -260,9 +403,22 @@ class AngelBrokingMarketFeed:
         self._web_socket: Optional[SmartWebSocketV2] = None
         self._options_tokens = []
         self._index_tokens = []
+        # Subscription mode for each token group. Index only needs LTP whereas the traded strikes
+        # are subscribed in SNAP_QUOTE mode to get the best 5 bid and ask.
+        self._index_mode: int = SmartWebSocketV2.LTP_MODE
+        self._options_mode: int = SmartWebSocketV2.SNAP_QUOTE
         self._token_subscribed = []
         self._token_symbol_mapper = TokenSymbolMapper()
         self._redis_backend = RedisBackend()
+        # Called with the index token and ltp on every index tick. Used to re-centre the strike
+        # window.
+        self._on_index_tick: Optional[Callable[[str, float], None]] = None
+        # Ticks of unsubscribed tokens which are still in flight are not saved
+        self._active_tokens = set()
+        # Sequence numbers, stale symbols and backfill after reconnect
+        self._feed_health = FeedHealth(client_id=client_id)
+        self._rest_api: Optional[AngelBrokingApi] = None
+        self._ticks_metric = FEED_TICKS.labels(client_id)
 
     def setup(self):
         """ Setup websocket """
@@ -270,15 +426,20 @@ class AngelBrokingMarketFeed:
         self._web_socket = SmartWebSocketV2(
             self._auth_token, self._api_key, self._client_id, self._feed_token
         )
+        ws_uri = os.environ.get("ANGELBROKING_WS_URI")
+        if ws_uri:
+            self._web_socket.ROOT_URI = ws_uri
         self._web_socket.on_open = self.on_open
         self._web_socket.on_data = self.on_data
         self._web_socket.on_error = self.on_error
         self._web_socket.on_close = self.on_close
+        self._web_socket.on_reconnect = self.on_reconnect
 
     def connect(self):
         """ Connect to websocket """
         # Connect to redis backend
         self._redis_backend.connect()
+        self._feed_health.connect()
         self._web_socket.connect()
 
     def subscribe(self):
@@ -296,15 +457,12 @@ class AngelBrokingMarketFeed:
             3 -> Snap Quote
         """
         correlation_id = "sathualabs"
-        mode = 1
-        script = self.get_script()
-        # script = [{"exchangeType": 1, "tokens": ["26009"]}]
-        if script:
-            print(f"Subscribing script: {script}")
+        for mode, script in self.get_script_by_mode().items():
+            mode_name = SmartWebSocketV2.SUBSCRIPTION_MODE_MAP[mode]
+            print(f"Subscribing script in {mode_name} mode: {script}")
             self._web_socket.subscribe(correlation_id, mode, script)
 
     def on_data(self, ws, message):
-        print(f"Ticks: {message}")
         self.parse_save(message)
 
     def on_open(self, ws):
@@ -317,25 +475,142 @@ class AngelBrokingMarketFeed:
 
     def on_close(self, ws):
         print("On Close")
+        self._feed_health.on_disconnect(self.get_active_symbols())
+
+    def on_reconnect(self, ws):
+        self._feed_health.on_reconnect(self.backfill if self._rest_api is not None else None)
+
+    def backfill(self, token: str, symbol: str) -> Optional[dict]:
+        """ Return the redis value of the token from the REST ltp api """
+        if token not in self._active_tokens:
+            return None
+        if token in self._index_tokens:
+            trading_symbol = AngelBrokingSymbolParser.INDEX_TRADING_SYMBOL.get(symbol, symbol)
+            data = self._rest_api.get_ltp_data(trading_symbol, token, exchange="NSE")
+        else:
+            data = self._rest_api.get_ltp_data(symbol, token, exchange="NFO")
+        return FeedHealth.get_symbol_data(data["ltp"], token)
+
+    def get_active_symbols(self) -> Dict[str, str]:
+        """ Subscribed token -> redis key """
+        return {x: self._token_symbol_mapper[x] for x in self._active_tokens}
 
     def parse_save(self, message) -> None:
         """ Parse the market websocket message and save it to redis backend """
+        parsed = self.parse(message)
+        if parsed is not None:
+            symbol, symbol_data = parsed
+            start = time.perf_counter()
+            # Publish the tick so that the strategy loop wakes up on it instead of polling
+            self._redis_backend.set_and_publish(symbol, symbol_data, get_tick_channel(symbol))
+            REDIS_WRITE_SECONDS.observe(time.perf_counter() - start)
+            self._ticks_metric.inc()
+            if self._on_index_tick is not None and message["token"] in self._index_tokens:
+                self._on_index_tick(message["token"], symbol_data["ltp"])
+
+    def parse(self, message) -> Optional[Tuple[str, dict]]:
+        """ Return the redis key and value for the market websocket message """
         if type(message) == dict:
             if "token" in message and "last_traded_price" in message:
+                if message["token"] not in self._active_tokens:
+                    return None
+                if not self._feed_health.on_tick(message["token"], message["sequence_number"]):
+                    return None
                 symbol = self._token_symbol_mapper[message["token"]]
                 # Redis. Key is symbol in format <NIFTY><DD><MON><YY><STRIKE><OPTIONTYPE>
                 # NIFTY25AUG2217000CE and value is dict
+                # exchange_timestamp and received_at are epoch milliseconds. timestamp (epoch
+                # seconds) is kept for the readers of the old format.
+                received_at = int(time.time() * 1000)
                 symbol_data = {
                     "token": message["token"],
                     "ltp": float(message["last_traded_price"]/100),
-                    "timestamp": int(datetime.datetime.now().timestamp())
+                    "timestamp": received_at // 1000,
+                    "received_at": received_at,
+                    "exchange_timestamp": message.get("exchange_timestamp")
                 }
-                self._redis_backend.set(symbol, symbol_data)
+                if "best_5_buy_data" in message:
+                    self.add_depth(symbol_data, message)
+                return symbol, symbol_data
+        return None
+
+    def update_options_tokens(self, subscribe: List[str], unsubscribe: List[str]) -> None:
+        """
+        Incrementally change the option subscription. Unsubscribed tokens are removed from redis
+        so that the price monitor never picks a strike whose price is no longer updated. Held
+        symbols are never unsubscribed by the feed supervisor.
+        """
+        self._update_subscription(
+            self._options_mode, SmartWebSocketV2.NSE_FO, subscribe, unsubscribe, options=True
+        )
+
+    def update_index_tokens(self, subscribe: List[str], unsubscribe: List[str]) -> None:
+        """ Incrementally change the index subscription """
+        self._update_subscription(
+            self._index_mode, SmartWebSocketV2.NSE_CM, subscribe, unsubscribe, options=False
+        )
+
+    def _update_subscription(
+            self,
+            mode: int,
+            exchange_type: int,
+            subscribe: List[str],
+            unsubscribe: List[str],
+            options: bool
+    ) -> None:
+        tokens = self._options_tokens if options else self._index_tokens
+        if unsubscribe:
+            removed = set(unsubscribe)
+            tokens = [x for x in tokens if x not in removed]
+        tokens = tokens + [x for x in subscribe if x not in tokens]
+        if options:
+            self.options_tokens = tokens
+        else:
+            self.index_tokens = tokens
+        if unsubscribe:
+            self._feed_health.on_unsubscribe({x: self._token_symbol_mapper[x] for x in unsubscribe})
+        self._send_subscription(mode, exchange_type, subscribe, unsubscribe)
+        logger.info(
+            f"{'Option' if options else 'Index'} subscription updated. "
+            f"Subscribed: {len(subscribe)}, Unsubscribed: {len(unsubscribe)}, "
+            f"Total: {len(tokens)}"
+        )
+
+    def _send_subscription(
+            self, mode: int, exchange_type: int, subscribe: List[str], unsubscribe: List[str]
+    ) -> None:
+        correlation_id = "sathualabs"
+        if unsubscribe:
+            self._web_socket.unsubscribe(
+                correlation_id, mode, [{"exchangeType": exchange_type, "tokens": unsubscribe}]
+            )
+            for token in unsubscribe:
+                self._redis_backend.delete(self._token_symbol_mapper[token])
+        if subscribe:
+            self._web_socket.subscribe(
+                correlation_id, mode, [{"exchangeType": exchange_type, "tokens": subscribe}]
+            )
+
+    @staticmethod
+    def add_depth(symbol_data: dict, message: dict) -> None:
+        """
+        Add best bid, best ask and the 5 level depth from a SNAP_QUOTE message. Depth is stored
+        as [price, quantity] pairs to keep the redis value small. Empty levels are dropped.
+        """
+        bids = [
+            [x["price"] / 100, x["quantity"]] for x in message["best_5_buy_data"] if x["price"]
+        ]
+        asks = [
+            [x["price"] / 100, x["quantity"]] for x in message["best_5_sell_data"] if x["price"]
+        ]
+        symbol_data["bid"] = bids[0][0] if bids else None
+        symbol_data["ask"] = asks[0][0] if asks else None
+        symbol_data["depth"] = {"bids": bids, "asks": asks}
 
     def get_option_script(self) -> dict:
         output = {}
         if self._options_tokens:
-            output = {"exchangeType": 2, "tokens": self._options_tokens}
+            output = {"exchangeType": SmartWebSocketV2.NSE_FO, "tokens": self._options_tokens}
         return output
 
     def get_index_script(self) -> dict:
@@ -358,7 +633,7 @@ class AngelBrokingMarketFeed:
         """
         output = {}
         if self._index_tokens:
-            output = {"exchangeType": 1, "tokens": self._index_tokens}
+            output = {"exchangeType": SmartWebSocketV2.NSE_CM, "tokens": self._index_tokens}
         return output
 
     def get_script(self) -> list:
@@ -371,6 +646,25 @@ class AngelBrokingMarketFeed:
             output.append(option_script)
         return output
 
+    def get_script_by_mode(self) -> Dict[int, list]:
+        """ Group the scripts by subscription mode as one subscribe request takes one mode """
+        output: Dict[int, list] = dict()
+        index_script = self.get_index_script()
+        option_script = self.get_option_script()
+        if index_script:
+            output.setdefault(self._index_mode, []).append(index_script)
+        if option_script:
+            output.setdefault(self._options_mode, []).append(option_script)
+        return output
+
+    @staticmethod
+    def get_mode(mode_name: str) -> int:
+        """ Convert subscription mode name LTP, QUOTE or SNAP_QUOTE to websocket mode """
+        for mode, name in SmartWebSocketV2.SUBSCRIPTION_MODE_MAP.items():
+            if name == mode_name.upper():
+                return mode
+        raise ValueError(f"Invalid subscription mode {mode_name}")
+
     @property
     def index_tokens(self) -> List:
         return self._index_tokens
@@ -378,6 +672,7 @@ class AngelBrokingMarketFeed:
     @index_tokens.setter
     def index_tokens(self, tokens: List) -> None:
         self._index_tokens = tokens
+        self._active_tokens = set(self._index_tokens) | set(self._options_tokens)
 
     @property
     def options_tokens(self) -> List:
@@ -386,11 +681,165 @@ class AngelBrokingMarketFeed:
     @options_tokens.setter
     def options_tokens(self, tokens: List) -> None:
         self._options_tokens = tokens
+        self._active_tokens = set(self._index_tokens) | set(self._options_tokens)
+
+    @property
+    def index_mode(self) -> int:
+        return self._index_mode
+
+    @index_mode.setter
+    def index_mode(self, mode: int) -> None:
+        self._index_mode = mode
+
+    @property
+    def options_mode(self) -> int:
+        return self._options_mode
+
+    @options_mode.setter
+    def options_mode(self, mode: int) -> None:
+        self._options_mode = mode
+
+    @property
+    def rest_api(self) -> Optional["AngelBrokingApi"]:
+        return self._rest_api
+
+    @rest_api.setter
+    def rest_api(self, api: Optional["AngelBrokingApi"]) -> None:
+        self._rest_api = api
+
+    @property
+    def feed_health(self) -> FeedHealth:
+        return self._feed_health
+
+    @property
+    def on_index_tick(self) -> Optional[Callable[[str, float], None]]:
+        return self._on_index_tick
+
+    @on_index_tick.setter
+    def on_index_tick(self, callback: Optional[Callable[[str, float], None]]) -> None:
+        self._on_index_tick = callback
+
+
+class AsyncAngelBrokingMarketFeed(AngelBrokingMarketFeed):
+    """
+    Market feed on the asyncio SmartStream client. Ticks are kept in a pending dict by symbol and
+    a writer task saves them to redis with one MSET, so a burst of ticks for the same symbol is
+    written once with the latest value.
+    """
+
+    def __init__(self, api_key: str, auth_token: str, feed_token: str, client_id: str):
+        super(AsyncAngelBrokingMarketFeed, self).__init__(
+            api_key=api_key, auth_token=auth_token, feed_token=feed_token, client_id=client_id
+        )
+        self._web_socket: Optional[AsyncSmartWebSocket] = None
+        self._redis_backend = AsyncRedisBackend()
+        self._pending: Dict[str, dict] = dict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._has_pending: Optional[asyncio.Event] = None
+
+    def setup(self):
+        """ Setup websocket """
+        self._web_socket = AsyncSmartWebSocket(
+            self._auth_token, self._api_key, self._client_id, self._feed_token
+        )
+        ws_uri = os.environ.get("ANGELBROKING_WS_URI")
+        if ws_uri:
+            self._web_socket.ROOT_URI = ws_uri
+        self._web_socket.on_open = self.on_open
+        self._web_socket.on_data = self.on_data
+        self._web_socket.on_error = self.on_error
+        self._web_socket.on_close = self.on_close
+        self._web_socket.on_reconnect = self.on_reconnect
+
+    async def connect(self):
+        """ Connect to websocket and run the redis writer until the websocket is closed """
+        self._loop = asyncio.get_running_loop()
+        self._has_pending = asyncio.Event()
+        self._redis_backend.connect()
+        self._feed_health.connect()
+        writer = asyncio.create_task(self.write())
+        try:
+            await self._web_socket.run()
+        finally:
+            writer.cancel()
+            await self.flush()
+            await self._redis_backend.close()
+
+    async def subscribe(self):
+        correlation_id = "sathualabs"
+        for mode, script in self.get_script_by_mode().items():
+            mode_name = SmartWebSocketV2.SUBSCRIPTION_MODE_MAP[mode]
+            logger.info(f"Subscribing {self._client_id} script in {mode_name} mode")
+            await self._web_socket.subscribe(correlation_id, mode, script)
+
+    async def on_open(self, ws):
+        logger.info(f"Websocket opened for {self._client_id}")
+        await self.subscribe()
+
+    def parse_save(self, message) -> None:
+        """ Parse the market websocket message and queue it for the redis writer """
+        parsed = self.parse(message)
+        if parsed is not None:
+            symbol, symbol_data = parsed
+            self._pending[symbol] = symbol_data
+            self._has_pending.set()
+            self._ticks_metric.inc()
+            if self._on_index_tick is not None and message["token"] in self._index_tokens:
+                self._on_index_tick(message["token"], symbol_data["ltp"])
+
+    async def write(self):
+        """ Write the pending ticks to redis """
+        while True:
+            await self._has_pending.wait()
+            await self.flush()
+
+    async def flush(self):
+        self._has_pending.clear()
+        if self._pending:
+            pending, self._pending = self._pending, dict()
+            start = time.perf_counter()
+            await self._redis_backend.set_many(pending, channel_prefix=TICK_CHANNEL_PREFIX)
+            REDIS_WRITE_SECONDS.observe(time.perf_counter() - start)
+
+    def _send_subscription(
+            self, mode: int, exchange_type: int, subscribe: List[str], unsubscribe: List[str]
+    ) -> None:
+        """ Can be called from any thread. The websocket requests run on the event loop """
+        coroutine = self._async_send_subscription(mode, exchange_type, subscribe, unsubscribe)
+        if self._loop is None:
+            # Not connected yet. Tokens are subscribed when the websocket opens
+            coroutine.close()
+            return
+        asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    async def _async_send_subscription(
+            self, mode: int, exchange_type: int, subscribe: List[str], unsubscribe: List[str]
+    ) -> None:
+        correlation_id = "sathualabs"
+        if unsubscribe:
+            await self._web_socket.unsubscribe(
+                correlation_id, mode, [{"exchangeType": exchange_type, "tokens": unsubscribe}]
+            )
+            for token in unsubscribe:
+                symbol = self._token_symbol_mapper[token]
+                self._pending.pop(symbol, None)
+                await self._redis_backend.delete(symbol)
+        if subscribe:
+            await self._web_socket.subscribe(
+                correlation_id, mode, [{"exchangeType": exchange_type, "tokens": subscribe}]
+            )
+
+    async def close(self):
+        await self._web_socket.close_connection()
 
 
 class AngelBrokingSymbolParser:
     """ Angel broking symbol parsing """
     DATE_FORMAT: str = "%d%b%Y"
+    # Index trading symbol used for ltp api
+    INDEX_TRADING_SYMBOL = {
+        "NIFTY": "NIFTY", "BANKNIFTY": "Nifty Bank", "FINNIFTY": "Nifty Fin Service"
+    }
     __instance: Optional["AngelBrokingSymbolParser"] = None
 
     def __init__(self):
@@ -513,8 +962,10 @@ class AngelBrokingSymbolParser:
 
     @property
     def symbol_master_file(self) -> str:
-        return "https://margincalculator.angelbroking.com/OpenAPI_File/files/" \
-               "OpenAPIScripMaster.json"
+        return os.environ.get(
+            "ANGELBROKING_SCRIP_MASTER_URL",
+            "https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json"
+        )
 
 
 class TokenSymbolMapper:
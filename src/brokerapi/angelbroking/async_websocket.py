@@ -0,0 +1,130 @@
+"""
+File:           async_websocket.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 6:10 pm
+"""
+from typing import Optional
+import asyncio
+import json
+
+import websockets
+
+from src.brokerapi.angelbroking.websocketv2 import SmartWebSocketV2
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("async_websocket")
+
+
+class AsyncSmartWebSocket(SmartWebSocketV2):
+    """
+    Asyncio SmartStream client. Several clients can run in one event loop instead of one
+    run_forever thread (plus callback threads) per connection. The subscription bookkeeping and
+    the binary decoder are shared with SmartWebSocketV2.
+    on_open is a coroutine. on_data, on_reconnect, on_error and on_close are called from the event
+    loop and should not block.
+    """
+    def __init__(self, auth_token, api_key, client_code, feed_token):
+        super(AsyncSmartWebSocket, self).__init__(auth_token, api_key, client_code, feed_token)
+        self._websocket: Optional[websockets.WebSocketClientProtocol] = None
+        self._stop = False
+
+    async def run(self):
+        """
+        Connect and receive until closed. Reconnect with exponential backoff till
+        MAX_RETRY_ATTEMPT reconnects in a row fail.
+        """
+        while not self._stop:
+            try:
+                await self.connect()
+            except (websockets.WebSocketException, OSError, asyncio.TimeoutError) as err:
+                self.on_error(self._websocket, err)
+            self.on_close(self._websocket)
+            if self._stop or self.current_retry_attempt >= self.MAX_RETRY_ATTEMPT:
+                break
+            delay = self.get_retry_delay()
+            self.current_retry_attempt += 1
+            logger.info(f"Attempting to resubscribe/reconnect in {delay:.1f} sec")
+            await asyncio.sleep(delay)
+
+    async def connect(self):
+        """ Make the web socket connection and receive the messages till the socket closes """
+        headers = {
+            "Authorization": self.auth_token,
+            "x-api-key": self.api_key,
+            "x-client-code": self.client_code,
+            "x-feed-token": self.feed_token
+        }
+        # SmartStream expects the text heartbeat, so websocket ping frames are disabled
+        async with websockets.connect(
+                self.ROOT_URI, extra_headers=headers, ping_interval=None, max_size=None
+        ) as websocket:
+            self._websocket = websocket
+            self.current_retry_attempt = 0
+            heartbeat = asyncio.create_task(self._heartbeat())
+            try:
+                if self.RESUBSCRIBE_FLAG:
+                    await self.resubscribe()
+                    self.on_reconnect(websocket)
+                else:
+                    self.RESUBSCRIBE_FLAG = True
+                    await self.on_open(websocket)
+                async for message in websocket:
+                    if isinstance(message, bytes):
+                        self.on_data(websocket, self._parse_binary_data(message))
+                    else:
+                        self.on_data(websocket, message)
+            finally:
+                heartbeat.cancel()
+                self._websocket = None
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.HEAR_BEAT_INTERVAL)
+            await self._websocket.send(self.HEART_BEAT_MESSAGE)
+
+    async def subscribe(self, correlation_id, mode, token_list):
+        """
+        Subscribe the tokens. When the socket is not connected, the tokens are only remembered and
+        are subscribed as soon as the socket connects.
+        """
+        self._add_subscription(mode, token_list)
+        await self._send(
+            {
+                "correlationID": correlation_id,
+                "action": self.SUBSCRIBE_ACTION,
+                "params": {"mode": mode, "tokenList": token_list}
+            }
+        )
+
+    async def unsubscribe(self, correlation_id, mode, token_list):
+        self._remove_subscription(mode, token_list)
+        await self._send(
+            {
+                "correlationID": correlation_id,
+                "action": self.UNSUBSCRIBE_ACTION,
+                "params": {"mode": mode, "tokenList": token_list}
+            }
+        )
+
+    async def resubscribe(self):
+        for request_data in self._get_resubscribe_requests():
+            await self._send(request_data)
+
+    async def _send(self, request_data: dict) -> None:
+        if self._websocket is not None:
+            await self._websocket.send(json.dumps(request_data))
+
+    async def close_connection(self):
+        """ Closes the connection """
+        self._stop = True
+        self.RESUBSCRIBE_FLAG = False
+        if self._websocket is not None:
+            await self._websocket.close()
+
+    async def on_open(self, wsapp):
+        pass
+
+    @property
+    def connected(self) -> bool:
+        return self._websocket is not None
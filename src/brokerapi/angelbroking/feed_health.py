@@ -0,0 +1,178 @@
+"""
+File:           feed_health.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 7:30 pm
+"""
+from typing import Optional, Dict, List, Callable
+import threading
+import time
+
+from src.metrics import MetricsRegistry
+from src.utils.redis_backend import RedisBackend
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("feed_health")
+metrics: MetricsRegistry = MetricsRegistry.get_instance()
+STALE_SYMBOLS = metrics.gauge(
+    "feed_stale_symbols", "Symbols marked stale since a disconnect", ("client_id",)
+)
+SEQUENCE_GAPS = metrics.counter(
+    "feed_sequence_gaps", "Jumps in the tick sequence numbers", ("client_id",)
+)
+DUPLICATES = metrics.counter(
+    "feed_duplicates", "Replayed or out of order ticks dropped", ("client_id",)
+)
+RECONNECTS = metrics.counter("feed_reconnects", "Websocket reconnects", ("client_id",))
+
+
+# Redis hash of symbol -> epoch seconds since when the symbol price is stale
+STALENESS_KEY = "FEED_STALENESS"
+
+
+class FeedHealth:
+    """
+    Track the health of one websocket connection.
+    - Per token sequence numbers. Packets with a sequence number not greater than the last one
+      (replayed after a reconnect) are dropped and jumps are counted as gaps.
+    - On disconnect every subscribed symbol is marked stale in the STALENESS_KEY redis hash.
+    - After reconnect, a symbol is cleared on its first tick. Symbols with no tick after a grace
+      period are backfilled with the REST ltp api, as an illiquid strike may not tick for a while.
+    """
+    # Wait for live ticks after reconnect before falling back to REST
+    BACKFILL_GRACE_SEC = 2
+    # SmartAPI allows 10 ltp requests per second
+    BACKFILL_INTERVAL_SEC = 0.1
+
+    def __init__(self, redis_backend: Optional[RedisBackend] = None, client_id: str = ""):
+        self._redis_backend = redis_backend or RedisBackend()
+        self._last_sequence: Dict[str, int] = dict()
+        self._last_received: Dict[str, float] = dict()
+        self._stale: Dict[str, str] = dict()     # Stale token -> symbol
+        self._disconnected_at: Optional[float] = None
+        self._lock = threading.Lock()
+        # Stats
+        self.gaps = 0
+        self.duplicates = 0
+        self.reconnects = 0
+        self.backfilled = 0
+        self._stale_metric = STALE_SYMBOLS.labels(client_id)
+        self._gaps_metric = SEQUENCE_GAPS.labels(client_id)
+        self._duplicates_metric = DUPLICATES.labels(client_id)
+        self._reconnects_metric = RECONNECTS.labels(client_id)
+
+    def connect(self) -> None:
+        self._redis_backend.connect()
+
+    def on_tick(self, token: str, sequence_number: int) -> bool:
+        """ Record the tick. Return False if the packet is a duplicate or out of order """
+        last_sequence = self._last_sequence.get(token)
+        if last_sequence is not None:
+            if sequence_number <= last_sequence:
+                self.duplicates += 1
+                self._duplicates_metric.inc()
+                return False
+            if sequence_number > last_sequence + 1:
+                self.gaps += 1
+                self._gaps_metric.inc()
+        self._last_sequence[token] = sequence_number
+        self._last_received[token] = time.time()
+        if self._stale and self._disconnected_at is None and token in self._stale:
+            self._clear([self._stale.pop(token, token)])
+        return True
+
+    def on_disconnect(self, symbols: Dict[str, str]) -> None:
+        """ Mark the subscribed symbols (token -> symbol) stale """
+        with self._lock:
+            if self._disconnected_at is not None:
+                return
+            self._disconnected_at = time.time()
+            self._stale = dict(symbols)
+        self._stale_metric.set(len(symbols))
+        if symbols:
+            stale_since = int(self._disconnected_at)
+            self._redis_backend.hset(STALENESS_KEY, {x: stale_since for x in symbols.values()})
+        logger.warning(f"Feed disconnected. Marked {len(symbols)} symbols stale")
+
+    def on_reconnect(self, backfill: Optional[Callable[[str, str], Optional[dict]]]) -> None:
+        """
+        Sequence numbers are reset as the server replays the latest packet on subscribe.
+        Recovery runs in a thread so that the websocket keeps receiving ticks.
+        """
+        with self._lock:
+            if self._disconnected_at is None:
+                return
+            reconnected_at = time.time()
+            gap = reconnected_at - self._disconnected_at
+            self._disconnected_at = None
+            self._last_sequence.clear()
+        self.reconnects += 1
+        self._reconnects_metric.inc()
+        logger.info(f"Feed reconnected after {gap:.1f} sec")
+        threading.Thread(
+            target=self.recover, args=(backfill,), name="feed-recover", daemon=True
+        ).start()
+
+    def recover(self, backfill: Optional[Callable[[str, str], Optional[dict]]]) -> None:
+        """ Backfill the symbols with no tick after reconnect """
+        time.sleep(self.BACKFILL_GRACE_SEC)
+        with self._lock:
+            pending = dict(self._stale)
+        if not pending or backfill is None:
+            return
+        logger.info(f"Backfilling {len(pending)} symbols with no tick after reconnect")
+        backfilled: List[str] = []
+        for token, symbol in pending.items():
+            try:
+                symbol_data = backfill(token, symbol)
+            except Exception as err:
+                logger.error(f"Backfill failed for {symbol}")
+                logger.error(err)
+                symbol_data = None
+            # A live tick received during the REST call is newer than the backfill
+            with self._lock:
+                if symbol_data is not None and self._stale.pop(token, None) is not None:
+                    self._redis_backend.set(symbol, symbol_data)
+                    backfilled.append(symbol)
+            time.sleep(self.BACKFILL_INTERVAL_SEC)
+        self.backfilled += len(backfilled)
+        # Symbols which failed to backfill stay stale till their first tick
+        self._clear(backfilled)
+        logger.info(f"Backfilled {len(backfilled)} of {len(pending)} symbols")
+
+    def on_unsubscribe(self, symbols: Dict[str, str]) -> None:
+        """ Unsubscribed symbols (token -> symbol) are not tracked anymore """
+        with self._lock:
+            for token in symbols:
+                self._stale.pop(token, None)
+                self._last_sequence.pop(token, None)
+                self._last_received.pop(token, None)
+        self._clear(list(symbols.values()))
+
+    def _clear(self, symbols: List[str]) -> None:
+        self._stale_metric.set(len(self._stale))
+        if symbols:
+            self._redis_backend.hdel(STALENESS_KEY, *symbols)
+
+    @staticmethod
+    def get_symbol_data(ltp: float, token: str) -> dict:
+        """
+        Redis value for a backfilled symbol. Same format as the websocket ticks in LTP mode. The
+        REST api does not return the exchange timestamp.
+        """
+        received_at = int(time.time() * 1000)
+        return {
+            "token": token,
+            "ltp": ltp,
+            "timestamp": received_at // 1000,
+            "received_at": received_at,
+            "exchange_timestamp": None
+        }
+
+    def get_last_received(self, token: str) -> Optional[float]:
+        """ Epoch seconds of the last tick of the token """
+        return self._last_received.get(token)
+
+    @property
+    def disconnected(self) -> bool:
+        return self._disconnected_at is not None
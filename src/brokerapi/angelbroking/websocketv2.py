@@ -5,10 +5,11 @@ Created on:     03/06/23, 10:53 am
 """
 from __future__ import print_function
 
-import pdb
+import random
 import struct
 import ssl
 import json
+import time
 
 import websocket
 
@@ -18,13 +19,17 @@ class SmartWebSocketV2(object):
     SmartAPI Web Socket version 2
     """
 
-    ROOT_URI = "ws://smartapisocket.angelone.in/smart-stream"
+    ROOT_URI = "wss://smartapisocket.angelone.in/smart-stream"
     HEART_BEAT_MESSAGE = "ping"
     HEAR_BEAT_INTERVAL = 30
     LITTLE_ENDIAN_BYTE_ORDER = "<"
     RESUBSCRIBE_FLAG = False
     # HB_THREAD_FLAG = True
-    MAX_RETRY_ATTEMPT = 1
+    # Reconnect with exponential backoff. The attempt count is reset once the socket opens.
+    MAX_RETRY_ATTEMPT = 10
+    RETRY_DELAY = 1
+    RETRY_MULTIPLIER = 2
+    MAX_RETRY_DELAY = 30
 
     # Available Actions
     SUBSCRIBE_ACTION = 1
@@ -51,6 +56,25 @@ class SmartWebSocketV2(object):
         3: "SNAP_QUOTE"
     }
 
+    # Binary packet sections. LTP -> bytes 0 to 51, QUOTE -> 51 to 123,
+    # SNAP_QUOTE -> 123 to 147, best 5 data -> 147 to 347, circuit limits -> 347 to 379
+    LTP_PACKET = struct.Struct("<BB25sqqq")
+    QUOTE_PACKET = struct.Struct("<qqqddqqqq")
+    QUOTE_FIELDS = (
+        "last_traded_quantity", "average_traded_price", "volume_trade_for_the_day",
+        "total_buy_quantity", "total_sell_quantity", "open_price_of_the_day",
+        "high_price_of_the_day", "low_price_of_the_day", "closed_price"
+    )
+    SNAP_QUOTE_PACKET = struct.Struct("<qqq")
+    SNAP_QUOTE_FIELDS = (
+        "last_traded_timestamp", "open_interest", "open_interest_change_percentage"
+    )
+    DEPTH_PACKET = struct.Struct("<" + "HqqH" * 10)
+    CIRCUIT_PACKET = struct.Struct("<qqqq")
+    CIRCUIT_FIELDS = (
+        "upper_circuit_limit", "lower_circuit_limit", "52_week_high_price", "52_week_low_price"
+    )
+
     wsapp = None
     input_request_dict = {}
     current_retry_attempt = 0
@@ -73,6 +97,11 @@ class SmartWebSocketV2(object):
         self.api_key = api_key
         self.client_code = client_code
         self.feed_token = feed_token
+        # Subscribed tokens by mode and exchange type. Used to resubscribe after reconnect.
+        self.input_request_dict = {}
+        self.current_retry_attempt = 0
+        # Set by close_connection so that a deliberate close is not reconnected
+        self._closed = False
 
         if not self._sanity_check():
             raise Exception("Provide valid value for all the tokens")
@@ -105,8 +134,10 @@ class SmartWebSocketV2(object):
         # thread.daemon = True
         # thread.start()
 
+        self.current_retry_attempt = 0
         if self.RESUBSCRIBE_FLAG:
             self.resubscribe()
+            self.on_reconnect(wsapp)
         else:
             self.RESUBSCRIBE_FLAG = True
             self.on_open(wsapp)
@@ -159,15 +190,7 @@ class SmartWebSocketV2(object):
                 }
             }
 
-            if self.input_request_dict.get(mode, None) is None:
-                self.input_request_dict[mode] = {}
-
-            for token in token_list:
-                if token['exchangeType'] in self.input_request_dict[mode]:
-                    self.input_request_dict[mode][token['exchangeType']].extend(token["tokens"])
-                else:
-                    self.input_request_dict[mode][token['exchangeType']] = token["tokens"]
-
+            self._add_subscription(mode, token_list)
             self.wsapp.send(json.dumps(request_data))
             self.RESUBSCRIBE_FLAG = True
         except Exception as e:
@@ -215,8 +238,7 @@ class SmartWebSocketV2(object):
                 }
             }
 
-            self.input_request_dict.update(request_data)
-            self.input_request_dict.update(request_data)
+            self._remove_subscription(mode, token_list)
             self.wsapp.send(json.dumps(request_data))
             self.RESUBSCRIBE_FLAG = True
         except Exception as e:
@@ -224,49 +246,94 @@ class SmartWebSocketV2(object):
 
     def resubscribe(self):
         try:
-            for key, val in self.input_request_dict.items():
-                token_list = []
-                for key1, val1 in val.items():
-                    temp_data = {
-                        'exchangeType': key1,
-                        'tokens': val1
-                    }
-                    token_list.append(temp_data)
-                request_data = {
-                    "action": self.SUBSCRIBE_ACTION,
-                    "params": {
-                        "mode": key,
-                        "tokenList": token_list
-                    }
-                }
+            for request_data in self._get_resubscribe_requests():
                 self.wsapp.send(json.dumps(request_data))
         except Exception as e:
             raise e
 
+    def _add_subscription(self, mode, token_list):
+        """ Remember the subscribed tokens so that they are subscribed again on reconnect """
+        if self.input_request_dict.get(mode, None) is None:
+            self.input_request_dict[mode] = {}
+
+        for token in token_list:
+            tokens = self.input_request_dict[mode].setdefault(token['exchangeType'], [])
+            tokens.extend(x for x in token["tokens"] if x not in tokens)
+
+    def _remove_subscription(self, mode, token_list):
+        """ Remove the tokens so that they are not subscribed again on reconnect """
+        for token in token_list:
+            tokens = self.input_request_dict.get(mode, {}).get(token['exchangeType'], [])
+            unsubscribed = set(token["tokens"])
+            tokens[:] = [x for x in tokens if x not in unsubscribed]
+
+    def _get_resubscribe_requests(self):
+        """ One subscribe request per mode for all the remembered tokens """
+        requests = []
+        for key, val in self.input_request_dict.items():
+            token_list = []
+            for key1, val1 in val.items():
+                if not val1:
+                    continue
+                temp_data = {
+                    'exchangeType': key1,
+                    'tokens': val1
+                }
+                token_list.append(temp_data)
+            if not token_list:
+                continue
+            request_data = {
+                "action": self.SUBSCRIBE_ACTION,
+                "params": {
+                    "mode": key,
+                    "tokenList": token_list
+                }
+            }
+            requests.append(request_data)
+        return requests
+
     def connect(self):
         """
-            Make the web socket connection with the server
+            Make the web socket connection with the server. Blocks till the connection is closed
+            with close_connection or MAX_RETRY_ATTEMPT reconnects in a row fail.
         """
-        try:
-            headers = {
-                "Authorization": self.auth_token,
-                "x-api-key": self.api_key,
-                "x-client-code": self.client_code,
-                "x-feed-token": self.feed_token
-            }
-            self.wsapp = websocket.WebSocketApp(self.ROOT_URI, header=headers, on_open=self._on_open,
-                                                on_error=self._on_error, on_close=self._on_close, on_data=self._on_data,
-                                                on_ping=self._on_ping, on_pong=self._on_pong)
-            self.wsapp.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE}, ping_interval=self.HEAR_BEAT_INTERVAL,
-                                   ping_payload=self.HEART_BEAT_MESSAGE)
-        except Exception as e:
-            raise e
+        self._closed = False
+        while True:
+            try:
+                headers = {
+                    "Authorization": self.auth_token,
+                    "x-api-key": self.api_key,
+                    "x-client-code": self.client_code,
+                    "x-feed-token": self.feed_token
+                }
+                self.wsapp = websocket.WebSocketApp(self.ROOT_URI, header=headers, on_open=self._on_open,
+                                                    on_error=self._on_error, on_close=self._on_close, on_data=self._on_data,
+                                                    on_ping=self._on_ping, on_pong=self._on_pong)
+                self.wsapp.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE}, ping_interval=self.HEAR_BEAT_INTERVAL,
+                                       ping_payload=self.HEART_BEAT_MESSAGE)
+            except Exception as e:
+                raise e
+            if self._closed or self.current_retry_attempt >= self.MAX_RETRY_ATTEMPT:
+                break
+            delay = self.get_retry_delay()
+            self.current_retry_attempt += 1
+            print(f"Attempting to resubscribe/reconnect in {delay:.1f} sec...")
+            time.sleep(delay)
+
+    def get_retry_delay(self):
+        """ Exponential backoff with jitter so that several connections do not retry together """
+        delay = min(
+            self.RETRY_DELAY * self.RETRY_MULTIPLIER ** self.current_retry_attempt,
+            self.MAX_RETRY_DELAY
+        )
+        return delay * random.uniform(0.5, 1)
 
     def close_connection(self):
         """
             Closes the connection
         """
         self.RESUBSCRIBE_FLAG = False
+        self._closed = True
         # self.HB_THREAD_FLAG = False
         self.wsapp.close()
 
@@ -285,12 +352,7 @@ class SmartWebSocketV2(object):
 
     def _on_error(self, wsapp, error):
         self.HB_THREAD_FLAG = False
-        self.RESUBSCRIBE_FLAG = True
         self.on_error(wsapp, error)
-        if self.current_retry_attempt < self.MAX_RETRY_ATTEMPT:
-            print("Attempting to resubscribe/reconnect...")
-            self.current_retry_attempt += 1
-            self.connect()
 
     def _on_close(self, wsapp, close_status_code, close_msg):
         # self.HB_THREAD_FLAG = False
@@ -298,39 +360,37 @@ class SmartWebSocketV2(object):
         self.on_close(wsapp)
 
     def _parse_binary_data(self, binary_data):
+        """
+            Decode a SmartStream binary packet. Each section of the packet is unpacked with a
+            single precompiled struct instead of one struct.unpack call per field, which keeps
+            the 379 byte SNAP_QUOTE packets cheap.
+        """
         try:
+            mode, exchange_type, token, sequence_number, exchange_timestamp, ltp = \
+                self.LTP_PACKET.unpack_from(binary_data, 0)
             parsed_data = {
-                "subscription_mode": self._unpack_data(binary_data, 0, 1, byte_format="B")[0],
-                "exchange_type": self._unpack_data(binary_data, 1, 2, byte_format="B")[0],
-                "token": SmartWebSocketV2._parse_token_value(binary_data[2:27]),
-                "sequence_number": self._unpack_data(binary_data, 27, 35, byte_format="q")[0],
-                "exchange_timestamp": self._unpack_data(binary_data, 35, 43, byte_format="q")[0],
-                "last_traded_price": self._unpack_data(binary_data, 43, 51, byte_format="q")[0]
+                "subscription_mode": mode,
+                "exchange_type": exchange_type,
+                "token": token.decode("utf-8").replace("\x00", ""),
+                "sequence_number": sequence_number,
+                "exchange_timestamp": exchange_timestamp,
+                "last_traded_price": ltp,
+                "subscription_mode_val": self.SUBSCRIPTION_MODE_MAP.get(mode)
             }
 
-            parsed_data["subscription_mode_val"] = self.SUBSCRIPTION_MODE_MAP.get(parsed_data["subscription_mode"])
-
-            if parsed_data["subscription_mode"] in [self.QUOTE, self.SNAP_QUOTE]:
-                parsed_data["last_traded_quantity"] = self._unpack_data(binary_data, 51, 59, byte_format="q")[0]
-                parsed_data["average_traded_price"] = self._unpack_data(binary_data, 59, 67, byte_format="q")[0]
-                parsed_data["volume_trade_for_the_day"] = self._unpack_data(binary_data, 67, 75, byte_format="q")[0]
-                parsed_data["total_buy_quantity"] = self._unpack_data(binary_data, 75, 83, byte_format="d")[0]
-                parsed_data["total_sell_quantity"] = self._unpack_data(binary_data, 83, 91, byte_format="d")[0]
-                parsed_data["open_price_of_the_day"] = self._unpack_data(binary_data, 91, 99, byte_format="q")[0]
-                parsed_data["high_price_of_the_day"] = self._unpack_data(binary_data, 99, 107, byte_format="q")[0]
-                parsed_data["low_price_of_the_day"] = self._unpack_data(binary_data, 107, 115, byte_format="q")[0]
-                parsed_data["closed_price"] = self._unpack_data(binary_data, 115, 123, byte_format="q")[0]
-
-            if parsed_data["subscription_mode"] == self.SNAP_QUOTE:
-                parsed_data["last_traded_timestamp"] = self._unpack_data(binary_data, 123, 131, byte_format="q")[0]
-                parsed_data["open_interest"] = self._unpack_data(binary_data, 131, 139, byte_format="q")[0]
-                parsed_data["open_interest_change_percentage"] = \
-                    self._unpack_data(binary_data, 139, 147, byte_format="q")[0]
-                parsed_data["upper_circuit_limit"] = self._unpack_data(binary_data, 347, 355, byte_format="q")[0]
-                parsed_data["lower_circuit_limit"] = self._unpack_data(binary_data, 355, 363, byte_format="q")[0]
-                parsed_data["52_week_high_price"] = self._unpack_data(binary_data, 363, 371, byte_format="q")[0]
-                parsed_data["52_week_low_price"] = self._unpack_data(binary_data, 371, 379, byte_format="q")[0]
-                best_5_buy_and_sell_data = self._parse_best_5_buy_and_sell_data(binary_data[147:347])
+            if mode == self.QUOTE or mode == self.SNAP_QUOTE:
+                parsed_data.update(
+                    zip(self.QUOTE_FIELDS, self.QUOTE_PACKET.unpack_from(binary_data, 51))
+                )
+
+            if mode == self.SNAP_QUOTE:
+                parsed_data.update(
+                    zip(self.SNAP_QUOTE_FIELDS, self.SNAP_QUOTE_PACKET.unpack_from(binary_data, 123))
+                )
+                parsed_data.update(
+                    zip(self.CIRCUIT_FIELDS, self.CIRCUIT_PACKET.unpack_from(binary_data, 347))
+                )
+                best_5_buy_and_sell_data = self._parse_best_5_buy_and_sell_data(binary_data)
                 parsed_data["best_5_buy_data"] = best_5_buy_and_sell_data["best_5_buy_data"]
                 parsed_data["best_5_sell_data"] = best_5_buy_and_sell_data["best_5_sell_data"]
 
@@ -348,41 +408,29 @@ class SmartWebSocketV2(object):
     @staticmethod
     def _parse_token_value(binary_packet):
         token = binary_packet.decode("utf-8").replace("\x00", "")
-        # for i in range(len(binary_packet)):
-        #     if binary_packet[i] == b'\x00':
-        #         return token
-        #     print(i, binary_packet[i])
-        #     token += binary_packet[i].encode("UTF-8")
         return token
 
     def _parse_best_5_buy_and_sell_data(self, binary_data):
-
-        def split_packets(binary_packets):
-            packets = []
-
-            i = 0
-            while i < len(binary_packets):
-                packets.append(binary_packets[i: i+20])
-                i += 20
-            return packets
-
-        best_5_buy_sell_packets = split_packets(binary_data)
-
+        """
+            Best 5 buy and sell data is 10 packets of 20 bytes starting at byte 147 of a
+            SNAP_QUOTE packet. All 10 packets are unpacked in one call.
+        """
+        values = self.DEPTH_PACKET.unpack_from(binary_data, 147)
         best_5_buy_data = []
         best_5_sell_data = []
-
-        for packet in best_5_buy_sell_packets:
+        for i in range(0, 40, 4):
             each_data = {
-                "flag": self._unpack_data(packet, 0, 2, byte_format="H")[0],
-                "quantity": self._unpack_data(packet, 2, 10, byte_format="q")[0],
-                "price": self._unpack_data(packet, 10, 18, byte_format="q")[0],
-                "no of orders": self._unpack_data(packet, 18, 20, byte_format="H")[0]
+                "flag": values[i],
+                "quantity": values[i + 1],
+                "price": values[i + 2],
+                "no of orders": values[i + 3]
             }
 
+            # Flag is 1 for buy side and 0 for sell side
             if each_data["flag"] == 0:
-                best_5_buy_data.append(each_data)
-            else:
                 best_5_sell_data.append(each_data)
+            else:
+                best_5_buy_data.append(each_data)
 
         return {
             "best_5_buy_data": best_5_buy_data,
@@ -401,5 +449,8 @@ class SmartWebSocketV2(object):
     def on_open(self, wsapp):
         pass
 
+    def on_reconnect(self, wsapp):
+        pass
+
     def on_error(self, wsapp, error):
         pass
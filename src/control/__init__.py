@@ -0,0 +1,7 @@
+"""
+File:           __init__.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 1:05 am
+"""
+from .command_stream import CommandStream, CommandConsumer, Command, CommandType, \
+    CommandStreamError
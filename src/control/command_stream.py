@@ -0,0 +1,259 @@
+"""
+File:           command_stream.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 1:05 am
+"""
+from typing import Optional, Callable, List, Dict, Tuple
+from dataclasses import dataclass
+import enum
+import json
+import queue
+import threading
+import time
+
+from src.utils.redis_backend import RedisBackend
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("command_stream")
+
+
+class CommandStreamError(Exception):
+    """ Raised for an unknown command or a command without its value """
+    pass
+
+
+class CommandType(enum.Enum):
+    MANUAL_ENTRY = "MANUAL_ENTRY"
+    MANUAL_EXIT = "MANUAL_EXIT"
+    PAUSE_SHIFTING = "PAUSE_SHIFTING"
+    RESUME_SHIFTING = "RESUME_SHIFTING"
+    SET_SL = "SET_SL"                   # value is the SL amount
+    SET_TARGET = "SET_TARGET"           # value is the target amount
+    RELOAD_CONFIG = "RELOAD_CONFIG"     # Reload the strategy config file
+
+
+@dataclass()
+class Command:
+    command_id: str                     # Stream entry id
+    command_type: CommandType
+    client_id: str                      # Target account or ALL_ACCOUNTS
+    value: Optional[float]
+    created_at: int                     # Epoch milliseconds from the stream entry id
+
+
+class CommandStream:
+    """
+    Operator commands to the strategies through redis streams. The dashboard adds a command to
+    COMMANDS, targeting one account or all of them. Every account reads the stream with its own
+    consumer group and reports the result of each command on COMMAND_ACKS.
+    """
+    STREAM = "COMMANDS"
+    ACK_STREAM = "COMMAND_ACKS"
+    MAX_LEN = 1000
+    ALL_ACCOUNTS = "*"
+    VALUE_COMMANDS = (CommandType.SET_SL, CommandType.SET_TARGET)
+
+    def __init__(self, redis_backend: Optional[RedisBackend] = None):
+        self._redis_backend = redis_backend or RedisBackend()
+
+    def connect(self) -> None:
+        self._redis_backend.connect()
+
+    def send(
+            self,
+            command_type: CommandType,
+            client_id: str = ALL_ACCOUNTS,
+            value: Optional[float] = None
+    ) -> str:
+        """ Add a command for the account. Return the command id """
+        if command_type in CommandStream.VALUE_COMMANDS and (
+                isinstance(value, bool) or not isinstance(value, (int, float))
+        ):
+            raise CommandStreamError(f"{command_type.value} needs a numeric value")
+        return self._redis_backend.xadd(
+            CommandStream.STREAM,
+            {
+                "type": command_type.value,
+                "client_id": client_id or CommandStream.ALL_ACCOUNTS,
+                "value": json.dumps(value)
+            },
+            maxlen=CommandStream.MAX_LEN
+        )
+
+    def get_acks(self, count: int = 5) -> List[Dict[str, str]]:
+        """ Latest acknowledgements, the latest first """
+        return [x for _, x in self._redis_backend.xrevrange(CommandStream.ACK_STREAM, count)]
+
+    @staticmethod
+    def parse(command_id: str, fields: Dict[str, str]) -> Command:
+        """ Commands can also be added with redis-cli, so the value is validated here too """
+        try:
+            command = Command(
+                command_id=command_id,
+                command_type=CommandType(fields["type"]),
+                client_id=fields["client_id"],
+                value=json.loads(fields.get("value", "null")),
+                created_at=int(command_id.split("-")[0])
+            )
+        except (KeyError, ValueError) as err:
+            raise CommandStreamError(f"Invalid command {command_id} {fields}. {err}")
+        if command.command_type in CommandStream.VALUE_COMMANDS and (
+                isinstance(command.value, bool) or not isinstance(command.value, (int, float))
+        ):
+            raise CommandStreamError(
+                f"{command.command_type.value} {command_id} needs a numeric value, "
+                f"got {fields.get('value')}"
+            )
+        return command
+
+
+class CommandConsumer:
+    """
+    Read the commands for one account with a blocking read in a background thread. The commands
+    are queued for the strategy loop, which is woken up by on_command. The strategy acknowledges
+    each command after handling it. The accounts of a process run one after another, so only the
+    running account handles a command. Commands sent before connect are reported as not
+    delivered, when the account starts or, if it does not run again, on the next process start.
+    """
+    BLOCK_MS = 1000
+    NOT_DELIVERED = "Not delivered as the account was not running"
+    NOT_HANDLED = "Not handled before the account stopped"
+
+    def __init__(
+            self,
+            client_id: str,
+            on_command: Optional[Callable[[], None]] = None,
+            redis_backend: Optional[RedisBackend] = None
+    ):
+        self._client_id = client_id
+        self._on_command = on_command
+        self._redis_backend = redis_backend or RedisBackend()
+        self._group = f"strategy:{client_id}"
+        self._commands: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = False
+        # Id of the last entry in the stream at connect, as (milliseconds, sequence)
+        self._connected_at: Tuple[int, int] = (0, 0)
+
+    def skip_backlog(self) -> None:
+        """
+        Called on process start. Create the group if missing, else report the commands left
+        from the previous process as not delivered: the ones read but not acked before a restart
+        and the ones sent after the account stopped.
+        """
+        self._redis_backend.connect()
+        self._redis_backend.create_group(CommandStream.STREAM, self._group)
+        for entry_id, message in (
+                ("0", CommandConsumer.NOT_HANDLED), (">", CommandConsumer.NOT_DELIVERED)
+        ):
+            while True:
+                entries = self._redis_backend.xreadgroup(
+                    CommandStream.STREAM,
+                    self._group,
+                    self._client_id,
+                    count=100,
+                    block_ms=None,
+                    entry_id=entry_id
+                )
+                if not entries:
+                    break
+                for command_id, fields in entries:
+                    self.reject(command_id, fields, message)
+
+    def connect(self) -> None:
+        if self._thread is not None:
+            return
+        self._redis_backend.connect()
+        self._redis_backend.create_group(CommandStream.STREAM, self._group)
+        latest = self._redis_backend.xrevrange(CommandStream.STREAM, 1)
+        self._connected_at = self.get_entry_order(latest[0][0]) if latest else (0, 0)
+        self._stop = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"commands-{self._client_id}", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_commands(self) -> List[Command]:
+        """ Commands received since the last call """
+        commands = []
+        while not self._commands.empty():
+            commands.append(self._commands.get_nowait())
+        return commands
+
+    def ack(self, command: Command, ok: bool = True, message: str = "") -> None:
+        """ Mark the command handled and report the result on the ack stream """
+        self.report(command.command_id, command.command_type.value, ok, message)
+        logger.info(
+            f"Command {command.command_type.value} {command.command_id} for {self._client_id} "
+            f"{'done' if ok else 'failed'}. {message}"
+        )
+
+    @staticmethod
+    def get_entry_order(entry_id: str) -> Tuple[int, int]:
+        milliseconds, sequence = entry_id.split("-")
+        return int(milliseconds), int(sequence)
+
+    def reject(self, command_id: str, fields: Dict[str, str], message: str) -> None:
+        """ Report a command for this account as failed without handling it """
+        if fields.get("client_id") in (CommandStream.ALL_ACCOUNTS, self._client_id):
+            logger.warning(f"Command {command_id} for {self._client_id} rejected. {message}")
+            self.report(command_id, fields.get("type", ""), False, message)
+        else:
+            self._redis_backend.xack(CommandStream.STREAM, self._group, command_id)
+
+    def report(self, command_id: str, command_type: str, ok: bool, message: str) -> None:
+        self._redis_backend.xack(CommandStream.STREAM, self._group, command_id)
+        self._redis_backend.xadd(
+            CommandStream.ACK_STREAM,
+            {
+                "command_id": command_id,
+                "type": command_type,
+                "client_id": self._client_id,
+                "status": "ok" if ok else "error",
+                "message": message,
+                "latency_ms": str(int(time.time() * 1000) - int(command_id.split("-")[0]))
+            },
+            maxlen=CommandStream.MAX_LEN
+        )
+
+    def _run(self) -> None:
+        while not self._stop:
+            try:
+                entries = self._redis_backend.xreadgroup(
+                    CommandStream.STREAM,
+                    self._group,
+                    self._client_id,
+                    block_ms=CommandConsumer.BLOCK_MS
+                )
+            except Exception as err:
+                logger.error(f"Error reading commands for {self._client_id}: {err}")
+                time.sleep(1)
+                continue
+            received = False
+            for command_id, fields in entries:
+                try:
+                    command = CommandStream.parse(command_id, fields)
+                except CommandStreamError as err:
+                    logger.error(err)
+                    self.reject(command_id, fields, str(err))
+                    continue
+                if self.get_entry_order(command_id) <= self._connected_at:
+                    # Sent while an earlier account was running
+                    self.reject(command_id, fields, CommandConsumer.NOT_DELIVERED)
+                    continue
+                if command.client_id not in (CommandStream.ALL_ACCOUNTS, self._client_id):
+                    # Meant for another account
+                    self._redis_backend.xack(CommandStream.STREAM, self._group, command_id)
+                    continue
+                logger.info(f"Received command {command.command_type.value} {command_id}")
+                self._commands.put(command)
+                received = True
+            if received and self._on_command is not None:
+                self._on_command()
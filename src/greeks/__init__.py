@@ -0,0 +1,8 @@
+"""
+File:           __init__.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 9:40 pm
+"""
+from .black76 import OptionGreeks
+from .greeks_engine import GreeksEngine
+from .risk_aggregator import RiskAggregator, PortfolioRisk
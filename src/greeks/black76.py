@@ -0,0 +1,156 @@
+"""
+File:           black76.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 9:40 pm
+"""
+from typing import Optional
+from dataclasses import dataclass
+import math
+
+
+# Implied volatility search range
+MIN_VOLATILITY = 0.0001
+MAX_VOLATILITY = 5.0
+IV_TOLERANCE = 1e-6
+IV_MAX_ITERATIONS = 50
+
+
+@dataclass(frozen=True)
+class OptionGreeks:
+    """
+    Greeks of one option. delta and gamma are w.r.t. the forward, vega is per 1% volatility and
+    theta is per calendar day. Everything is None when the implied volatility can not be solved.
+    """
+    strike: int
+    option_type: str
+    price: float
+    iv: Optional[float] = None
+    delta: Optional[float] = None
+    gamma: Optional[float] = None
+    vega: Optional[float] = None
+    theta: Optional[float] = None
+
+
+def norm_cdf(x: float) -> float:
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
+
+
+def norm_pdf(x: float) -> float:
+    return math.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+def get_d1_d2(forward: float, strike: float, t: float, volatility: float):
+    volatility_sqrt_t = volatility * math.sqrt(t)
+    d1 = (math.log(forward / strike) + 0.5 * volatility_sqrt_t * volatility_sqrt_t) / \
+        volatility_sqrt_t
+    return d1, d1 - volatility_sqrt_t
+
+
+def price(
+        forward: float, strike: float, t: float, volatility: float, r: float, option_type: str
+) -> float:
+    """ Black-76 price of a european option on the forward. t is in years """
+    d1, d2 = get_d1_d2(forward, strike, t, volatility)
+    discount = math.exp(-r * t)
+    if option_type == "CE":
+        return discount * (forward * norm_cdf(d1) - strike * norm_cdf(d2))
+    return discount * (strike * norm_cdf(-d2) - forward * norm_cdf(-d1))
+
+
+def vega(forward: float, strike: float, t: float, volatility: float, r: float) -> float:
+    """ Change in price for a change of 1 (100%) in volatility """
+    d1, _ = get_d1_d2(forward, strike, t, volatility)
+    return math.exp(-r * t) * forward * norm_pdf(d1) * math.sqrt(t)
+
+
+def implied_volatility(
+        option_price: float,
+        forward: float,
+        strike: float,
+        t: float,
+        r: float,
+        option_type: str,
+        guess: Optional[float] = None
+) -> Optional[float]:
+    """
+    Solve the volatility with Newton-Raphson, falling back to bisection when a Newton step goes
+    out of the bracket. guess is the starting volatility, usually the iv of the neighbour strike.
+    Return None when the price is outside the no-arbitrage bounds.
+    """
+    discount = math.exp(-r * t)
+    if option_type == "CE":
+        intrinsic = discount * max(forward - strike, 0)
+        upper_bound = discount * forward
+    else:
+        intrinsic = discount * max(strike - forward, 0)
+        upper_bound = discount * strike
+    if t <= 0 or option_price <= intrinsic or option_price >= upper_bound:
+        return None
+    low, high = MIN_VOLATILITY, MAX_VOLATILITY
+    sqrt_t = math.sqrt(t)
+    log_moneyness = math.log(forward / strike)
+    if guess is None:
+        # Brenner-Subrahmanyam approximation is a good starting point near the money
+        guess = option_price / (discount * forward) * math.sqrt(2 * math.pi / t)
+    volatility = min(max(guess, low), high)
+    for _ in range(IV_MAX_ITERATIONS):
+        # Price and vega share d1, so both are computed here instead of calling price and vega
+        volatility_sqrt_t = volatility * sqrt_t
+        d1 = (log_moneyness + 0.5 * volatility_sqrt_t * volatility_sqrt_t) / volatility_sqrt_t
+        d2 = d1 - volatility_sqrt_t
+        if option_type == "CE":
+            model_price = discount * (forward * norm_cdf(d1) - strike * norm_cdf(d2))
+        else:
+            model_price = discount * (strike * norm_cdf(-d2) - forward * norm_cdf(-d1))
+        diff = model_price - option_price
+        if abs(diff) < IV_TOLERANCE:
+            return volatility
+        # Price increases with volatility, so the bracket can be narrowed on every step
+        if diff > 0:
+            high = volatility
+        else:
+            low = volatility
+        option_vega = discount * forward * norm_pdf(d1) * sqrt_t
+        next_volatility = volatility - diff / option_vega if option_vega > 0 else low
+        if not low < next_volatility < high:
+            next_volatility = (low + high) / 2
+        volatility = next_volatility
+        if high - low < IV_TOLERANCE:
+            return volatility
+    return volatility
+
+
+def greeks(
+        option_price: float,
+        forward: float,
+        strike: int,
+        t: float,
+        r: float,
+        option_type: str,
+        guess: Optional[float] = None
+) -> OptionGreeks:
+    """ Implied volatility and greeks of an option from its market price """
+    iv = implied_volatility(option_price, forward, strike, t, r, option_type, guess)
+    if iv is None:
+        return OptionGreeks(strike=strike, option_type=option_type, price=option_price)
+    d1, d2 = get_d1_d2(forward, strike, t, iv)
+    discount = math.exp(-r * t)
+    sqrt_t = math.sqrt(t)
+    pdf_d1 = norm_pdf(d1)
+    if option_type == "CE":
+        delta = discount * norm_cdf(d1)
+    else:
+        delta = -discount * norm_cdf(-d1)
+    gamma = discount * pdf_d1 / (forward * iv * sqrt_t)
+    # Theta per year is the time decay of the volatility term plus the discounting of the price
+    theta = -discount * forward * pdf_d1 * iv / (2 * sqrt_t) + r * option_price
+    return OptionGreeks(
+        strike=strike,
+        option_type=option_type,
+        price=option_price,
+        iv=iv,
+        delta=delta,
+        gamma=gamma,
+        vega=discount * forward * pdf_d1 * sqrt_t / 100,
+        theta=theta / 365
+    )
@@ -0,0 +1,90 @@
+"""
+File:           greeks_engine.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 10:05 pm
+"""
+from typing import Optional, Dict, Callable, TYPE_CHECKING
+import datetime
+import math
+
+import pytz
+
+from src.greeks.black76 import OptionGreeks, greeks
+
+if TYPE_CHECKING:
+    from src.price_monitor.price_monitor import ChainSnapshot
+
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+
+
+class GreeksEngine:
+    """
+    Implied volatility and greeks of the option chain in a snapshot with Black-76. The forward is
+    implied from the ATM call and put prices (put-call parity), so the greeks do not depend on the
+    spot to futures basis. The mid price is used when bid and ask are available, else ltp.
+    """
+    RISK_FREE_RATE = 0.07
+    EXPIRY_TIME = datetime.time(hour=15, minute=30)
+    # Floor so that the greeks stay finite in the last minute of the expiry day
+    MIN_TIME_TO_EXPIRY = 60 / SECONDS_PER_YEAR
+
+    def __init__(self, expiry: datetime.date, risk_free_rate: float = RISK_FREE_RATE):
+        self._expiry = expiry
+        self._risk_free_rate = risk_free_rate
+        ist_tz = pytz.timezone("Asia/Kolkata")
+        self._expiry_at = ist_tz.localize(datetime.datetime.combine(expiry, self.EXPIRY_TIME))
+
+    def compute(
+            self, snapshot: "ChainSnapshot", get_symbol: Callable[[int, str], str]
+    ) -> Dict[str, OptionGreeks]:
+        """ Return symbol -> greeks for every strike in the snapshot """
+        t = self.get_time_to_expiry(snapshot.created_at)
+        forward = self.get_forward(snapshot, get_symbol, t)
+        chain_greeks: Dict[str, OptionGreeks] = dict()
+        for option_type in ("CE", "PE"):
+            strikes, _ = snapshot.get_ladder(option_type)
+            # The smile is smooth, so the iv of a strike is the starting point for the next one
+            guess = None
+            for strike in strikes:
+                symbol = get_symbol(strike, option_type)
+                option_price = self.get_option_price(snapshot.get_quote(symbol))
+                option_greeks = greeks(
+                    option_price, forward, strike, t, self._risk_free_rate, option_type, guess
+                )
+                chain_greeks[symbol] = option_greeks
+                guess = option_greeks.iv or guess
+        return chain_greeks
+
+    def get_time_to_expiry(self, timestamp: float) -> float:
+        """ Years from the epoch timestamp to the expiry """
+        seconds = self._expiry_at.timestamp() - timestamp
+        return max(seconds / SECONDS_PER_YEAR, self.MIN_TIME_TO_EXPIRY)
+
+    def get_forward(
+            self, snapshot: "ChainSnapshot", get_symbol: Callable[[int, str], str], t: float
+    ) -> float:
+        """ Forward from the ATM put-call parity. Fallback to the index if a leg is missing """
+        ce_quote = snapshot.get_quote(get_symbol(snapshot.atm, "CE"))
+        pe_quote = snapshot.get_quote(get_symbol(snapshot.atm, "PE"))
+        if ce_quote is None or pe_quote is None:
+            return snapshot.index
+        ce_price = self.get_option_price(ce_quote)
+        pe_price = self.get_option_price(pe_quote)
+        return snapshot.atm + (ce_price - pe_price) * math.exp(self._risk_free_rate * t)
+
+    @staticmethod
+    def get_option_price(quote: dict) -> float:
+        bid: Optional[float] = quote.get("bid")
+        ask: Optional[float] = quote.get("ask")
+        if bid and ask and ask >= bid:
+            return (bid + ask) / 2
+        return quote["ltp"]
+
+    @property
+    def expiry(self) -> datetime.date:
+        return self._expiry
+
+    @property
+    def risk_free_rate(self) -> float:
+        return self._risk_free_rate
@@ -0,0 +1,132 @@
+"""
+File:           risk_aggregator.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 10:50 pm
+"""
+from typing import Optional, Dict, List, Tuple, TYPE_CHECKING
+from dataclasses import dataclass, asdict
+import math
+
+from src.greeks import black76
+from src.greeks.black76 import OptionGreeks
+from src.strategies.instrument import Instrument, Action
+from src.utils.redis_backend import RedisBackend
+
+if TYPE_CHECKING:
+    from src.price_monitor.price_monitor import PriceMonitor
+
+
+@dataclass(frozen=True)
+class PortfolioRisk:
+    """
+    Net greeks of the open legs of an account in rupees (greek * signed quantity) and the change
+    in pnl for each index move in scenario_pnl, keyed by the move like "-1%".
+    """
+    delta: float
+    gamma: float
+    vega: float
+    theta: float
+    scenario_pnl: Dict[str, float]
+    legs: int
+    timestamp: int                  # Epoch milliseconds of the prices used
+
+    @property
+    def worst_scenario_pnl(self) -> float:
+        return min(self.scenario_pnl.values(), default=0)
+
+
+class RiskAggregator:
+    """
+    Net greeks and scenario pnl of the open straddle and hedge legs of one account. Only the legs
+    are solved on each update, so it is cheap enough to run on every strategy loop iteration. The
+    chain greeks are reused when they are already computed for the snapshot.
+    The result is published to RISK_<client_id> in redis.
+    """
+    # Index moves for the scenario pnl
+    SCENARIOS = (-0.03, -0.02, -0.01, 0.01, 0.02, 0.03)
+
+    def __init__(
+            self,
+            client_id: str,
+            price_monitor: "PriceMonitor",
+            redis_backend: Optional[RedisBackend] = None,
+            scenarios: Tuple[float, ...] = SCENARIOS
+    ):
+        self._client_id = client_id
+        self._price_monitor = price_monitor
+        self._redis_backend = redis_backend or RedisBackend()
+        self._scenarios = scenarios
+        self._risk: Optional[PortfolioRisk] = None
+
+    def update(self, legs: List[Instrument]) -> PortfolioRisk:
+        """ Compute the risk of the legs from the current snapshot """
+        snapshot = self._price_monitor.get_snapshot()
+        engine = self._price_monitor.greeks_engine
+        get_symbol = self._price_monitor.get_symbol
+        t = engine.get_time_to_expiry(snapshot.created_at)
+        forward = engine.get_forward(snapshot, get_symbol, t)
+        r = engine.risk_free_rate
+        delta = gamma = vega = theta = 0
+        scenario_pnl = {self.get_scenario_name(x): 0 for x in self._scenarios}
+        for leg in legs:
+            quantity = leg.lot_size if leg.action == Action.BUY else -leg.lot_size
+            option_greeks = snapshot.greeks.get(leg.symbol)
+            if option_greeks is None:
+                quote = snapshot.get_quote(leg.symbol) or \
+                    self._price_monitor.get_quote_by_symbol(leg.symbol)
+                option_greeks = black76.greeks(
+                    engine.get_option_price(quote), forward, leg.strike, t, r, leg.option_type
+                )
+            if option_greeks.iv is not None:
+                delta += option_greeks.delta * quantity
+                gamma += option_greeks.gamma * quantity
+                vega += option_greeks.vega * quantity
+                theta += option_greeks.theta * quantity
+            for move in self._scenarios:
+                scenario_price = self.get_scenario_price(option_greeks, forward * (1 + move), t, r)
+                scenario_pnl[self.get_scenario_name(move)] += \
+                    (scenario_price - option_greeks.price) * quantity
+        self._risk = PortfolioRisk(
+            delta=round(delta, 2),
+            gamma=round(gamma, 4),
+            vega=round(vega, 2),
+            theta=round(theta, 2),
+            scenario_pnl={x: round(y, 2) for x, y in scenario_pnl.items()},
+            legs=len(legs),
+            timestamp=int(snapshot.created_at * 1000)
+        )
+        return self._risk
+
+    def publish(self, risk: Optional[PortfolioRisk] = None) -> None:
+        """ Write the risk to redis for the dashboard """
+        risk = risk or self._risk
+        if risk is not None:
+            self._redis_backend.set(self.risk_key, asdict(risk))
+
+    @staticmethod
+    def get_scenario_price(option_greeks: OptionGreeks, forward: float, t: float, r: float):
+        """
+        Price of the option at the forward with its current implied volatility. Options whose iv
+        can not be solved (usually far OTM at the minimum tick) are valued at intrinsic.
+        """
+        if option_greeks.iv is None:
+            if option_greeks.option_type == "CE":
+                intrinsic = max(forward - option_greeks.strike, 0)
+            else:
+                intrinsic = max(option_greeks.strike - forward, 0)
+            return math.exp(-r * t) * intrinsic
+        return black76.price(
+            forward, option_greeks.strike, t, option_greeks.iv, r, option_greeks.option_type
+        )
+
+    @staticmethod
+    def get_scenario_name(move: float) -> str:
+        return f"{move * 100:+g}%"
+
+    @property
+    def risk_key(self) -> str:
+        return f"RISK_{self._client_id}"
+
+    @property
+    def risk(self) -> Optional[PortfolioRisk]:
+        return self._risk
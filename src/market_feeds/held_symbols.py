@@ -0,0 +1,41 @@
+"""
+File:           held_symbols.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 11:05 am
+"""
+from typing import List, Optional, Set
+import json
+
+from src.utils.redis_backend import RedisBackend
+
+
+# Redis hash of client id -> JSON list of the symbols the account holds
+HELD_SYMBOLS_KEY = "FEED_HELD_SYMBOLS"
+
+
+class HeldSymbols:
+    """
+    Symbols of the open positions, shared by the trading process with the market feed. The feed
+    keeps a held symbol subscribed when its strike window is re-centred away from it, so the
+    price of a far hedge is still updated. Each account replaces its own entry.
+    """
+
+    def __init__(self, redis_backend: Optional[RedisBackend] = None):
+        self._redis_backend = redis_backend or RedisBackend()
+
+    def connect(self) -> None:
+        self._redis_backend.connect()
+
+    def hold(self, client_id: str, symbols: List[str]) -> None:
+        """ Set the symbols held by the account. No symbols releases the account entry """
+        if symbols:
+            self._redis_backend.hset(HELD_SYMBOLS_KEY, {client_id: json.dumps(sorted(symbols))})
+        else:
+            self._redis_backend.hdel(HELD_SYMBOLS_KEY, client_id)
+
+    def get(self) -> Set[str]:
+        """ Symbols held by any account """
+        symbols = set()
+        for value in self._redis_backend.hgetall(HELD_SYMBOLS_KEY).values():
+            symbols.update(json.loads(value))
+        return symbols
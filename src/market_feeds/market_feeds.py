@@ -3,12 +3,15 @@ File:           market_feeds.py
 Author:         Dibyaranjan Sathua
 Created on:     09/08/22, 8:32 pm
 """
-from typing import List, Optional
-import datetime
-
 from src.brokerapi.angelbroking import AngelBrokingApi, AngelBrokingSymbolParser, \
-    TokenSymbolMapper
+    AngelBrokingMarketFeed, TokenSymbolMapper
+from src.market_feeds.held_symbols import HeldSymbols
+from src.market_feeds.strike_window import StrikeWindow
 from src.utils import StrategyTicker
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("market_feeds")
 
 
 class MarketFeeds:
@@ -21,7 +24,10 @@ class MarketFeeds:
             totp_key: str,
             symbol_parser: AngelBrokingSymbolParser,
             only_ce_or_pe: bool = True,
-            option_type: str = "CE"
+            option_type: str = "CE",
+            index_mode: str = "LTP",
+            options_mode: str = "SNAP_QUOTE",
+            recentre_strikes: int = 5
     ):
         self._api_key = api_key
         self._client_id = client_id
@@ -35,6 +41,9 @@ class MarketFeeds:
         # is ignored.
         self._only_ce_or_pe = only_ce_or_pe
         self._option_type = option_type
+        # Websocket subscription mode (LTP, QUOTE or SNAP_QUOTE) for index and option tokens
+        self._index_mode = AngelBrokingMarketFeed.get_mode(index_mode)
+        self._options_mode = AngelBrokingMarketFeed.get_mode(options_mode)
         self._api = AngelBrokingApi(
             api_key=api_key, client_id=client_id, password=password, totp_key=totp_key
         )
@@ -42,93 +51,62 @@ class MarketFeeds:
         self._option_tokens = []        # Stores the token for subscribing for web socket data
         self._token_symbol_mapper = TokenSymbolMapper()
         self._ticker = StrategyTicker.get_instance().ticker
+        self._strike_window = StrikeWindow(
+            ticker=self._ticker,
+            symbol_parser=symbol_parser,
+            only_ce_or_pe=only_ce_or_pe,
+            option_type=option_type,
+            recentre_strikes=recentre_strikes
+        )
+        # Symbols of the open positions which are kept subscribed on re-centring
+        self._held_symbols = HeldSymbols()
 
     def setup(self):
         """ Setup required data for live market feeds """
         self._api.login()
         # Just to check if login is successful, fetch user profile
         self._api.get_user_profile()
-        # Get the nifty ltp to determine the ATM price
-        symbol_token = self._symbol_parser.nifty_index_token
-        trading_symbol = ""
-        if self._ticker == "NIFTY":
-            symbol_token = self._symbol_parser.nifty_index_token
-            trading_symbol = "NIFTY"
-        elif self._ticker == "FINNIFTY":
-            symbol_token = self._symbol_parser.finnifty_index_token
-            trading_symbol = "Nifty Fin Service"
+        # Get the index ltp to determine the ATM price
+        symbol_token = self._strike_window.index_token
         data = self._api.get_ltp_data(
-            trading_symbol=trading_symbol,
+            trading_symbol=self._strike_window.index_trading_symbol,
             symbol_token=symbol_token,
             exchange="NSE"
         )
         # Added index to token to symbol mapper
         self._token_symbol_mapper[symbol_token] = self._ticker
-        index = data["ltp"]
-        atm = self.get_nearest_50_strike(index)
-        pe_strikes = None
-        ce_strikes = None
-        if self._only_ce_or_pe:
-            # From one account we get fetch 50 CE strikes and other account 50 PE strikes
-            if self._option_type == "CE":
-                ce_strikes = [atm + (50 * x) for x in range(30)]  # 30 CE strikes (ATM + OTM)
-                ce_strikes += [atm - (50 * x) for x in range(1, 20)]  # 20 CE strikes ITM
-            else:
-                pe_strikes = [atm - (50 * x) for x in range(30)]  # 35 PE strikes (ATM + OTM)
-                pe_strikes += [atm + (50 * x) for x in range(1, 20)]  # 20 PE strikes ITM
-        else:
-            ce_strikes = [atm + (50 * x) for x in range(30)]    # 30 CE strikes (ATM + OTM)
-            ce_strikes += [atm - (50 * x) for x in range(1, 20)]  # 20 CE strikes ITM
-            pe_strikes = [atm - (50 * x) for x in range(30)]    # 30 PE strikes (ATM + OTM)
-            pe_strikes += [atm + (50 * x) for x in range(1, 20)]    # 20 PE strikes ITM
-        # Get the current expiry
-        current_expiry = self._symbol_parser.current_week_expiry
-        self._option_tokens = self.get_option_tokens(
-            expiry=current_expiry, ce_strikes=ce_strikes, pe_strikes=pe_strikes
-        )
+        self._option_tokens = self._strike_window.build(data["ltp"])
+        self._held_symbols.connect()
         # Setup market feed
         self._api.setup_market_feeds()
         self._api.market_feeds.options_tokens = self._option_tokens
         self._api.market_feeds.index_tokens = [symbol_token]
+        self._api.market_feeds.index_mode = self._index_mode
+        self._api.market_feeds.options_mode = self._options_mode
+        self._api.market_feeds.on_index_tick = self.recentre_strike_window
         self._api.market_feeds.connect()
 
-    def get_option_tokens(
-            self,
-            expiry: datetime.date,
-            *,
-            ce_strikes: Optional[List] = None,
-            pe_strikes: Optional[List] = None
-    ):
-        """ Get the option tokens for ce_strikes and pe_strikes """
-        option_tokens = []
-        date_str = expiry.strftime("%d%b%y").upper()
-        for strike in ce_strikes or []:
-            data = self._symbol_parser.get_symbol_data(
-                ticker=self._ticker,
-                strike=strike,
-                expiry=expiry,
-                option_type="CE"
-            )
-            if data is not None and "token" in data:
-                option_tokens.append(data['token'])
-                self._token_symbol_mapper[data['token']] = f"{self._ticker}{date_str}{strike}CE"
-
-        for strike in pe_strikes or []:
-            data = self._symbol_parser.get_symbol_data(
-                ticker=self._ticker,
-                strike=strike,
-                expiry=expiry,
-                option_type="PE"
-            )
-            if data is not None and "token" in data:
-                option_tokens.append(data['token'])
-                self._token_symbol_mapper[data['token']] = f"{self._ticker}{date_str}{strike}PE"
-        return option_tokens
-
-    @staticmethod
-    def get_nearest_50_strike(index: float) -> int:
-        """ Return the nearest 50 strike """
-        return round(index / 50) * 50
+    def recentre_strike_window(self, token: str, index: float) -> None:
+        """
+        Called on every index tick. When the ATM has drifted far enough, move the window to the
+        new ATM by subscribing only the strikes that entered the window and unsubscribing the
+        ones that left it, except the held ones.
+        """
+        if not self._strike_window.needs_recentre(index):
+            return
+        try:
+            held_symbols = self._held_symbols.get()
+        except Exception as err:
+            # Re-centring is postponed to a later tick rather than dropping a held symbol
+            logger.error(f"Unable to read the held symbols. {err}")
+            return
+        atm = self._strike_window.atm
+        changes = self._strike_window.recentre(index, held_symbols)
+        if changes is None:
+            return
+        logger.info(f"Re-centring strike window from ATM {atm} to {self._strike_window.atm}")
+        self._option_tokens = self._strike_window.tokens
+        self._api.market_feeds.update_options_tokens(*changes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+"""
+File:           readiness.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 11:20 pm
+"""
+from typing import List, Optional
+import time
+
+from src.utils.redis_backend import RedisBackend
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("feed_readiness")
+
+
+# Redis key set by the market feed once the index and the option chain are in redis
+FEED_READY_KEY = "FEED_READY"
+
+
+class FeedReadiness:
+    """
+    Explicit readiness signal between the market feed and the trading process. The feed marks
+    itself ready once min_fraction of the subscribed symbols have a price in redis. The trading
+    side waits for the signal instead of sleeping for a fixed time.
+    """
+
+    def __init__(self, redis_backend: Optional[RedisBackend] = None, min_fraction: float = 1.0):
+        self._redis_backend = redis_backend or RedisBackend()
+        self._min_fraction = min_fraction
+
+    def connect(self) -> None:
+        self._redis_backend.connect()
+
+    def check(self, symbols: List[str]) -> bool:
+        """ Mark the feed ready and return True if enough symbols have a price in redis """
+        if not symbols:
+            return False
+        values = self._redis_backend.mget(symbols)
+        available = sum(1 for x in values if isinstance(x, dict) and "ltp" in x)
+        if available < self._min_fraction * len(symbols):
+            logger.info(f"Waiting for market feed. {available} of {len(symbols)} symbols in redis")
+            return False
+        self._redis_backend.set(
+            FEED_READY_KEY, {"symbols": available, "timestamp": int(time.time() * 1000)}
+        )
+        logger.info(f"Market feed is ready with {available} of {len(symbols)} symbols")
+        return True
+
+    def is_ready(self) -> bool:
+        return self._redis_backend.get(FEED_READY_KEY) is not None
+
+    def wait(self, timeout: float, interval: float = 1) -> bool:
+        """ Block till the feed is ready or timeout seconds. Return True if ready """
+        deadline = time.time() + timeout
+        while not self.is_ready():
+            if time.time() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def clear(self) -> None:
+        self._redis_backend.delete(FEED_READY_KEY)
@@ -0,0 +1,174 @@
+"""
+File:           strike_window.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 4:20 pm
+"""
+from typing import List, Optional, Dict, Tuple, Set
+import datetime
+
+from src.brokerapi.angelbroking import AngelBrokingSymbolParser, TokenSymbolMapper
+
+
+class StrikeWindowError(Exception):
+    """ Raised for an unsupported ticker or a ticker without an index token """
+    pass
+
+
+class StrikeWindow:
+    """
+    Option strikes subscribed around the ATM of one underlying. The window is re-centred once
+    the ATM moves recentre_strikes strikes away from the ATM used to build it. Held symbols out
+    of the new window stay subscribed till they are released.
+    """
+    # Strike interval of the weekly options of each supported ticker
+    STRIKE_STEPS = {"NIFTY": 50, "BANKNIFTY": 100, "FINNIFTY": 50}
+
+    def __init__(
+            self,
+            ticker: str,
+            symbol_parser: AngelBrokingSymbolParser,
+            only_ce_or_pe: bool = False,
+            option_type: str = "CE",
+            recentre_strikes: int = 5
+    ):
+        if ticker not in self.STRIKE_STEPS:
+            raise StrikeWindowError(
+                f"Unsupported ticker {ticker}. Supported tickers are {list(self.STRIKE_STEPS)}"
+            )
+        self._ticker = ticker
+        self._strike_step = self.STRIKE_STEPS[ticker]
+        self._symbol_parser = symbol_parser
+        self._only_ce_or_pe = only_ce_or_pe
+        self._option_type = option_type
+        self._recentre_strikes = recentre_strikes
+        self._expiry: Optional[datetime.date] = symbol_parser.current_week_expiry
+        self._atm: Optional[int] = None
+        self._tokens: List[str] = []
+        self._token_symbol_mapper = TokenSymbolMapper()
+        # Cache of (strike, option_type) -> token so that re-centring only looks up new strikes
+        self._strike_tokens: Dict[Tuple[int, str], Optional[str]] = dict()
+
+    def build(self, index: float) -> List[str]:
+        """ Build the window around the index and return the option tokens """
+        self._atm = self.get_nearest_strike(index)
+        ce_strikes, pe_strikes = self.get_strikes(self._atm)
+        self._tokens = self.get_option_tokens(ce_strikes=ce_strikes, pe_strikes=pe_strikes)
+        return self._tokens
+
+    def needs_recentre(self, index: float) -> bool:
+        atm = self.get_nearest_strike(index)
+        return self._atm is not None and \
+            abs(atm - self._atm) >= self._recentre_strikes * self._strike_step
+
+    def recentre(
+            self, index: float, held_symbols: Optional[Set[str]] = None
+    ) -> Optional[Tuple[List[str], List[str]]]:
+        """
+        Return the tokens to subscribe and unsubscribe if the window needs to be re-centred
+        for the index, else None. Tokens of held_symbols are not unsubscribed.
+        """
+        if not self.needs_recentre(index):
+            return None
+        atm = self.get_nearest_strike(index)
+        ce_strikes, pe_strikes = self.get_strikes(atm)
+        tokens = self.get_option_tokens(ce_strikes=ce_strikes, pe_strikes=pe_strikes)
+        current = set(self._tokens)
+        latest = set(tokens)
+        held_symbols = held_symbols or set()
+        subscribe = [x for x in tokens if x not in current]
+        unsubscribe = []
+        for token in self._tokens:
+            if token in latest:
+                continue
+            if self._token_symbol_mapper[token] in held_symbols:
+                tokens.append(token)
+            else:
+                unsubscribe.append(token)
+        self._atm = atm
+        self._tokens = tokens
+        return subscribe, unsubscribe
+
+    def get_strikes(self, atm: int) -> Tuple[Optional[List], Optional[List]]:
+        """ Return the CE and PE strikes to subscribe around the atm """
+        step = self._strike_step
+        pe_strikes = None
+        ce_strikes = None
+        if not self._only_ce_or_pe or self._option_type == "CE":
+            ce_strikes = [atm + (step * x) for x in range(30)]      # 30 CE strikes (ATM + OTM)
+            ce_strikes += [atm - (step * x) for x in range(1, 20)]  # 20 CE strikes ITM
+        if not self._only_ce_or_pe or self._option_type == "PE":
+            pe_strikes = [atm - (step * x) for x in range(30)]      # 30 PE strikes (ATM + OTM)
+            pe_strikes += [atm + (step * x) for x in range(1, 20)]  # 20 PE strikes ITM
+        return ce_strikes, pe_strikes
+
+    def get_option_tokens(
+            self,
+            *,
+            ce_strikes: Optional[List] = None,
+            pe_strikes: Optional[List] = None
+    ) -> List[str]:
+        """ Get the option tokens for ce_strikes and pe_strikes """
+        option_tokens = []
+        for strike in ce_strikes or []:
+            token = self.get_option_token(strike, "CE")
+            if token is not None:
+                option_tokens.append(token)
+
+        for strike in pe_strikes or []:
+            token = self.get_option_token(strike, "PE")
+            if token is not None:
+                option_tokens.append(token)
+        return option_tokens
+
+    def get_option_token(self, strike: int, option_type: str) -> Optional[str]:
+        """ Return the token of the strike and add it to token symbol mapper """
+        key = (strike, option_type)
+        if key not in self._strike_tokens:
+            data = self._symbol_parser.get_symbol_data(
+                ticker=self._ticker,
+                strike=strike,
+                expiry=self._expiry,
+                option_type=option_type
+            )
+            token = None
+            if data is not None and "token" in data:
+                token = data['token']
+                date_str = self._expiry.strftime("%d%b%y").upper()
+                self._token_symbol_mapper[token] = f"{self._ticker}{date_str}{strike}{option_type}"
+            self._strike_tokens[key] = token
+        return self._strike_tokens[key]
+
+    def get_nearest_strike(self, index: float) -> int:
+        return round(index / self._strike_step) * self._strike_step
+
+    @property
+    def index_token(self) -> str:
+        index_tokens = {
+            "NIFTY": self._symbol_parser.nifty_index_token,
+            "BANKNIFTY": self._symbol_parser.banknifty_index_token,
+            "FINNIFTY": self._symbol_parser.finnifty_index_token
+        }
+        token = index_tokens[self._ticker]
+        if not token:
+            raise StrikeWindowError(f"{self._ticker} index token is missing in the symbol master")
+        return token
+
+    @property
+    def strike_step(self) -> int:
+        return self._strike_step
+
+    @property
+    def index_trading_symbol(self) -> str:
+        return AngelBrokingSymbolParser.INDEX_TRADING_SYMBOL.get(self._ticker, self._ticker)
+
+    @property
+    def ticker(self) -> str:
+        return self._ticker
+
+    @property
+    def atm(self) -> Optional[int]:
+        return self._atm
+
+    @property
+    def tokens(self) -> List[str]:
+        return self._tokens
@@ -0,0 +1,355 @@
+"""
+File:           supervisor.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 4:45 pm
+"""
+from typing import List, Optional, Dict
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+from src.brokerapi.angelbroking import AngelBrokingApi, AngelBrokingSymbolParser, \
+    AngelBrokingMarketFeed, TokenSymbolMapper
+from src.market_feeds.held_symbols import HeldSymbols
+from src.market_feeds.strike_window import StrikeWindow
+from src.market_feeds.readiness import FeedReadiness
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("feed_supervisor")
+
+
+class FeedSupervisorError(Exception):
+    """ Raised when the tokens do not fit in the websocket connections or a ticker is repeated """
+    pass
+
+
+def shard_tokens(tokens: List[str], capacities: List[int]) -> List[List[str]]:
+    """
+    Split tokens across connections. Each token goes to the connection with the most free
+    capacity so that the load is balanced and no connection is above its capacity.
+    """
+    if len(tokens) > sum(capacities):
+        raise FeedSupervisorError(
+            f"{len(tokens)} tokens exceeds the total websocket capacity {sum(capacities)}"
+        )
+    shards: List[List[str]] = [[] for _ in capacities]
+    for token in tokens:
+        index = max(range(len(capacities)), key=lambda x: capacities[x] - len(shards[x]))
+        shards[index].append(token)
+    return shards
+
+
+class FeedConnection:
+    """
+    One market feed account and its websocket connection. The connection runs in its own
+    thread or, when an event loop is given, as a task on the shared event loop.
+    """
+
+    def __init__(
+            self,
+            account: Dict,
+            capacity: int,
+            index_mode: int,
+            options_mode: int,
+            loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self._client_id = account["client_id"]
+        self._capacity = capacity
+        self._index_mode = index_mode
+        self._options_mode = options_mode
+        self._api = AngelBrokingApi(
+            api_key=account["api_key"],
+            client_id=account["client_id"],
+            password=account["password"],
+            totp_key=account["totp_key"]
+        )
+        self._loop = loop
+        self._thread: Optional[threading.Thread] = None
+        self._future: Optional[concurrent.futures.Future] = None
+
+    def login(self):
+        self._api.login()
+        # Just to check if login is successful, fetch user profile
+        self._api.get_user_profile()
+
+    def start(self, index_tokens: List[str], options_tokens: List[str], on_index_tick) -> None:
+        """ Create the websocket with the tokens and run it """
+        self._api.setup_market_feeds(use_asyncio=self._loop is not None)
+        self.market_feeds.index_tokens = list(index_tokens)
+        self.market_feeds.options_tokens = list(options_tokens)
+        self.market_feeds.index_mode = self._index_mode
+        self.market_feeds.options_mode = self._options_mode
+        self.market_feeds.on_index_tick = on_index_tick
+        if self._loop is not None:
+            self._future = asyncio.run_coroutine_threadsafe(
+                self.market_feeds.connect(), self._loop
+            )
+        else:
+            self._thread = threading.Thread(
+                target=self.market_feeds.connect, name=f"feed-{self._client_id}", daemon=True
+            )
+            self._thread.start()
+        logger.info(
+            f"Started feed connection {self._client_id} with {len(index_tokens)} index tokens "
+            f"and {len(options_tokens)} option tokens"
+        )
+
+    def get_api(self) -> AngelBrokingApi:
+        return self._api
+
+    @property
+    def client_id(self) -> str:
+        return self._client_id
+
+    @property
+    def market_feeds(self) -> Optional[AngelBrokingMarketFeed]:
+        return self._api.market_feeds
+
+    @property
+    def alive(self) -> bool:
+        if self._future is not None:
+            return not self._future.done()
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def tokens(self) -> List[str]:
+        if self.market_feeds is None:
+            return []
+        return self.market_feeds.index_tokens + self.market_feeds.options_tokens
+
+    @property
+    def free_capacity(self) -> int:
+        return self._capacity - len(self.tokens)
+
+
+class FeedSupervisor:
+    """
+    Run the market feed for one or more underlyings from a single process. The index and option
+    tokens of every underlying are sharded across the market feed accounts (one websocket
+    connection per account) within the per connection token limit. When a connection drops, its
+    tokens are moved to the remaining connections and the account is logged in again.
+    Symbols held by the trading process stay subscribed when a strike window is re-centred.
+    With use_asyncio, all the connections and their redis writers run in one event loop thread.
+    """
+    # SmartStream allows 1000 token subscriptions per websocket session
+    MAX_TOKENS_PER_CONNECTION = 1000
+    # Seconds between the readiness checks till the chain is in redis
+    READY_CHECK_INTERVAL = 1
+
+    def __init__(
+            self,
+            accounts: List[Dict],
+            symbol_parser: AngelBrokingSymbolParser,
+            tickers: List[str],
+            index_mode: str = "LTP",
+            options_mode: str = "SNAP_QUOTE",
+            recentre_strikes: int = 5,
+            max_tokens_per_connection: int = MAX_TOKENS_PER_CONNECTION,
+            monitor_interval: float = 5,
+            reconnect_delay: float = 30,
+            use_asyncio: bool = False
+    ):
+        self._accounts = accounts
+        self._symbol_parser = symbol_parser
+        self._index_mode = AngelBrokingMarketFeed.get_mode(index_mode)
+        self._options_mode = AngelBrokingMarketFeed.get_mode(options_mode)
+        self._max_tokens_per_connection = max_tokens_per_connection
+        self._monitor_interval = monitor_interval
+        self._reconnect_delay = reconnect_delay
+        self._token_symbol_mapper = TokenSymbolMapper()
+        # Index token -> strike window of the underlying
+        self._strike_windows: Dict[str, StrikeWindow] = dict()
+        for ticker in tickers:
+            strike_window = StrikeWindow(ticker, symbol_parser, recentre_strikes=recentre_strikes)
+            if strike_window.index_token in self._strike_windows:
+                raise FeedSupervisorError(f"{ticker} is listed more than once")
+            self._strike_windows[strike_window.index_token] = strike_window
+        self._connections: List[FeedConnection] = []
+        # Connections that dropped and the time after which they are logged in again
+        self._dropped: Dict[str, float] = dict()
+        # Tokens that did not fit in the connections that are alive
+        self._unassigned_index: List[str] = []
+        self._unassigned_options: List[str] = []
+        self._lock = threading.RLock()
+        self._stop = False
+        self._readiness = FeedReadiness()
+        self._ready = False
+        # Symbols of the open positions which are kept subscribed on re-centring
+        self._held_symbols = HeldSymbols()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        if use_asyncio:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name="feed-loop", daemon=True).start()
+
+    def setup(self):
+        """ Login every account, build the strike windows and start the connections """
+        self._readiness.connect()
+        self._readiness.clear()
+        self._held_symbols.connect()
+        for account in self._accounts:
+            connection = self.create_connection(account)
+            connection.login()
+            self._connections.append(connection)
+        api = self._connections[0].get_api()
+        index_tokens = []
+        options_tokens = []
+        for index_token, strike_window in self._strike_windows.items():
+            data = api.get_ltp_data(
+                trading_symbol=strike_window.index_trading_symbol,
+                symbol_token=index_token,
+                exchange="NSE"
+            )
+            self._token_symbol_mapper[index_token] = strike_window.ticker
+            index_tokens.append(index_token)
+            options_tokens += strike_window.build(data["ltp"])
+        capacities = [self._max_tokens_per_connection] * len(self._connections)
+        index_shards = shard_tokens(index_tokens, capacities)
+        capacities = [x - len(y) for x, y in zip(capacities, index_shards)]
+        options_shards = shard_tokens(options_tokens, capacities)
+        for connection, index_shard, options_shard in zip(
+                self._connections, index_shards, options_shards
+        ):
+            connection.start(index_shard, options_shard, self.on_index_tick)
+
+    def create_connection(self, account: Dict) -> FeedConnection:
+        return FeedConnection(
+            account=account,
+            capacity=self._max_tokens_per_connection,
+            index_mode=self._index_mode,
+            options_mode=self._options_mode,
+            loop=self._loop
+        )
+
+    def run(self):
+        """ Monitor the connections and signal readiness. Blocks until stop is set """
+        while not self._stop:
+            if not self._ready:
+                self._ready = self.check_ready()
+            self.check_connections()
+            time.sleep(self._monitor_interval if self._ready else self.READY_CHECK_INTERVAL)
+
+    def check_ready(self) -> bool:
+        """ Set the readiness signal once every index and option symbol has a price in redis """
+        with self._lock:
+            tokens = list(self._strike_windows)
+            for strike_window in self._strike_windows.values():
+                tokens += strike_window.tokens
+        return self._readiness.check([self._token_symbol_mapper[x] for x in tokens])
+
+    def check_connections(self):
+        """ Rebalance the tokens of dropped connections and login them again after a delay """
+        with self._lock:
+            for connection in list(self._connections):
+                if connection.alive:
+                    continue
+                logger.error(f"Feed connection {connection.client_id} dropped")
+                self._connections.remove(connection)
+                self._dropped[connection.client_id] = time.time() + self._reconnect_delay
+                self.assign(
+                    connection.market_feeds.index_tokens, connection.market_feeds.options_tokens
+                )
+            # Tokens which did not fit earlier are assigned once a connection has capacity
+            has_capacity = any(x.free_capacity > 0 for x in self._connections)
+            if has_capacity and (self._unassigned_index or self._unassigned_options):
+                index_tokens, self._unassigned_index = self._unassigned_index, []
+                options_tokens, self._unassigned_options = self._unassigned_options, []
+                self.assign(index_tokens, options_tokens)
+        # Login is done outside the lock so that the index ticks are not blocked
+        for account in self._accounts:
+            retry_at = self._dropped.get(account["client_id"])
+            if retry_at is None or time.time() < retry_at:
+                continue
+            connection = self.create_connection(account)
+            try:
+                connection.login()
+                connection.start([], [], self.on_index_tick)
+            except Exception as err:
+                logger.error(f"Unable to reconnect feed account {account['client_id']}")
+                logger.error(err)
+                self._dropped[account["client_id"]] = time.time() + self._reconnect_delay
+                continue
+            with self._lock:
+                self._connections.append(connection)
+                self._dropped.pop(account["client_id"])
+
+    def assign(self, index_tokens: List[str], options_tokens: List[str]) -> None:
+        """
+        Subscribe the tokens on the connections that are alive. Tokens which do not fit are kept
+        as unassigned, the index first and then the strikes nearest to the ATM which are first
+        in the window.
+        """
+        capacities = [x.free_capacity for x in self._connections]
+        available = sum(capacities)
+        index_tokens, unassigned_index = index_tokens[:available], index_tokens[available:]
+        available -= len(index_tokens)
+        options_tokens, unassigned_options = options_tokens[:available], options_tokens[available:]
+        if unassigned_index or unassigned_options:
+            logger.error(
+                f"Feed connections are full. {len(unassigned_index) + len(unassigned_options)} "
+                f"tokens are not subscribed"
+            )
+            self._unassigned_index += unassigned_index
+            self._unassigned_options += unassigned_options
+        index_shards = shard_tokens(index_tokens, capacities)
+        capacities = [x - len(y) for x, y in zip(capacities, index_shards)]
+        options_shards = shard_tokens(options_tokens, capacities)
+        for connection, index_shard, options_shard in zip(
+                self._connections, index_shards, options_shards
+        ):
+            try:
+                if index_shard:
+                    connection.market_feeds.update_index_tokens(index_shard, [])
+                if options_shard:
+                    connection.market_feeds.update_options_tokens(options_shard, [])
+            except Exception as err:
+                # Tokens are already added to the connection and are subscribed when the
+                # websocket opens.
+                logger.error(f"Unable to subscribe tokens on {connection.client_id}")
+                logger.error(err)
+
+    def on_index_tick(self, token: str, index: float) -> None:
+        """ Re-centre the strike window of the underlying across the connections """
+        strike_window = self._strike_windows.get(token)
+        if strike_window is None or not strike_window.needs_recentre(index):
+            return
+        try:
+            held_symbols = self._held_symbols.get()
+        except Exception as err:
+            # Re-centring is postponed to a later tick rather than dropping a held symbol
+            logger.error(f"Unable to read the held symbols. {err}")
+            return
+        with self._lock:
+            atm = strike_window.atm
+            changes = strike_window.recentre(index, held_symbols)
+            if changes is None:
+                return
+            subscribe, unsubscribe = changes
+            logger.info(
+                f"Re-centring {strike_window.ticker} strike window from ATM {atm} to "
+                f"{strike_window.atm}"
+            )
+            removed = set(unsubscribe)
+            self._unassigned_options = [x for x in self._unassigned_options if x not in removed]
+            for connection in self._connections:
+                tokens = [x for x in connection.market_feeds.options_tokens if x in removed]
+                if tokens:
+                    connection.market_feeds.update_options_tokens([], tokens)
+            self.assign([], subscribe)
+
+    @property
+    def connections(self) -> List[FeedConnection]:
+        return self._connections
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    @property
+    def stop(self) -> bool:
+        return self._stop
+
+    @stop.setter
+    def stop(self, value: bool) -> None:
+        self._stop = value
@@ -0,0 +1,107 @@
+"""
+File:           tick_events.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 12:45 am
+"""
+from typing import Optional, Iterable, Set
+import threading
+
+from src.utils.redis_backend import RedisBackend
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("tick_events")
+
+
+# The market feed publishes the symbol on TICK:<symbol> whenever it saves a tick
+TICK_CHANNEL_PREFIX = "TICK:"
+
+
+def get_tick_channel(symbol: str) -> str:
+    return f"{TICK_CHANNEL_PREFIX}{symbol}"
+
+
+class TickEvents:
+    """
+    Wake a loop on the ticks of the watched symbols instead of polling. A listener thread reads
+    the redis pub/sub messages and wait() returns the kind of events ("tick" and / or "control")
+    received since the last call. Ticks are coalesced, so a burst of ticks wakes the loop once.
+    Other threads wake the loop with notify(), e.g. with "control" for an operator command.
+    """
+    TICK = "tick"
+    CONTROL = "control"
+    # The listener applies subscription changes at least this often
+    POLL_TIMEOUT = 0.1
+
+    def __init__(self, redis_backend: Optional[RedisBackend] = None):
+        self._redis_backend = redis_backend or RedisBackend()
+        self._condition = threading.Condition()
+        self._events: Set[str] = set()
+        self._watched: Set[str] = set()
+        self._subscribed: Set[str] = set()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = False
+
+    def connect(self) -> None:
+        if self._thread is not None:
+            return
+        self._redis_backend.connect()
+        self._stop = False
+        self._thread = threading.Thread(target=self._listen, name="tick-events", daemon=True)
+        self._thread.start()
+
+    def watch(self, symbols: Iterable[str]) -> None:
+        """ Symbols whose ticks wake the loop. Replaces the previous set """
+        self._watched = set(symbols)
+
+    def wait(self, timeout: float) -> Set[str]:
+        """ Block till an event or timeout seconds. Return the events, empty on timeout """
+        with self._condition:
+            if not self._events:
+                self._condition.wait(max(timeout, 0))
+            events, self._events = self._events, set()
+        return events
+
+    def close(self) -> None:
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def notify(self, event: str) -> None:
+        with self._condition:
+            self._events.add(event)
+            self._condition.notify_all()
+
+    def _listen(self) -> None:
+        pubsub = self._redis_backend.pubsub()
+        try:
+            while not self._stop:
+                self._update_subscriptions(pubsub)
+                try:
+                    message = pubsub.get_message(timeout=self.POLL_TIMEOUT)
+                except Exception as err:
+                    logger.error(f"Error reading tick events: {err}")
+                    self._stop_wait(1)
+                    continue
+                if message is not None and message["type"] == "message":
+                    self.notify(self.TICK)
+        finally:
+            pubsub.close()
+
+    def _update_subscriptions(self, pubsub) -> None:
+        watched = self._watched
+        if watched == self._subscribed:
+            return
+        subscribe = watched - self._subscribed
+        unsubscribe = self._subscribed - watched
+        if subscribe:
+            pubsub.subscribe(*[get_tick_channel(x) for x in subscribe])
+        if unsubscribe:
+            pubsub.unsubscribe(*[get_tick_channel(x) for x in unsubscribe])
+        self._subscribed = watched
+
+    def _stop_wait(self, seconds: float) -> None:
+        """ Back off after a redis error """
+        with self._condition:
+            self._condition.wait(seconds)
@@ -0,0 +1,6 @@
+"""
+File:           __init__.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 12:05 am
+"""
+from .metrics import MetricsRegistry, MetricsServer, Counter, Gauge, Histogram
@@ -0,0 +1,290 @@
+"""
+File:           metrics.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 12:05 am
+"""
+from typing import Optional, Dict, Tuple, List, Iterable
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import bisect
+import math
+import threading
+import time
+
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("metrics")
+
+
+class MetricsError(Exception):
+    """ Raised when a metric is registered again with a different type or labels """
+    pass
+
+
+class Metric:
+    """
+    Base class of a metric. A metric with label names holds one child per label values, got with
+    labels(). Keep the child in a variable on hot paths to skip the lookup.
+    """
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self._name = name
+        self._documentation = documentation
+        self._label_names = label_names
+        self._children: Dict[Tuple[str, ...], "Metric"] = dict()
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> "Metric":
+        values = tuple(str(x) for x in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self._label_names):
+                raise MetricsError(f"{self._name} expects labels {self._label_names}")
+            with self._lock:
+                child = self._children.setdefault(values, self.new_child())
+        return child
+
+    def new_child(self) -> "Metric":
+        return self.__class__(self._name, self._documentation)
+
+    def get_samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        """ (name suffix, labels, value) of the metric """
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self._name} {self._documentation}",
+            f"# TYPE {self._name} {self.TYPE}"
+        ]
+        if self._label_names:
+            metrics = [
+                (dict(zip(self._label_names, x)), y) for x, y in list(self._children.items())
+            ]
+        else:
+            metrics = [(dict(), self)]
+        for labels, metric in metrics:
+            for suffix, sample_labels, value in metric.get_samples():
+                all_labels = {**labels, **sample_labels}
+                label_str = ",".join(f'{x}="{y}"' for x, y in all_labels.items())
+                label_str = f"{{{label_str}}}" if label_str else ""
+                lines.append(f"{self._name}{suffix}{label_str} {self.format_value(value)}")
+        return lines
+
+    @staticmethod
+    def format_value(value: float) -> str:
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(float(value))
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def label_names(self) -> Tuple[str, ...]:
+        return self._label_names
+
+
+class Counter(Metric):
+    """ Monotonically increasing value like ticks received or order retries """
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        super(Counter, self).__init__(name, documentation, label_names)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def get_samples(self):
+        return [("_total", dict(), self._value)]
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge(Metric):
+    """ Value that goes up and down like pnl or number of stale symbols """
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        super(Gauge, self).__init__(name, documentation, label_names)
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def get_samples(self):
+        return [("", dict(), self._value)]
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram(Metric):
+    """ Distribution of durations in seconds like redis write or order latency """
+    TYPE = "histogram"
+    BUCKETS = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+        5, 10
+    )
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = BUCKETS
+    ):
+        super(Histogram, self).__init__(name, documentation, label_names)
+        self._buckets = tuple(sorted(buckets))
+        # Count per bucket. Cumulated only when rendered so that observe is a single increment.
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+
+    def new_child(self) -> "Histogram":
+        return Histogram(self._name, self._documentation, buckets=self._buckets)
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self) -> "HistogramTimer":
+        """ Context manager observing the duration of the block """
+        return HistogramTimer(self)
+
+    def get_samples(self):
+        samples = []
+        cumulative = 0
+        for bucket, count in zip(self._buckets + (math.inf,), list(self._counts)):
+            cumulative += count
+            samples.append(("_bucket", {"le": self.format_value(bucket)}, cumulative))
+        samples.append(("_sum", dict(), self._sum))
+        samples.append(("_count", dict(), cumulative))
+        return samples
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+
+class HistogramTimer:
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+        self._start: float = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class MetricsRegistry:
+    """
+    In-process registry of the metrics of the feed and the trading process. The same metric is
+    returned when it is asked again, so modules can define their metrics at import.
+    """
+    __INSTANCE: Optional["MetricsRegistry"] = None
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "MetricsRegistry":
+        """ Return instance of this class. This is a singleton class """
+        if cls.__INSTANCE is None:
+            cls.__INSTANCE = MetricsRegistry()
+        return cls.__INSTANCE
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, label_names)
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = Histogram.BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def _register(self, metric_class, name: str, documentation: str, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, documentation, tuple(label_names), **kwargs)
+                self._metrics[name] = metric
+            elif type(metric) != metric_class or metric.label_names != tuple(label_names):
+                raise MetricsError(f"Metric {name} is already registered as a different metric")
+            return metric
+
+    def render(self) -> str:
+        """ All the metrics in Prometheus text exposition format """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """ Serve the registry on http://host:port/metrics in a background thread """
+
+    def __init__(
+            self, port: int, host: str = "127.0.0.1", registry: Optional[MetricsRegistry] = None
+    ):
+        self._host = host
+        self._port = port
+        self._registry = registry or MetricsRegistry.get_instance()
+        self._http_server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> None:
+        registry = self._registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._http_server = ThreadingHTTPServer((self._host, self._port), Handler)
+        self._http_server.daemon_threads = True
+        threading.Thread(target=self._http_server.serve_forever, daemon=True).start()
+        logger.info(f"Serving metrics on http://{self._host}:{self._port}/metrics")
+
+    def stop(self) -> None:
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+
+    @property
+    def port(self) -> int:
+        """ Bound port. Useful when started on port 0 """
+        return self._http_server.server_address[1] if self._http_server else self._port
@@ -3,19 +3,38 @@ File:           price_monitor.py
 Author:         Dibyaranjan Sathua
 Created on:     18/08/22, 5:58 pm
 """
-from typing import Optional, Callable, List
-from dataclasses import dataclass
+from typing import Optional, Callable, List, Dict, Tuple
+from dataclasses import dataclass, field, asdict
+import bisect
+import contextlib
 import datetime
 import time
 import threading
 
 from src.brokerapi.angelbroking.api import AngelBrokingSymbolParser
+from src.brokerapi.angelbroking.feed_health import STALENESS_KEY
+from src.greeks import GreeksEngine, OptionGreeks
+from src.market_feeds.tick_events import TickEvents
+from src.metrics import MetricsRegistry
+from src.strategies.instrument import Action
 from src.utils.redis_backend import RedisBackend
 from src.utils import StrategyTicker
 from src.utils.logger import LogFacade
 
 
-logger: LogFacade = LogFacade.get_logger("price_monitor")
+logger: LogFacade = LogFacade.get_logger("price_monitor", rate_limit=10)
+metrics: MetricsRegistry = MetricsRegistry.get_instance()
+LOOP_SECONDS = metrics.histogram(
+    "price_monitor_loop_seconds", "Time of one price monitor iteration without the wait"
+)
+PRICE_AGE_SECONDS = metrics.histogram(
+    "price_age_seconds",
+    "Age of the prices read for trading",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300, 1800)
+)
+STALE_SYMBOLS = metrics.gauge(
+    "price_monitor_stale_symbols", "Registered symbols skipped as the feed marked them stale"
+)
 
 
 class PriceMonitorError(Exception):
@@ -40,17 +59,179 @@ class PriceRegister:
         return self.symbol
 
 
+class PremiumLadder:
+    """
+    Strikes of one option type ordered from ITM to OTM with strictly falling premium, so that a
+    strike can be selected by premium with a binary search. The ladder keeps the longest run of
+    strikes on each side of the ATM whose premium falls (OTM side) or rises (ITM side) from the
+    ATM. An illiquid strike out of order with the rest is skipped, as its last traded price is
+    out of date, without cutting off the strikes after it.
+    """
+
+    def __init__(self, atm: int, strikes: List[int], prices: List[float], option_type: str):
+        # strikes are ascending. CE premium falls with the strike and PE premium rises.
+        pairs = list(zip(strikes, prices))
+        if option_type == "PE":
+            pairs.reverse()
+        atm_index = next((i for i, (x, _) in enumerate(pairs) if x == atm), None)
+        self._strikes: List[int] = []
+        # Negative premiums so that the list is ascending for bisect
+        self._keys: List[float] = []
+        self._atm_index = 0
+        if atm_index is None:
+            return
+        # Outward from the ATM, ITM premium rises and OTM premium falls
+        atm_price = pairs[atm_index][1]
+        itm_pairs = pairs[:atm_index][::-1]
+        otm_pairs = pairs[atm_index + 1:]
+        itm = self.longest_rising(itm_pairs, [y for _, y in itm_pairs], atm_price)
+        otm = self.longest_rising(otm_pairs, [-y for _, y in otm_pairs], -atm_price)
+        ladder = itm[::-1] + [pairs[atm_index]] + otm
+        self._atm_index = len(itm)
+        self._strikes = [x for x, _ in ladder]
+        self._keys = [-y for _, y in ladder]
+
+    @staticmethod
+    def longest_rising(
+            pairs: List[Tuple[int, float]], keys: List[float], start: float
+    ) -> List[Tuple[int, float]]:
+        """
+        Longest subsequence of pairs whose keys strictly rise from start. Patience sorting, where
+        tails[k] is the index of the smallest key ending a subsequence of length k + 1.
+        """
+        tails: List[int] = []
+        tail_keys: List[float] = []
+        previous: List[Optional[int]] = [None] * len(pairs)
+        for i, key in enumerate(keys):
+            if key <= start:
+                continue
+            position = bisect.bisect_left(tail_keys, key)
+            previous[i] = tails[position - 1] if position > 0 else None
+            if position == len(tails):
+                tails.append(i)
+                tail_keys.append(key)
+            else:
+                tails[position] = i
+                tail_keys[position] = key
+        subsequence = []
+        index = tails[-1] if tails else None
+        while index is not None:
+            subsequence.append(pairs[index])
+            index = previous[index]
+        return subsequence[::-1]
+
+    def get_nearest(self, price: float) -> Optional[int]:
+        """ Strike with premium nearest to price. A tie goes to the strike nearer to the ATM """
+        if not self._strikes:
+            return None
+        index = bisect.bisect_left(self._keys, -price)
+        candidates = [x for x in (index - 1, index) if 0 <= x < len(self._keys)]
+        best = min(
+            candidates,
+            key=lambda x: (abs(price + self._keys[x]), abs(x - self._atm_index))
+        )
+        return self._strikes[best]
+
+    def get_first_below(self, price: float) -> Optional[int]:
+        """
+        First strike from the ATM with premium less than price. The strikes are scanned towards
+        ITM when the price is more than the ATM premium, else towards OTM.
+        """
+        if not self._strikes:
+            return None
+        if price > -self._keys[self._atm_index]:
+            # Premium rises towards ITM, so only the strike next to the ATM can be less
+            index = self._atm_index - 1
+            return self._strikes[index] if index >= 0 and -self._keys[index] < price else None
+        index = bisect.bisect_right(self._keys, -price)
+        return self._strikes[index] if index < len(self._strikes) else None
+
+    @property
+    def strikes(self) -> List[int]:
+        return self._strikes
+
+    @property
+    def prices(self) -> List[float]:
+        return [-x for x in self._keys]
+
+
+@dataclass(frozen=True)
+class ChainSnapshot:
+    """
+    Index, ATM and the option chain of the current expiry read from redis in one round trip.
+    Strikes are in ascending order and only the strikes around the ATM without a gap in redis are
+    included. quotes has the redis value of every included symbol and the index.
+    """
+    index: float
+    atm: int
+    ce_strikes: List[int]
+    ce_prices: List[float]
+    pe_strikes: List[int]
+    pe_prices: List[float]
+    quotes: Dict[str, dict]
+    created_at: float
+    # (option type, price field) -> premium ladder built from this snapshot
+    premium_ladders: Dict[Tuple[str, str], PremiumLadder] = field(default_factory=dict)
+    # symbol -> greeks computed from this snapshot
+    greeks: Dict[str, OptionGreeks] = field(default_factory=dict)
+
+    def get_quote(self, symbol: str) -> Optional[dict]:
+        return self.quotes.get(symbol)
+
+    def get_ladder(self, option_type: str) -> Tuple[List[int], List[float]]:
+        """ Return the ascending strikes and their ltp of the option type """
+        if option_type == "CE":
+            return self.ce_strikes, self.ce_prices
+        return self.pe_strikes, self.pe_prices
+
+
 class PriceMonitor:
     """ Price monitor class """
     REGISTER: List[PriceRegister] = []
-
-    def __init__(self):
+    # Max age of a price in milliseconds since it was received by the market feed
+    TRADING_MAX_AGE_MS = 1800 * 1000        # 30 min
+    DISPLAY_MAX_AGE_MS = 1800 * 1000
+    STRIKE_STEP = 50
+    # Strikes read on each side of the ATM for a snapshot. The market feed subscribes 30 OTM and
+    # 19 ITM strikes around an ATM which is re-centred when the index moves.
+    SNAPSHOT_STRIKES = 50
+    # The monitor wakes on the ticks of the registered symbols, at most once per
+    # MIN_EVENT_INTERVAL sec, and at least every HEARTBEAT_INTERVAL sec for the staleness check.
+    # Greeks are published at most once per GREEKS_INTERVAL sec.
+    HEARTBEAT_INTERVAL = 2
+    MIN_EVENT_INTERVAL = 0.2
+    GREEKS_INTERVAL = 2
+
+    def __init__(
+            self,
+            trading_max_age_ms: int = TRADING_MAX_AGE_MS,
+            display_max_age_ms: int = DISPLAY_MAX_AGE_MS,
+            max_exchange_lag_ms: Optional[int] = None,
+            publish_greeks: bool = False
+    ):
+        """
+        trading_max_age_ms is used for trading decisions and display_max_age_ms for prices that
+        are only shown or notified. When max_exchange_lag_ms is set, a price received more than
+        max_exchange_lag_ms after its exchange timestamp is also treated as not updated.
+        With publish_greeks, the monitor writes the option chain greeks to redis for the dashboard.
+        """
+        self._trading_max_age_ms = trading_max_age_ms
+        self._display_max_age_ms = display_max_age_ms
+        self._max_exchange_lag_ms = max_exchange_lag_ms
         self._redis_backend = RedisBackend()
         self._symbol_parser: Optional[AngelBrokingSymbolParser] = None
         self._expiry: Optional[datetime.date] = None
         self._expiry_str = ""
         self.stop_monitor = False
         self._ticker = StrategyTicker.get_instance().ticker
+        # Cache of (strike, option_type) -> symbol
+        self._symbols: Dict[Tuple[int, str], str] = dict()
+        # Snapshot used by the thread inside use_snapshot
+        self._local = threading.local()
+        self._publish_greeks = publish_greeks
+        self._greeks_engine: Optional[GreeksEngine] = None
+        self._greeks_published_at: float = 0
+        self._tick_events: TickEvents = TickEvents()
 
     def setup(self):
         """ Setup required class for price monitor """
@@ -58,74 +239,128 @@ class PriceMonitor:
         self._symbol_parser = AngelBrokingSymbolParser.instance()
         self._expiry = self._symbol_parser.current_week_expiry
         self._expiry_str = self._expiry.strftime("%d%b%y").upper()
+        self._symbols.clear()
+
+    def take_snapshot(self) -> ChainSnapshot:
+        """ Read the index and the strikes around the ATM from redis, usually with one MGET """
+        symbol_data = self._redis_backend.get(self._ticker)
+        if symbol_data is None:
+            raise PriceMonitorError(f"{self._ticker} data is missing in redis")
+        self.check_fresh(self._ticker, symbol_data)
+        index = symbol_data["ltp"]
+        atm = self.get_nearest_50_strike(index)
+        quotes = {self._ticker: symbol_data}
+        ladders = self.read_ladders(atm, self.SNAPSHOT_STRIKES)
+        for option_type, (ladder_strikes, ladder_values) in zip(("CE", "PE"), ladders):
+            for strike, value in zip(ladder_strikes, ladder_values):
+                quotes[self.get_symbol(strike, option_type)] = value
+        return ChainSnapshot(
+            index=index,
+            atm=atm,
+            ce_strikes=ladders[0][0],
+            ce_prices=[x["ltp"] for x in ladders[0][1]],
+            pe_strikes=ladders[1][0],
+            pe_prices=[x["ltp"] for x in ladders[1][1]],
+            quotes=quotes,
+            created_at=time.time()
+        )
+
+    def read_ladders(self, atm: int, strikes_each_side: int) -> List[Tuple[List[int], List[dict]]]:
+        """
+        Return the CE and PE (strikes, redis values) around the atm. Like a strike scan, a ladder
+        ends at the first strike missing in redis. The range is doubled and read again if a
+        ladder reaches its end.
+        """
+        while True:
+            strikes = [
+                atm + x * self.STRIKE_STEP for x in range(-strikes_each_side, strikes_each_side + 1)
+            ]
+            symbols = [self.get_symbol(x, y) for y in ("CE", "PE") for x in strikes]
+            values = self._redis_backend.mget(symbols)
+            ladders = []
+            truncated = False
+            for side, option_type in enumerate(("CE", "PE")):
+                side_values = values[side * len(strikes): (side + 1) * len(strikes)]
+                first = last = strikes_each_side
+                if not isinstance(side_values[first], dict):
+                    ladders.append(([], []))
+                    continue
+                while first > 0 and isinstance(side_values[first - 1], dict):
+                    first -= 1
+                while last < len(strikes) - 1 and isinstance(side_values[last + 1], dict):
+                    last += 1
+                truncated |= first == 0 or last == len(strikes) - 1
+                for strike, value in zip(strikes[first:last + 1], side_values[first:last + 1]):
+                    if "ltp" not in value:
+                        raise PriceMonitorError(
+                            f"Strike {strike} {option_type} price ltp key is missing "
+                            f"while reading from redis"
+                        )
+                ladders.append((strikes[first:last + 1], side_values[first:last + 1]))
+            if not truncated:
+                return ladders
+            strikes_each_side *= 2
+
+    @contextlib.contextmanager
+    def use_snapshot(self):
+        """
+        Take one snapshot for the block. Index, ATM, strike selection and symbol prices requested
+        by this thread inside the block are served from the snapshot, so that all the decisions of
+        one strategy loop iteration see the same prices. Nested blocks reuse the outer snapshot.
+        """
+        previous = self.snapshot
+        if previous is not None:
+            yield previous
+            return
+        self._local.snapshot = self.take_snapshot()
+        try:
+            yield self._local.snapshot
+        finally:
+            self._local.snapshot = None
+
+    def get_snapshot(self) -> ChainSnapshot:
+        """ Snapshot of the current use_snapshot block else a new one """
+        snapshot = self.snapshot
+        return snapshot if snapshot is not None else self.take_snapshot()
 
     def get_atm_strike(self):
         """ Return ATM strike """
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return snapshot.atm
         return self.get_nearest_50_strike(self.get_index_value())
 
     def get_index_value(self) -> float:
         """ Return index value """
+        snapshot = self.snapshot
+        if snapshot is not None:
+            return snapshot.index
         symbol_data = self._redis_backend.get(self._ticker)
         if symbol_data is None:
             raise PriceMonitorError(f"{self._ticker} data is missing in redis")
-        now = int(datetime.datetime.now().timestamp())
-        price_last_updated = now - symbol_data["timestamp"]
-        if price_last_updated > 1800:       # 60 * 30 sec = 30 min
-            raise PriceNotUpdatedError(
-                f"{self._ticker} price has not been updated in last 30 minutes"
-            )
+        self.check_fresh(self._ticker, symbol_data)
         return symbol_data["ltp"]
 
-    def get_strike_by_price(self, price: float, option_type: str) -> int:
-        """ Return the strike nearest to the price argument """
-        atm_strike = self.get_atm_strike()
-        selected_strike = atm_strike
-        step = 50 if option_type == "CE" else -50
-        atm_strike_price = self._redis_backend.get(
-            self.get_symbol(strike=atm_strike, option_type=option_type)
-        )
-        if atm_strike_price is None or "ltp" not in atm_strike_price:
-            raise PriceMonitorError(
-                f"Strike {atm_strike} {option_type} price is None or ltp key is missing "
-                f"while reading from redis"
-            )
-        now = int(datetime.datetime.now().timestamp())
-        price_last_updated = now - atm_strike_price["timestamp"]
-        if price_last_updated > 1800:  # 60 * 30 sec = 30 min
-            raise PriceNotUpdatedError(
-                f"Strike {atm_strike} {option_type} price has not been updated in last 30 minutes"
-            )
-        atm_strike_price = atm_strike_price["ltp"]
-        if price > atm_strike_price:   # Scan ITM strikes
-            step *= -1
-        diff = abs(price - atm_strike_price)
-        next_strike = atm_strike
-        while True:
-            next_strike += step
-            next_strike_price = self._redis_backend.get(
-                self.get_symbol(strike=next_strike, option_type=option_type)
-            )
-            # We are done with the strikes
-            if next_strike_price is None:
-                break
-            if "ltp" not in next_strike_price:
-                raise PriceMonitorError(
-                    f"Strike {atm_strike} {option_type} price ltp key is missing "
-                    f"while reading from redis"
-                )
-            next_strike_price = next_strike_price["ltp"]
-            temp_diff = abs(price - next_strike_price)
-            if temp_diff < diff:
-                diff = temp_diff
-                selected_strike = next_strike
-        return selected_strike
+    def get_strike_by_price(self, price: float, option_type: str, price_field: str = "ltp") -> int:
+        """
+        Return the strike nearest to the price argument. price_field can be ltp, bid or ask.
+        bid and ask are available only for strikes subscribed in SNAP_QUOTE mode, else ltp is used.
+        """
+        snapshot = self.get_snapshot()
+        self.check_atm_quote(snapshot, option_type)
+        return self.get_premium_ladder(snapshot, option_type, price_field).get_nearest(price)
 
     def get_strike_by_with_less_price(self, price: float, option_type: str) -> int:
         """ Return the strike with price less then the given price """
-        atm_strike = self.get_atm_strike()
-        selected_strike = atm_strike
-        step = 50 if option_type == "CE" else -50
-        atm_strike_price = self._redis_backend.get(
+        snapshot = self.get_snapshot()
+        self.check_atm_quote(snapshot, option_type)
+        strike = self.get_premium_ladder(snapshot, option_type).get_first_below(price)
+        return snapshot.atm if strike is None else strike
+
+    def check_atm_quote(self, snapshot: ChainSnapshot, option_type: str) -> dict:
+        """ Return the ATM quote of the option type after checking it is present and fresh """
+        atm_strike = snapshot.atm
+        atm_strike_price = snapshot.get_quote(
             self.get_symbol(strike=atm_strike, option_type=option_type)
         )
         if atm_strike_price is None or "ltp" not in atm_strike_price:
@@ -133,76 +368,166 @@ class PriceMonitor:
                 f"Strike {atm_strike} {option_type} price is None or ltp key is missing "
                 f"while reading from redis"
             )
-        now = int(datetime.datetime.now().timestamp())
-        price_last_updated = now - atm_strike_price["timestamp"]
-        if price_last_updated > 1800:  # 60 * 30 sec = 30 min
-            raise PriceNotUpdatedError(
-                f"Strike {atm_strike} {option_type} price has not been updated in last 30 minutes"
-            )
-        atm_strike_price = atm_strike_price["ltp"]
-        if price > atm_strike_price:   # Scan ITM strikes
-            step *= -1
-
-        next_strike = atm_strike
-        while True:
-            next_strike += step
-            next_strike_price = self._redis_backend.get(
-                self.get_symbol(strike=next_strike, option_type=option_type)
-            )
-            # We are done with the strikes
-            if next_strike_price is None:
-                break
-            if "ltp" not in next_strike_price:
-                raise PriceMonitorError(
-                    f"Strike {atm_strike} {option_type} price ltp key is missing "
-                    f"while reading from redis"
-                )
-            next_strike_price = next_strike_price["ltp"]
-            if next_strike_price < price:
-                return next_strike
+        self.check_fresh(f"Strike {atm_strike} {option_type}", atm_strike_price)
+        return atm_strike_price
+
+    def get_premium_ladder(
+            self, snapshot: ChainSnapshot, option_type: str, price_field: str = "ltp"
+    ) -> PremiumLadder:
+        """ Premium ladder of the snapshot. Built once per snapshot, option type and price field """
+        key = (option_type, price_field)
+        ladder = snapshot.premium_ladders.get(key)
+        if ladder is None:
+            strikes, prices = snapshot.get_ladder(option_type)
+            if price_field != "ltp":
+                quotes = [snapshot.get_quote(self.get_symbol(x, option_type)) for x in strikes]
+                prices = [self.get_price_field(x, price_field) for x in quotes]
+            ladder = PremiumLadder(snapshot.atm, strikes, prices, option_type)
+            snapshot.premium_ladders[key] = ladder
+        return ladder
+
+    def get_greeks(self, snapshot: Optional[ChainSnapshot] = None) -> Dict[str, OptionGreeks]:
+        """ Return symbol -> greeks of the snapshot. Computed once per snapshot """
+        snapshot = snapshot or self.get_snapshot()
+        if not snapshot.greeks:
+            snapshot.greeks.update(self.greeks_engine.compute(snapshot, self.get_symbol))
+        return snapshot.greeks
+
+    def get_strike_by_delta(self, delta: float, option_type: str) -> int:
+        """ Return the strike with absolute delta nearest to the absolute value of delta """
+        snapshot = self.get_snapshot()
+        self.check_atm_quote(snapshot, option_type)
+        chain_greeks = self.get_greeks(snapshot)
+        selected_strike = snapshot.atm
+        diff = None
+        for strike in snapshot.get_ladder(option_type)[0]:
+            option_greeks = chain_greeks[self.get_symbol(strike, option_type)]
+            if option_greeks.delta is None:
+                continue
+            temp_diff = abs(abs(option_greeks.delta) - abs(delta))
+            if diff is None or temp_diff < diff:
+                diff = temp_diff
+                selected_strike = strike
         return selected_strike
 
-    def get_price_by_symbol(self, symbol: str):
+    def publish_greeks(self) -> None:
+        """ Write the greeks of the option chain to redis for the dashboard """
+        snapshot = self.take_snapshot()
+        chain_greeks = self.get_greeks(snapshot)
+        self._redis_backend.set(
+            self.greeks_key,
+            {
+                "index": snapshot.index,
+                "atm": snapshot.atm,
+                "timestamp": int(snapshot.created_at * 1000),
+                "greeks": {x: asdict(y) for x, y in chain_greeks.items()}
+            }
+        )
+
+    def get_price_by_symbol(self, symbol: str, display: bool = False):
         """ Return the price of a symbol """
-        symbol_data = self._redis_backend.get(symbol)
+        return self.get_quote_by_symbol(symbol, display=display)["ltp"]
+
+    def get_quote_by_symbol(self, symbol: str, display: bool = False) -> dict:
+        """
+        Return ltp, bid, ask and depth of a symbol. bid and ask are None in LTP mode.
+        display uses the display freshness threshold instead of the trading one.
+        """
+        snapshot = self.snapshot
+        symbol_data = snapshot.get_quote(symbol) if snapshot is not None else None
+        if symbol_data is None:
+            symbol_data = self._redis_backend.get(symbol)
         if symbol_data is None or "ltp" not in symbol_data:
             raise PriceMonitorError(f"{symbol} data is missing in redis")
-        now = int(datetime.datetime.now().timestamp())
-        price_last_updated = now - symbol_data["timestamp"]
-        if price_last_updated > 1800:  # 60 * 30 sec = 30 min
+        max_age_ms = self._display_max_age_ms if display else self._trading_max_age_ms
+        self.check_fresh(f"Strike {symbol}", symbol_data, max_age_ms)
+        return symbol_data
+
+    def check_fresh(self, name: str, symbol_data: dict, max_age_ms: Optional[int] = None) -> None:
+        """
+        Raise PriceNotUpdatedError if the price is older than max_age_ms (trading threshold by
+        default). Works on the value already read from redis.
+        """
+        if max_age_ms is None:
+            max_age_ms = self._trading_max_age_ms
+        received_at = self.get_received_at(symbol_data)
+        age_ms = int(time.time() * 1000) - received_at
+        PRICE_AGE_SECONDS.observe(age_ms / 1000)
+        if age_ms > max_age_ms:
             raise PriceNotUpdatedError(
-                f"Strike {symbol} price has not been updated in last 30 minutes"
+                f"{name} price has not been updated in last {max_age_ms / 1000:g} sec"
             )
-        return symbol_data["ltp"]
+        exchange_timestamp = symbol_data.get("exchange_timestamp")
+        if self._max_exchange_lag_ms is not None and exchange_timestamp:
+            lag_ms = received_at - exchange_timestamp
+            if lag_ms > self._max_exchange_lag_ms:
+                raise PriceNotUpdatedError(f"{name} price is {lag_ms} ms behind the exchange")
+
+    @staticmethod
+    def get_received_at(symbol_data: dict) -> int:
+        """ Epoch milliseconds when the price was received. Older values only have seconds """
+        received_at = symbol_data.get("received_at")
+        return received_at if received_at is not None else symbol_data["timestamp"] * 1000
+
+    def get_age_ms(self, symbol_data: dict) -> int:
+        return int(time.time() * 1000) - self.get_received_at(symbol_data)
+
+    def get_executable_price(self, symbol: str, action: Action) -> float:
+        """
+        Return the price at which a market order is expected to fill. Best ask for BUY and best
+        bid for SELL. Falls back to ltp when the symbol is not subscribed in SNAP_QUOTE mode.
+        """
+        symbol_data = self.get_quote_by_symbol(symbol)
+        return self.get_price_field(symbol_data, "ask" if action == Action.BUY else "bid")
+
+    def get_stale_symbols(self) -> Dict[str, int]:
+        """
+        Symbols whose websocket connection dropped and are not recovered yet, with the epoch
+        seconds since when they are stale. Written by the market feed.
+        """
+        return {x: int(y) for x, y in self._redis_backend.hgetall(STALENESS_KEY).items()}
+
+    def is_stale(self, symbol: str) -> bool:
+        return symbol in self.get_stale_symbols()
+
+    @staticmethod
+    def get_price_field(symbol_data: dict, price_field: str) -> float:
+        """ Return bid, ask or ltp from symbol data. Fallback to ltp if the field is empty """
+        price = symbol_data.get(price_field)
+        return symbol_data["ltp"] if price is None else price
 
     def monitor(self):
         """ Monitor price of a symbol and call appropriate function """
         # Remove the PriceRegister obj when a function is called
+        self._tick_events.connect()
         while True:
             if self.stop_monitor:
                 logger.info(f"Stopping price monitoring")
+                self._tick_events.close()
                 break
+            start = time.perf_counter()
             # Remove the PriceRegister object that is triggered
             triggered_signals: List[PriceRegister] = []
+            stale_symbols = self.get_stale_symbols() if self.REGISTER else {}
+            STALE_SYMBOLS.set(sum(1 for x in self.REGISTER if x.symbol in stale_symbols))
             for reg in self.REGISTER:
-                logger.debug(f"Registered: {reg} with id {id(reg)}")
+                logger.debug("Registered: %s with id %s", reg, id(reg))
                 live_price = self._redis_backend.get(reg.symbol)
                 if live_price is None or "ltp" not in live_price:
                     raise PriceMonitorError(
                         f"{reg.symbol} price is None or ltp key is missing while reading from redis"
                     )
-                now = int(datetime.datetime.now().timestamp())
-                price_last_updated = now - live_price["timestamp"]
-                if price_last_updated > 1800:  # 60 * 30 sec = 30 min
-                    raise PriceNotUpdatedError(
-                        f"Strike {reg.symbol} price has not been updated in last 30 minutes"
-                    )
+                self.check_fresh(f"Strike {reg.symbol}", live_price)
+                if reg.symbol in stale_symbols:
+                    # Do not shift on a frozen price while the feed is reconnecting
+                    logger.warning(f"Skipping {reg.symbol} as the price is stale")
+                    continue
                 live_price = live_price["ltp"]
                 price_diff = live_price - reg.reference_price
-                logger.debug(f"Live price: {live_price}")
-                logger.debug(f"Ref price: {reg.reference_price}")
-                logger.debug(f"Up point: {reg.up_point}")
-                logger.debug(f"Down point: {reg.down_point}")
+                logger.debug("Live price: %s", live_price)
+                logger.debug("Ref price: %s", reg.reference_price)
+                logger.debug("Up point: %s", reg.up_point)
+                logger.debug("Down point: %s", reg.down_point)
                 if price_diff > reg.up_point:
                     logger.info("Shifting triggered")
                     reg.up_func()
@@ -214,7 +539,20 @@ class PriceMonitor:
             for reg in triggered_signals:
                 logger.info(f"Removing reg with id {id(reg)}")
                 self.REGISTER.remove(reg)
-            time.sleep(2)
+            if self._publish_greeks and \
+                    time.perf_counter() - self._greeks_published_at >= self.GREEKS_INTERVAL:
+                self._greeks_published_at = time.perf_counter()
+                try:
+                    self.publish_greeks()
+                except (PriceMonitorError, PriceNotUpdatedError) as err:
+                    logger.warning(f"Unable to publish greeks. {err}")
+            elapsed = time.perf_counter() - start
+            LOOP_SECONDS.observe(elapsed)
+            self._tick_events.watch([x.symbol for x in self.REGISTER])
+            if elapsed < self.MIN_EVENT_INTERVAL:
+                # Ticks received meanwhile are coalesced into one event
+                time.sleep(self.MIN_EVENT_INTERVAL - elapsed)
+            self._tick_events.wait(self.HEARTBEAT_INTERVAL)
 
     def run_in_background(self):
         """ Run the monitor in background """
@@ -248,13 +586,42 @@ class PriceMonitor:
         cls.REGISTER.remove(price_register)
 
     def get_symbol(self, strike: int, option_type: str) -> str:
-        return f"{self._ticker}{self._expiry_str}{strike}{option_type}"
+        key = (strike, option_type)
+        symbol = self._symbols.get(key)
+        if symbol is None:
+            symbol = f"{self._ticker}{self._expiry_str}{strike}{option_type}"
+            self._symbols[key] = symbol
+        return symbol
 
     @staticmethod
     def get_nearest_50_strike(index: float) -> int:
         """ Return the nearest 50 strike """
         return round(index / 50) * 50
 
+    @property
+    def greeks_engine(self) -> GreeksEngine:
+        if self._greeks_engine is None or self._greeks_engine.expiry != self._expiry:
+            self._greeks_engine = GreeksEngine(self._expiry)
+        return self._greeks_engine
+
+    @property
+    def greeks_key(self) -> str:
+        """ Redis key of the published greeks """
+        return f"GREEKS_{self._ticker}"
+
+    @property
+    def snapshot(self) -> Optional[ChainSnapshot]:
+        """ Snapshot of the use_snapshot block of the current thread """
+        return getattr(self._local, "snapshot", None)
+
+    @property
+    def trading_max_age_ms(self) -> int:
+        return self._trading_max_age_ms
+
+    @property
+    def display_max_age_ms(self) -> int:
+        return self._display_max_age_ms
+
     @property
     def expiry(self) -> Optional[datetime.date]:
         return self._expiry
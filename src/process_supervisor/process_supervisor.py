@@ -0,0 +1,180 @@
+"""
+File:           process_supervisor.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 11:35 pm
+"""
+from typing import List, Optional
+import datetime
+import signal
+import subprocess
+import time
+
+from src.market_feeds.readiness import FeedReadiness
+from src.strategies.base_strategy import BaseStrategy
+from src.utils import istnow
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("process_supervisor")
+
+
+class ProcessSupervisorError(Exception):
+    """ Raised when the market feed is not ready in time """
+    pass
+
+
+class ChildProcess:
+    """ A main.py role run as a child process """
+
+    def __init__(self, name: str, args: List[str], max_restarts: int, restart_delay: float):
+        self._name = name
+        self._args = args
+        self._max_restarts = max_restarts
+        self._restart_delay = restart_delay
+        self._process: Optional[subprocess.Popen] = None
+        self._restarts = 0
+        self._restart_at: Optional[float] = None
+
+    def start(self) -> None:
+        self._process = subprocess.Popen(self._args)
+        self._restart_at = None
+        logger.info(f"Started {self._name} with pid {self._process.pid}")
+
+    def check(self, restart: bool = True) -> None:
+        """ Restart the process after restart_delay if it crashed and restarts are left """
+        if self._process is None or self.alive or not self.crashed:
+            return
+        if self._restart_at is None:
+            logger.error(f"{self._name} crashed with exit code {self._process.returncode}")
+            if not restart or self._restarts >= self._max_restarts:
+                logger.error(f"Not restarting {self._name}")
+                self._restart_at = float("inf")
+                return
+            self._restart_at = time.time() + self._restart_delay
+        if time.time() >= self._restart_at:
+            self._restarts += 1
+            logger.info(f"Restarting {self._name}. Restart {self._restarts}/{self._max_restarts}")
+            self.start()
+
+    def stop(self, grace_period: float) -> None:
+        """ Terminate the process and kill it if it does not exit within grace_period """
+        if not self.alive:
+            return
+        logger.info(f"Stopping {self._name}")
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=grace_period)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Killing {self._name} as it did not exit in {grace_period} sec")
+            self._process.kill()
+            self._process.wait()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    @property
+    def crashed(self) -> bool:
+        return self._process is not None and self._process.poll() not in (None, 0)
+
+    @property
+    def finished(self) -> bool:
+        """ Exited normally """
+        return self._process is not None and self._process.poll() == 0
+
+
+class ProcessSupervisor:
+    """
+    Run the whole trading day from one entry point.
+    1. Start the market feed and wait for its readiness signal in redis.
+    2. Start the trading process.
+    3. Restart crashed children. The trading process is restarted only before
+       trading_restart_end_time, as a restart after the entry would take the entry again.
+    4. Stop everything when the trading session ends or on SIGTERM / SIGINT.
+    """
+    POLL_INTERVAL = 1
+    GRACE_PERIOD = 10
+
+    def __init__(
+            self,
+            feed_args: List[str],
+            trading_args: List[str],
+            ready_timeout: float = 600,
+            max_restarts: int = 5,
+            restart_delay: float = 5,
+            trading_restart_end_time: datetime.time = datetime.time(hour=9, minute=15)
+    ):
+        self._feed = ChildProcess("market feed", feed_args, max_restarts, restart_delay)
+        self._trading = ChildProcess("trading", trading_args, max_restarts, restart_delay)
+        self._ready_timeout = ready_timeout
+        self._trading_restart_end_time = trading_restart_end_time
+        self._readiness = FeedReadiness()
+        self._stop = False
+
+    def run(self) -> None:
+        """
+        Blocks until the trading session ends or stop is set. Must be called from the main
+        thread, as SIGTERM and SIGINT set stop so that the children are stopped before exit.
+        """
+        previous_handlers = {
+            x: signal.signal(x, self.on_signal) for x in (signal.SIGTERM, signal.SIGINT)
+        }
+        self._readiness.connect()
+        self._feed.start()
+        try:
+            if not self.wait_for_feed():
+                return
+            self._trading.start()
+            while not self._stop and not BaseStrategy.trading_session_ends(istnow()):
+                self._feed.check()
+                self._trading.check(restart=self.can_restart_trading(istnow()))
+                time.sleep(self.POLL_INTERVAL)
+            if not self._stop:
+                logger.info(f"Trading session ended")
+        finally:
+            self.shutdown()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def on_signal(self, signum: int, frame) -> None:
+        """ Only set stop. The run loop exits within POLL_INTERVAL and stops the children """
+        logger.info(f"Received {signal.Signals(signum).name}. Stopping")
+        self._stop = True
+
+    def wait_for_feed(self) -> bool:
+        """
+        Wait for the readiness signal, restarting the feed if it crashes meanwhile. Return False
+        if stop is set before the feed is ready.
+        """
+        logger.info(f"Waiting for the market feed to be ready")
+        deadline = time.time() + self._ready_timeout
+        while not self._readiness.is_ready():
+            if self._stop:
+                return False
+            if time.time() >= deadline:
+                raise ProcessSupervisorError(
+                    f"Market feed is not ready in {self._ready_timeout} sec"
+                )
+            self._feed.check()
+            time.sleep(self.POLL_INTERVAL)
+        logger.info(f"Market feed is ready")
+        return True
+
+    def can_restart_trading(self, now: datetime.datetime) -> bool:
+        return now.time() < self._trading_restart_end_time
+
+    def shutdown(self) -> None:
+        self._trading.stop(self.GRACE_PERIOD)
+        self._feed.stop(self.GRACE_PERIOD)
+
+    @property
+    def stop(self) -> bool:
+        return self._stop
+
+    @stop.setter
+    def stop(self, value: bool) -> None:
+        self._stop = value
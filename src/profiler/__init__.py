@@ -0,0 +1,6 @@
+"""
+File:           __init__.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 12:25 am
+"""
+from .sampling_profiler import SamplingProfiler
@@ -0,0 +1,148 @@
+"""
+File:           sampling_profiler.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 12:25 am
+"""
+from typing import Optional, Dict, List
+from collections import Counter
+from pathlib import Path
+import os
+import sys
+import threading
+import time
+
+from src import LOG_DIR
+from src.utils import istnow
+from src.utils.redis_backend import RedisBackend
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("sampling_profiler")
+
+
+class SamplingProfiler:
+    """
+    Low overhead sampling profiler for a live process. A background thread takes the stack of
+    every other thread each interval and counts the stacks. The counts are written in the
+    collapsed stack format ("thread;outer func;inner func count" per line) which flamegraph.pl
+    and speedscope read, to logs/profiles/<name>_<date>.folded.
+    Profiling is switched on and off at runtime with the PROFILER_<NAME> redis key set to ON or
+    OFF. The key is checked every CONTROL_INTERVAL seconds.
+    """
+    INTERVAL = 0.01                     # 100 samples per second
+    CONTROL_INTERVAL = 2
+    FLUSH_INTERVAL = 30
+    MAX_DEPTH = 64
+
+    def __init__(
+            self,
+            name: str,
+            interval: float = INTERVAL,
+            enabled: bool = True,
+            redis_backend: Optional[RedisBackend] = None
+    ):
+        self._name = name
+        self._interval = interval
+        self._enabled = enabled
+        self._redis_backend = redis_backend or RedisBackend()
+        self._counts: Counter = Counter()
+        self._samples = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        session = istnow().strftime("%Y%m%d_%H%M%S")
+        self._output_file = LOG_DIR / "profiles" / f"{name}_{session}.folded"
+
+    def start(self) -> None:
+        self._redis_backend.connect()
+        self._output_file.parent.mkdir(exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Sampling profiler started for {self._name}. Set {self.control_key} to ON or OFF "
+            f"to switch it at runtime. Output: {self._output_file}"
+        )
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        next_control = next_flush = 0
+        own_id = threading.get_ident()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_control:
+                self.check_control()
+                next_control = now + self.CONTROL_INTERVAL
+            if now >= next_flush:
+                self.flush()
+                next_flush = now + self.FLUSH_INTERVAL
+            if self._enabled:
+                self.sample(own_id)
+            self._stop.wait(self._interval if self._enabled else self.CONTROL_INTERVAL)
+
+    def check_control(self) -> None:
+        """ Switch profiling on or off from the redis control key """
+        try:
+            value = self._redis_backend.get(self.control_key)
+        except Exception as err:
+            logger.warning(f"Unable to read {self.control_key}: {err}")
+            return
+        if value is None:
+            return
+        enabled = str(value).upper() == "ON"
+        if enabled != self._enabled:
+            logger.info(f"Sampling profiler {'enabled' if enabled else 'disabled'}")
+            self._enabled = enabled
+            if not enabled:
+                self.flush()
+
+    def sample(self, own_id: Optional[int] = None) -> None:
+        """ Count the current stack of every thread """
+        names = {x.ident: x.name for x in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack: List[str] = []
+            while frame is not None and len(stack) < self.MAX_DEPTH:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            self._counts[";".join(reversed(stack))] += 1
+        self._samples += 1
+
+    def flush(self) -> None:
+        """ Write the counts of the session so far """
+        if not self._counts:
+            return
+        counts = dict(self._counts)
+        temp_file = self._output_file.with_suffix(".tmp")
+        with open(temp_file, "w") as outfile:
+            for stack, count in counts.items():
+                outfile.write(f"{stack} {count}\n")
+        os.replace(temp_file, self._output_file)
+
+    @property
+    def control_key(self) -> str:
+        return f"PROFILER_{self._name.upper()}"
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def samples(self) -> int:
+        return self._samples
+
+    @property
+    def output_file(self) -> Path:
+        return self._output_file
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        return dict(self._counts)
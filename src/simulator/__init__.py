@@ -0,0 +1,5 @@
+"""
+File:           __init__.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 9:40 am
+"""
@@ -0,0 +1,528 @@
+"""
+File:           broker_server.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 10:30 am
+"""
+from typing import Optional, Dict, List, Tuple
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+import asyncio
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+import websockets
+
+from src.simulator.market import SimulatedMarket
+from src.simulator.smartstream import pack_frame
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("broker_simulator")
+
+
+@dataclass()
+class SimulatorConfig:
+    """ Knobs for the broker simulator """
+    host: str = "127.0.0.1"
+    http_port: int = 8000
+    ws_port: int = 8765
+    latency_ms: float = 0                   # Mean latency added to every REST call
+    latency_jitter_ms: float = 0            # Standard deviation of the added latency
+    error_rate: float = 0                   # Probability of returning status false
+    timeout_rate: float = 0                 # Probability of holding the request for timeout_sec
+    timeout_sec: float = 10
+    throttle: bool = True                   # Enforce per route request rate limits
+    # Requests per second allowed per route and client. Values are SmartAPI published limits.
+    rate_limits: Dict[str, float] = field(default_factory=lambda: {
+        "login": 1,
+        "profile": 3,
+        "rms": 2,
+        "ltp": 10,
+        "place_order": 20,
+        "order_book": 1,
+    })
+    ticks_per_sec: float = 2                # Market steps per second pushed on websocket
+    max_tokens_per_connection: int = 1000
+    initial_cash: float = 1000000
+    margin_per_lot_sold: float = 35000
+
+
+class RateLimiter:
+    """ Token bucket rate limiter keyed by (client, route) """
+
+    def __init__(self, limits: Dict[str, float]):
+        self._limits = limits
+        self._buckets: Dict[Tuple[str, str], Tuple[float, float]] = dict()
+        self._lock = threading.Lock()
+
+    def allow(self, client: str, route: str) -> bool:
+        rate = self._limits.get(route)
+        if rate is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get((client, route), (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate)
+            if tokens < 1:
+                self._buckets[(client, route)] = (tokens, now)
+                return False
+            self._buckets[(client, route)] = (tokens - 1, now)
+            return True
+
+
+@dataclass()
+class ClientSession:
+    """ Per login state of a simulated client """
+    client_code: str
+    jwt_token: str
+    refresh_token: str
+    feed_token: str
+    available_cash: float
+    utilised_debits: float = 0
+    orders: List[Dict] = field(default_factory=list)
+
+
+class BrokerSimulator:
+    """
+    Local stand-in for the Angel broking SmartAPI REST endpoints and the SmartStream websocket.
+    Point the app to it using ANGELBROKING_API_ROOT, ANGELBROKING_WS_URI and
+    ANGELBROKING_SCRIP_MASTER_URL environment variables.
+    """
+    ROUTES = {
+        ("POST", "/rest/auth/angelbroking/user/v1/loginByPassword"): "login",
+        ("GET", "/rest/secure/angelbroking/user/v1/getProfile"): "profile",
+        ("GET", "/rest/secure/angelbroking/user/v1/getRMS"): "rms",
+        ("POST", "/rest/secure/angelbroking/order/v1/getLtpData"): "ltp",
+        ("POST", "/rest/secure/angelbroking/order/v1/placeOrder"): "place_order",
+        ("GET", "/rest/secure/angelbroking/order/v1/getOrderBook"): "order_book",
+        ("GET", "/OpenAPI_File/files/OpenAPIScripMaster.json"): "scrip_master",
+    }
+    # Angel broking option trading symbol. NIFTY26OCT2617000CE
+    OPTION_SYMBOL_REGEX = re.compile(r"^([A-Z]+)(\d{2}[A-Z]{3}\d{2})(\d+)(CE|PE)$")
+
+    def __init__(self, config: Optional[SimulatorConfig] = None,
+                 market: Optional[SimulatedMarket] = None):
+        self._config = config or SimulatorConfig()
+        self._market = market or SimulatedMarket()
+        self._rate_limiter = RateLimiter(self._config.rate_limits)
+        self._random = random.Random()
+        self._sessions: Dict[str, ClientSession] = dict()
+        self._lock = threading.Lock()
+        self._http_server: Optional[ThreadingHTTPServer] = None
+        self._ws_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ws_stop: Optional[asyncio.Future] = None
+        self._ws_connections = set()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """ Start REST server and websocket server in background threads """
+        simulator = self
+
+        class Handler(SimulatorRequestHandler):
+            broker = simulator
+
+        self._http_server = ThreadingHTTPServer((self._config.host, self._config.http_port), Handler)
+        self._http_server.daemon_threads = True
+        self._threads.append(
+            threading.Thread(target=self._http_server.serve_forever, daemon=True)
+        )
+        self._threads.append(threading.Thread(target=self._run_ws_server, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(
+            f"Broker simulator running. REST: {self.api_root} Websocket: {self.ws_uri}"
+        )
+
+    def stop(self) -> None:
+        """ Stop both servers """
+        if self._http_server is not None:
+            self._http_server.shutdown()
+        if self._ws_loop is not None and self._ws_stop is not None:
+            self._ws_loop.call_soon_threadsafe(self._ws_stop.set_result, None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        logger.info(f"Broker simulator stopped")
+
+    # REST API
+    def handle_rest(self, method: str, path: str, headers, body: Dict) -> Tuple[int, object]:
+        """ Return HTTP status and response body for a REST call """
+        route = self.ROUTES.get((method, path))
+        if route is None:
+            return 404, {"status": False, "message": "Not Found", "errorcode": "AB404", "data": None}
+        if route == "scrip_master":
+            return 200, self._market.scrip_master()
+        self.simulate_latency()
+        session = None
+        if route != "login":
+            session = self.get_session(headers.get("Authorization", ""))
+            if session is None:
+                return 403, self.error_response("Invalid Token", "AG8001")
+        client = session.client_code if session is not None else body.get("clientcode", "")
+        if self._config.throttle and not self._rate_limiter.allow(client, route):
+            # SmartAPI responds with a plain text body when the access rate is exceeded
+            return 403, "Access denied because of exceeding access rate"
+        if self._random.random() < self._config.error_rate:
+            return 200, self.error_response("Simulated error", "AB1004")
+        return 200, getattr(self, f"_{route}")(session, body)
+
+    def simulate_latency(self) -> None:
+        if self._random.random() < self._config.timeout_rate:
+            time.sleep(self._config.timeout_sec)
+            return
+        if self._config.latency_ms > 0 or self._config.latency_jitter_ms > 0:
+            delay = self._random.gauss(self._config.latency_ms, self._config.latency_jitter_ms)
+            time.sleep(max(delay, 0) / 1000)
+
+    def get_session(self, authorization: str) -> Optional[ClientSession]:
+        return self._sessions.get(authorization.replace("Bearer ", "", 1))
+
+    def _login(self, session: Optional[ClientSession], body: Dict) -> Dict:
+        session = ClientSession(
+            client_code=body.get("clientcode", ""),
+            jwt_token=uuid.uuid4().hex,
+            refresh_token=uuid.uuid4().hex,
+            feed_token=uuid.uuid4().hex,
+            available_cash=self._config.initial_cash
+        )
+        with self._lock:
+            self._sessions[session.jwt_token] = session
+        return self.success_response(
+            {
+                "jwtToken": session.jwt_token,
+                "refreshToken": session.refresh_token,
+                "feedToken": session.feed_token
+            }
+        )
+
+    def _profile(self, session: ClientSession, body: Dict) -> Dict:
+        return self.success_response(
+            {
+                "clientcode": session.client_code,
+                "name": f"Simulated {session.client_code}",
+                "email": "",
+                "mobileno": "",
+                "exchanges": ["NSE", "NFO"],
+                "products": ["MARGIN", "MIS", "NRML", "CNC"],
+                "lastlogintime": "",
+                "brokerid": "B2C"
+            }
+        )
+
+    def _rms(self, session: ClientSession, body: Dict) -> Dict:
+        net = session.available_cash - session.utilised_debits
+        return self.success_response(
+            {
+                "net": f"{net:.4f}",
+                "availablecash": f"{session.available_cash:.4f}",
+                "utiliseddebits": f"{session.utilised_debits:.4f}",
+            }
+        )
+
+    def _ltp(self, session: ClientSession, body: Dict) -> Dict:
+        instrument = self._market.get(body.get("symboltoken", ""))
+        if instrument is None:
+            return self.error_response("Invalid symbol token", "AB4008")
+        return self.success_response(
+            {
+                "exchange": body.get("exchange"),
+                "tradingsymbol": body.get("tradingsymbol"),
+                "symboltoken": instrument.token,
+                "open": instrument.ltp,
+                "high": instrument.ltp,
+                "low": instrument.ltp,
+                "close": instrument.ltp,
+                "ltp": instrument.ltp
+            }
+        )
+
+    def _place_order(self, session: ClientSession, body: Dict) -> Dict:
+        instrument = self._market.get(body.get("symboltoken", ""))
+        match = self.OPTION_SYMBOL_REGEX.match(body.get("tradingsymbol", ""))
+        if instrument is None or match is None:
+            return self.error_response("Invalid symbol", "AB4008")
+        quantity = int(body.get("quantity", 0))
+        action = body.get("transactiontype")
+        # Market order fills at the touch
+        price = instrument.ask if action == "BUY" else instrument.bid
+        now = datetime.datetime.now()
+        order_id = f"{now:%y%m%d}{len(session.orders) + 1:09d}"
+        order = {
+            "variety": body.get("variety"),
+            "ordertype": body.get("ordertype"),
+            "producttype": body.get("producttype"),
+            "duration": body.get("duration"),
+            "price": 0.0,
+            "triggerprice": 0.0,
+            "quantity": str(quantity),
+            "tradingsymbol": instrument.symbol,
+            "transactiontype": action,
+            "exchange": body.get("exchange"),
+            "symboltoken": instrument.token,
+            "instrumenttype": "OPTIDX",
+            "strikeprice": float(instrument.strike),
+            "optiontype": instrument.option_type,
+            "expirydate": instrument.expiry.strftime("%d%b%Y").upper(),
+            "lotsize": str(instrument.lot_size),
+            "averageprice": price,
+            "filledshares": str(quantity),
+            "unfilledshares": "0",
+            "orderid": order_id,
+            "text": "",
+            "status": "complete",
+            "orderstatus": "complete",
+            "updatetime": now.strftime("%d-%b-%Y %H:%M:%S"),
+            "exchtime": now.strftime("%d-%b-%Y %H:%M:%S"),
+            "parentorderid": "",
+            "uniqueorderid": str(uuid.uuid4())
+        }
+        with self._lock:
+            session.orders.append(order)
+            if action == "SELL":
+                session.utilised_debits += \
+                    quantity / instrument.lot_size * self._config.margin_per_lot_sold
+        return self.success_response(
+            {"script": instrument.symbol, "orderid": order_id,
+             "uniqueorderid": order["uniqueorderid"]}
+        )
+
+    def _order_book(self, session: ClientSession, body: Dict) -> Dict:
+        with self._lock:
+            return self.success_response(list(session.orders))
+
+    @staticmethod
+    def success_response(data) -> Dict:
+        return {"status": True, "message": "SUCCESS", "errorcode": "", "data": data}
+
+    @staticmethod
+    def error_response(message: str, error_code: str) -> Dict:
+        return {"status": False, "message": message, "errorcode": error_code, "data": None}
+
+    # Websocket
+    def _run_ws_server(self) -> None:
+        self._ws_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._ws_loop)
+        self._ws_loop.run_until_complete(self._serve_ws())
+        self._ws_loop.close()
+
+    async def _serve_ws(self) -> None:
+        self._ws_stop = self._ws_loop.create_future()
+        async with websockets.serve(self._ws_handler, self._config.host, self._config.ws_port):
+            ticker = asyncio.ensure_future(self._broadcast())
+            await self._ws_stop
+            ticker.cancel()
+
+    async def _broadcast(self) -> None:
+        """ Step the market and push binary frames for changed tokens to subscribers """
+        interval = 1 / self._config.ticks_per_sec
+        while True:
+            started = time.monotonic()
+            changed = self._market.step()
+            for connection in list(self._ws_connections):
+                await connection.push(changed)
+            await asyncio.sleep(max(interval - (time.monotonic() - started), 0))
+
+    async def _ws_handler(self, websocket) -> None:
+        headers = websocket.request_headers
+        session = self.get_session(headers.get("Authorization", ""))
+        if session is None or headers.get("x-feed-token") != session.feed_token:
+            await websocket.close(code=1008, reason="Invalid feed token")
+            return
+        connection = FeedConnection(websocket, self._market, self._config.max_tokens_per_connection)
+        self._ws_connections.add(connection)
+        logger.info(f"Websocket connected for {session.client_code}")
+        try:
+            async for message in websocket:
+                await connection.handle(message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._ws_connections.discard(connection)
+            logger.info(f"Websocket disconnected for {session.client_code}")
+
+    @property
+    def api_root(self) -> str:
+        return f"http://{self._config.host}:{self._config.http_port}"
+
+    @property
+    def ws_uri(self) -> str:
+        return f"ws://{self._config.host}:{self._config.ws_port}/smart-stream"
+
+    @property
+    def scrip_master_url(self) -> str:
+        return f"{self.api_root}/OpenAPI_File/files/OpenAPIScripMaster.json"
+
+    @property
+    def market(self) -> SimulatedMarket:
+        return self._market
+
+
+class FeedConnection:
+    """ Subscription state of one SmartStream websocket connection """
+
+    def __init__(self, websocket, market: SimulatedMarket, max_tokens: int):
+        self._websocket = websocket
+        self._market = market
+        self._max_tokens = max_tokens
+        self._modes: Dict[str, int] = dict()          # Token -> subscription mode
+
+    async def handle(self, message) -> None:
+        if message == "ping":
+            await self._websocket.send("pong")
+            return
+        try:
+            request = json.loads(message)
+            mode = int(request["params"]["mode"])
+            tokens = [
+                token for token_list in request["params"]["tokenList"]
+                for token in token_list["tokens"]
+            ]
+        except (ValueError, KeyError, TypeError):
+            await self._websocket.send(
+                json.dumps({"errorCode": "E1001", "errorMessage": "Invalid Request Payload."})
+            )
+            return
+        if request.get("action") == 1:
+            new_tokens = [x for x in tokens if x not in self._modes]
+            if len(self._modes) + len(new_tokens) > self._max_tokens:
+                await self._websocket.send(
+                    json.dumps(
+                        {
+                            "correlationID": request.get("correlationID"),
+                            "errorCode": "E1002",
+                            "errorMessage": "Invalid Request. Subscription Limit Exceeded."
+                        }
+                    )
+                )
+                return
+            for token in tokens:
+                self._modes[token] = mode
+            # Send the current snapshot straight away like the real feed does
+            await self.push(tokens)
+        else:
+            for token in tokens:
+                self._modes.pop(token, None)
+
+    async def push(self, tokens: List[str]) -> None:
+        for token in tokens:
+            mode = self._modes.get(token)
+            if mode is None:
+                continue
+            instrument = self._market.get(token)
+            if instrument is None:
+                continue
+            frame = pack_frame(
+                mode,
+                instrument.exchange_type,
+                instrument.token,
+                instrument.sequence_number,
+                instrument.exchange_timestamp or int(time.time() * 1000),
+                instrument.ltp,
+                volume=instrument.volume,
+                bid=instrument.bid,
+                ask=instrument.ask
+            )
+            try:
+                await self._websocket.send(frame)
+            except websockets.ConnectionClosed:
+                return
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    """ HTTP handler delegating to BrokerSimulator.handle_rest """
+    broker: BrokerSimulator = None
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately. Without this a keep-alive client waits for the
+    # delayed ACK on every response.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = {}
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                body = {}
+        status, response = self.broker.handle_rest(
+            method, urlparse(self.path).path, self.headers, body
+        )
+        if isinstance(response, str):
+            payload = response.encode("utf-8")
+            content_type = "text/plain"
+        else:
+            payload = json.dumps(response).encode("utf-8")
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+if __name__ == "__main__":
+    import argparse
+    from src.simulator.market_generator import ExpiryDayMarket
+
+    parser = argparse.ArgumentParser(description="Angel broking SmartAPI simulator")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--http-port", type=int, default=8000)
+    parser.add_argument("--ws-port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--timeout-rate", type=float, default=0)
+    parser.add_argument("--no-throttle", action="store_true")
+    parser.add_argument("--ticks-per-sec", type=float, default=2)
+    parser.add_argument("--ticker", type=str, default="NIFTY")
+    parser.add_argument("--spot", type=float, default=19500)
+    parser.add_argument(
+        "--expiry-day", action="store_true",
+        help="Use the GBM + jumps expiry day model instead of the random walk"
+    )
+    parser.add_argument(
+        "--step-seconds", type=float, default=1,
+        help="Simulated seconds per market step for the expiry day model"
+    )
+    args = parser.parse_args()
+    if args.expiry_day:
+        market = ExpiryDayMarket(ticker=args.ticker, spot=args.spot, step_seconds=args.step_seconds)
+    else:
+        market = SimulatedMarket(ticker=args.ticker, spot=args.spot)
+    broker = BrokerSimulator(
+        config=SimulatorConfig(
+            host=args.host,
+            http_port=args.http_port,
+            ws_port=args.ws_port,
+            latency_ms=args.latency_ms,
+            latency_jitter_ms=args.latency_jitter_ms,
+            error_rate=args.error_rate,
+            timeout_rate=args.timeout_rate,
+            throttle=not args.no_throttle,
+            ticks_per_sec=args.ticks_per_sec
+        ),
+        market=market
+    )
+    broker.start()
+    print(f"export ANGELBROKING_API_ROOT={broker.api_root}")
+    print(f"export ANGELBROKING_WS_URI={broker.ws_uri}")
+    print(f"export ANGELBROKING_SCRIP_MASTER_URL={broker.scrip_master_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        broker.stop()
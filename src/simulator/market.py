@@ -0,0 +1,191 @@
+"""
+File:           market.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 10:05 am
+"""
+from typing import Optional, List, Dict
+from dataclasses import dataclass
+import datetime
+import math
+import random
+import threading
+import time
+
+
+@dataclass()
+class SimulatedInstrument:
+    """ Dataclass holding one simulated index or option contract """
+    token: str
+    symbol: str                     # Angel broking trading symbol. NIFTY26OCT2617000CE
+    name: str                       # Underlying name. NIFTY
+    exchange: str                   # NSE or NFO
+    exchange_type: int              # SmartStream exchange type. 1 -> nse_cm, 2 -> nse_fo
+    ltp: float
+    strike: Optional[int] = None
+    expiry: Optional[datetime.date] = None
+    option_type: Optional[str] = None
+    lot_size: int = 1
+    sequence_number: int = 0
+    exchange_timestamp: int = 0     # Epoch milliseconds
+    volume: int = 0
+    spread: float = 0.05
+
+    @property
+    def bid(self) -> float:
+        return max(round(self.ltp - self.spread / 2, 2), 0.05)
+
+    @property
+    def ask(self) -> float:
+        return round(self.ltp + self.spread / 2, 2)
+
+    def scrip_master_record(self) -> Dict:
+        """ Return the record in the format of OpenAPIScripMaster.json """
+        if self.strike is None:
+            return {
+                "token": self.token,
+                "symbol": self.symbol,
+                "name": self.name,
+                "expiry": "",
+                "strike": "0.000000",
+                "lotsize": "1",
+                "instrumenttype": "AMXIDX",
+                "exch_seg": self.exchange,
+                "tick_size": "0.000000"
+            }
+        return {
+            "token": self.token,
+            "symbol": self.symbol,
+            "name": self.name,
+            "expiry": self.expiry.strftime("%d%b%Y").upper(),
+            "strike": f"{self.strike * 100:.6f}",
+            "lotsize": str(self.lot_size),
+            "instrumenttype": "OPTIDX",
+            "exch_seg": self.exchange,
+            "tick_size": "5.000000"
+        }
+
+
+class SimulatedMarket:
+    """
+    In-memory market used by the broker simulator. The index follows a simple random walk and
+    option premiums are derived from the distance to the index. Subclasses can override step to
+    drive the market with a more realistic model.
+    """
+    INDEX_TOKENS = {"NIFTY": ("26000", "Nifty 50"), "FINNIFTY": ("26037", "Nifty Fin Service")}
+    STRIKE_STEP = 50
+
+    def __init__(
+            self,
+            ticker: str = "NIFTY",
+            spot: float = 19500,
+            expiry: Optional[datetime.date] = None,
+            strikes_each_side: int = 60,
+            lot_size: int = 50,
+            volatility: float = 0.0002,
+            seed: Optional[int] = None
+    ):
+        self._ticker = ticker
+        self._spot = spot
+        self._expiry = expiry or datetime.date.today()
+        self._strikes_each_side = strikes_each_side
+        self._lot_size = lot_size
+        self._volatility = volatility
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._instruments: Dict[str, SimulatedInstrument] = dict()
+        self._symbol_to_token: Dict[str, str] = dict()
+        self._build()
+
+    def _build(self):
+        """ Create index and option instruments around the spot """
+        token, symbol = self.INDEX_TOKENS.get(self._ticker, ("99926000", self._ticker))
+        self.add(
+            SimulatedInstrument(
+                token=token,
+                symbol=symbol,
+                name=self._ticker,
+                exchange="NSE",
+                exchange_type=1,
+                ltp=self._spot
+            )
+        )
+        atm = round(self._spot / self.STRIKE_STEP) * self.STRIKE_STEP
+        date_str = self._expiry.strftime("%d%b%y").upper()
+        next_token = 40000
+        for index in range(-self._strikes_each_side, self._strikes_each_side + 1):
+            strike = atm + index * self.STRIKE_STEP
+            for option_type in ("CE", "PE"):
+                self.add(
+                    SimulatedInstrument(
+                        token=str(next_token),
+                        symbol=f"{self._ticker}{date_str}{strike}{option_type}",
+                        name=self._ticker,
+                        exchange="NFO",
+                        exchange_type=2,
+                        ltp=self.option_price(self._spot, strike, option_type),
+                        strike=strike,
+                        expiry=self._expiry,
+                        option_type=option_type,
+                        lot_size=self._lot_size
+                    )
+                )
+                next_token += 1
+
+    def add(self, instrument: SimulatedInstrument) -> None:
+        self._instruments[instrument.token] = instrument
+        self._symbol_to_token[instrument.symbol] = instrument.token
+
+    def option_price(self, spot: float, strike: int, option_type: str) -> float:
+        """ Intrinsic value plus a time value decaying with distance from the spot """
+        intrinsic = max(spot - strike, 0) if option_type == "CE" else max(strike - spot, 0)
+        time_value = 0.006 * spot * math.exp(-abs(spot - strike) / (0.01 * spot))
+        return round(max(intrinsic + time_value, 0.05), 2)
+
+    def step(self) -> List[str]:
+        """ Move the market by one tick. Return the tokens whose price changed """
+        with self._lock:
+            self._spot *= math.exp(self._random.gauss(0, self._volatility))
+            return self._reprice(int(time.time() * 1000))
+
+    def _reprice(self, exchange_timestamp: int) -> List[str]:
+        """ Reprice every instrument off the current spot """
+        changed = []
+        for instrument in self._instruments.values():
+            if instrument.strike is None:
+                price = round(self._spot, 2)
+            else:
+                price = self.option_price(self._spot, instrument.strike, instrument.option_type)
+            if price != instrument.ltp:
+                instrument.ltp = price
+                instrument.sequence_number += 1
+                instrument.exchange_timestamp = exchange_timestamp
+                instrument.volume += instrument.lot_size
+                instrument.spread = self.spread(price)
+                changed.append(instrument.token)
+        return changed
+
+    @staticmethod
+    def spread(price: float) -> float:
+        return 0.05
+
+    def get(self, token: str) -> Optional[SimulatedInstrument]:
+        return self._instruments.get(token)
+
+    def get_by_symbol(self, symbol: str) -> Optional[SimulatedInstrument]:
+        token = self._symbol_to_token.get(symbol)
+        return self._instruments.get(token) if token is not None else None
+
+    def scrip_master(self) -> List[Dict]:
+        return [x.scrip_master_record() for x in self._instruments.values()]
+
+    @property
+    def spot(self) -> float:
+        return self._spot
+
+    @property
+    def expiry(self) -> datetime.date:
+        return self._expiry
+
+    @property
+    def instruments(self) -> List[SimulatedInstrument]:
+        return list(self._instruments.values())
@@ -0,0 +1,203 @@
+"""
+File:           market_generator.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 12:15 pm
+"""
+from typing import Optional, Callable, Iterator, List
+import datetime
+import math
+import time
+
+from src.simulator.market import SimulatedMarket, SimulatedInstrument
+from src.simulator.smartstream import pack_frame, LTP_MODE
+
+
+def norm_cdf(x: float) -> float:
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
+
+
+def black_scholes_price(
+        spot: float, strike: float, years: float, volatility: float, option_type: str,
+        rate: float = 0.0
+) -> float:
+    """ Black Scholes price of a european option """
+    if years <= 0 or volatility <= 0:
+        intrinsic = spot - strike if option_type == "CE" else strike - spot
+        return max(intrinsic, 0)
+    sqrt_t = math.sqrt(years)
+    d1 = (math.log(spot / strike) + (rate + volatility ** 2 / 2) * years) / (volatility * sqrt_t)
+    d2 = d1 - volatility * sqrt_t
+    discount = math.exp(-rate * years)
+    if option_type == "CE":
+        return spot * norm_cdf(d1) - strike * discount * norm_cdf(d2)
+    return strike * discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+
+
+class ExpiryDayMarket(SimulatedMarket):
+    """
+    Expiry day market. The index follows a geometric brownian motion with poisson jumps and the
+    option chain is priced with Black Scholes on a volatility smile, so premiums decay towards
+    zero as the simulated clock approaches 3:30 PM on expiry.
+    Each step advances the simulated clock by step_seconds.
+    """
+    SESSION_START = datetime.time(hour=9, minute=15)
+    SESSION_END = datetime.time(hour=15, minute=30)
+    YEAR_SECONDS = 365 * 24 * 60 * 60
+
+    def __init__(
+            self,
+            ticker: str = "NIFTY",
+            spot: float = 19500,
+            expiry: Optional[datetime.date] = None,
+            strikes_each_side: int = 60,
+            lot_size: int = 50,
+            annual_volatility: float = 0.25,
+            smile: float = 4.0,
+            jump_intensity: float = 3.0,
+            jump_mean: float = 0.0,
+            jump_std: float = 0.004,
+            step_seconds: float = 1.0,
+            start_time: Optional[datetime.time] = None,
+            seed: Optional[int] = None
+    ):
+        expiry = expiry or datetime.date.today()
+        self._annual_volatility = annual_volatility
+        self._smile = smile
+        # Expected number of jumps in a trading day and the jump size distribution (log return)
+        self._jump_intensity = jump_intensity
+        self._jump_mean = jump_mean
+        self._jump_std = jump_std
+        self._step_seconds = step_seconds
+        self._clock = datetime.datetime.combine(expiry, start_time or self.SESSION_START)
+        self._close = datetime.datetime.combine(expiry, self.SESSION_END)
+        super(ExpiryDayMarket, self).__init__(
+            ticker=ticker,
+            spot=spot,
+            expiry=expiry,
+            strikes_each_side=strikes_each_side,
+            lot_size=lot_size,
+            seed=seed
+        )
+
+    def option_price(self, spot: float, strike: int, option_type: str) -> float:
+        volatility = self.implied_volatility(spot, strike)
+        price = black_scholes_price(spot, strike, self.years_to_expiry, volatility, option_type)
+        # Exchange tick size is 0.05
+        return max(round(price * 20) / 20, 0.05)
+
+    def implied_volatility(self, spot: float, strike: float) -> float:
+        """ Quadratic smile in log moneyness """
+        moneyness = math.log(strike / spot)
+        return self._annual_volatility * (1 + self._smile * moneyness ** 2 * 100)
+
+    def step(self) -> List[str]:
+        """ Advance the simulated clock and move the index by one GBM + jump increment """
+        with self._lock:
+            self._clock = min(
+                self._clock + datetime.timedelta(seconds=self._step_seconds), self._close
+            )
+            session_seconds = (self.SESSION_END.hour * 60 + self.SESSION_END.minute -
+                               self.SESSION_START.hour * 60 - self.SESSION_START.minute) * 60
+            dt = self._step_seconds / session_seconds / 252
+            sigma = self._annual_volatility
+            log_return = -sigma ** 2 / 2 * dt + sigma * math.sqrt(dt) * self._random.gauss(0, 1)
+            jump_probability = self._jump_intensity * self._step_seconds / session_seconds
+            if self._random.random() < jump_probability:
+                log_return += self._random.gauss(self._jump_mean, self._jump_std)
+            self._spot *= math.exp(log_return)
+            return self._reprice(int(self._clock.timestamp() * 1000))
+
+    @staticmethod
+    def spread(price: float) -> float:
+        """ Wider relative spread for cheap far OTM strikes """
+        return max(round(price * 0.004 * 20) / 20, 0.05)
+
+    @property
+    def years_to_expiry(self) -> float:
+        # Floor at one minute so that premiums never collapse to intrinsic before the close
+        seconds = max((self._close - self._clock).total_seconds(), 60)
+        return seconds / self.YEAR_SECONDS
+
+    @property
+    def clock(self) -> datetime.datetime:
+        return self._clock
+
+
+class FrameGenerator:
+    """
+    Emit SmartStream binary frames from a market at a fixed rate. Every market step produces one
+    frame per changed token, so ticks_per_sec is the number of frames per second across all
+    tokens. Use it to drive the feed decoder and the redis writer at multiples of live volume.
+    """
+
+    def __init__(
+            self,
+            market: SimulatedMarket,
+            ticks_per_sec: float = 1000,
+            mode: int = LTP_MODE,
+            tokens: Optional[List[str]] = None
+    ):
+        self._market = market
+        self._ticks_per_sec = ticks_per_sec
+        self._mode = mode
+        self._tokens = set(tokens) if tokens is not None else None
+
+    def frames(self) -> Iterator[bytes]:
+        """ Infinite stream of frames without any pacing """
+        while True:
+            for token in self._market.step():
+                if self._tokens is not None and token not in self._tokens:
+                    continue
+                yield self.pack(self._market.get(token))
+
+    def pack(self, instrument: SimulatedInstrument) -> bytes:
+        return pack_frame(
+            self._mode,
+            instrument.exchange_type,
+            instrument.token,
+            instrument.sequence_number,
+            instrument.exchange_timestamp,
+            instrument.ltp,
+            volume=instrument.volume,
+            bid=instrument.bid,
+            ask=instrument.ask
+        )
+
+    def run(self, sink: Callable[[bytes], None], duration: float) -> int:
+        """
+        Push frames to sink at ticks_per_sec for duration seconds. Return the number of frames
+        sent. If the sink is slower than the target rate, frames are sent back to back.
+        """
+        interval = 1 / self._ticks_per_sec
+        started = time.perf_counter()
+        sent = 0
+        for frame in self.frames():
+            now = time.perf_counter()
+            if now - started >= duration:
+                break
+            sink(frame)
+            sent += 1
+            delay = started + sent * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return sent
+
+
+if __name__ == "__main__":
+    import argparse
+    from src.brokerapi.angelbroking.websocketv2 import SmartWebSocketV2
+
+    parser = argparse.ArgumentParser(description="Drive the SmartStream decoder with synthetic ticks")
+    parser.add_argument("--ticks-per-sec", type=float, default=5000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--strikes-each-side", type=int, default=60)
+    parser.add_argument("--mode", type=int, default=LTP_MODE)
+    args = parser.parse_args()
+    generator = FrameGenerator(
+        ExpiryDayMarket(strikes_each_side=args.strikes_each_side, seed=1),
+        ticks_per_sec=args.ticks_per_sec,
+        mode=args.mode
+    )
+    web_socket = SmartWebSocketV2("", "", "", "")
+    count = generator.run(web_socket._parse_binary_data, duration=args.duration)
+    print(f"Decoded {count} frames in {args.duration} sec ({count / args.duration:.0f} ticks/sec)")
@@ -0,0 +1,84 @@
+"""
+File:           smartstream.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 9:45 am
+"""
+from typing import Optional, List, Tuple
+import struct
+
+
+# SmartStream binary packet layout (little endian). This is the exact inverse of
+# SmartWebSocketV2._parse_binary_data.
+# LTP        -> 51 bytes
+# QUOTE      -> 123 bytes
+# SNAP_QUOTE -> 379 bytes
+LTP_MODE = 1
+QUOTE = 2
+SNAP_QUOTE = 3
+
+LTP_HEADER = struct.Struct("<BB25sqqq")
+QUOTE_BODY = struct.Struct("<qqqddqqqq")
+SNAP_QUOTE_BODY = struct.Struct("<qqq")
+DEPTH_PACKET = struct.Struct("<HqqH")
+CIRCUIT_BODY = struct.Struct("<qqqq")
+
+LTP_PACKET_SIZE = LTP_HEADER.size
+QUOTE_PACKET_SIZE = LTP_PACKET_SIZE + QUOTE_BODY.size
+SNAP_QUOTE_PACKET_SIZE = QUOTE_PACKET_SIZE + SNAP_QUOTE_BODY.size + 10 * DEPTH_PACKET.size + \
+                         CIRCUIT_BODY.size
+
+
+def to_paise(price: float) -> int:
+    """ SmartStream sends prices as integer paise """
+    return int(round(price * 100))
+
+
+def pack_frame(
+        mode: int,
+        exchange_type: int,
+        token: str,
+        sequence_number: int,
+        exchange_timestamp: int,
+        ltp: float,
+        *,
+        volume: int = 0,
+        bid: Optional[float] = None,
+        ask: Optional[float] = None,
+        depth: Optional[List[Tuple[int, float, int, int]]] = None
+) -> bytes:
+    """
+    Build a SmartStream binary frame for one token.
+    exchange_timestamp is epoch milliseconds and ltp is in rupees.
+    depth is a list of (flag, price, quantity, orders) with flag 1 for buy and 0 for sell. When it
+    is not given, a 5 level book is built around bid and ask.
+    """
+    ltp_paise = to_paise(ltp)
+    frame = LTP_HEADER.pack(
+        mode, exchange_type, token.encode("utf-8"), sequence_number, exchange_timestamp, ltp_paise
+    )
+    if mode == LTP_MODE:
+        return frame
+    frame += QUOTE_BODY.pack(
+        1, ltp_paise, volume, float(volume // 2), float(volume // 2),
+        ltp_paise, ltp_paise, ltp_paise, ltp_paise
+    )
+    if mode == QUOTE:
+        return frame
+    frame += SNAP_QUOTE_BODY.pack(exchange_timestamp, 0, 0)
+    if depth is None:
+        depth = build_depth(ltp if bid is None else bid, ltp if ask is None else ask)
+    for flag, price, quantity, orders in depth[:10]:
+        frame += DEPTH_PACKET.pack(flag, quantity, to_paise(price), orders)
+    frame += DEPTH_PACKET.pack(0, 0, 0, 0) * (10 - len(depth[:10]))
+    frame += CIRCUIT_BODY.pack(ltp_paise * 2, 5, ltp_paise * 3, 5)
+    return frame
+
+
+def build_depth(bid: float, ask: float, tick: float = 0.05, quantity: int = 500):
+    """ Return a 5 level buy and sell book starting at bid and ask """
+    depth = []
+    for level in range(5):
+        depth.append((1, max(bid - level * tick, 0.05), quantity * (level + 1), level + 1))
+    for level in range(5):
+        depth.append((0, ask + level * tick, quantity * (level + 1), level + 1))
+    return depth
@@ -3,8 +3,9 @@ File:           base_strategy.py
 Author:         Dibyaranjan Sathua
 Created on:     22/08/22, 9:29 pm
 """
-from typing import Optional
+from typing import Optional, List
 from abc import ABC, abstractmethod
+import concurrent.futures
 import datetime
 
 from src.brokerapi.angelbroking import AngelBrokingApi
@@ -18,6 +19,8 @@ logger: LogFacade = LogFacade.get_logger("base_strategy")
 class BaseStrategy(ABC):
     """ Abstract class contains common functions that needs to be implemented in the child class """
     STRATEGY_CODE: str = ""
+    # Straddle and hedge legs are at most 4 orders placed together
+    ORDER_WORKERS: int = 4
 
     def __init__(
             self,
@@ -35,6 +38,9 @@ class BaseStrategy(ABC):
         self.dry_run: bool = dry_run
         self.clean_up_flag: bool = clean_up
         self._broker_api: Optional[AngelBrokingApi] = None
+        self._order_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=BaseStrategy.ORDER_WORKERS, thread_name_prefix=f"orders-{client_id}"
+        )
 
     @abstractmethod
     def entry(self) -> None:
@@ -86,6 +92,26 @@ class BaseStrategy(ABC):
         self._broker_api.place_intraday_options_order(pair_instrument.ce_instrument)
         self._broker_api.place_intraday_options_order(pair_instrument.pe_instrument)
 
+    def place_instruments_order_concurrently(self, instruments: List[Instrument]):
+        """
+        Place the orders in parallel and wait till all of them are acknowledged. The first error
+        is raised after every order is tried, so one failed leg does not stop the others.
+        """
+        if self.dry_run:
+            logger.info(
+                f"Skipping placing orders for instruments {', '.join(map(str, instruments))} as "
+                f"running in dry-run mode"
+            )
+            return None
+        futures = [
+            self._order_executor.submit(self._broker_api.place_intraday_options_order, x)
+            for x in instruments
+        ]
+        errors = [x.exception() for x in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+
     def place_instrument_order(self, instrument: Instrument):
         """ Place the order using broker API """
         if self.dry_run:
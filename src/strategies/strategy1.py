@@ -4,7 +4,7 @@ Author:         Dibyaranjan Sathua
 Created on:     22/08/22, 9:30 pm
 """
 import time
-from typing import Optional, Tuple
+from typing import Optional, Tuple, List, Set
 import datetime
 import math
 import traceback
@@ -14,13 +14,19 @@ from src.strategies.base_strategy import BaseStrategy
 from src.utils import istnow
 from src.strategies.instrument import Instrument, PairInstrument, Action
 from src.price_monitor.price_monitor import PriceMonitor, PriceMonitorError, PriceNotUpdatedError
+from src.greeks import RiskAggregator, PortfolioRisk
+from src.market_feeds.held_symbols import HeldSymbols
+from src.market_feeds.tick_events import TickEvents
+from src.metrics import MetricsRegistry
 from src.utils import StrategyTicker
 from src.utils.enum import Weekdays
-from src.utils.config_reader import ConfigReader
+from src.strategies.strategy_config import StrategyConfigWatcher, Strategy1DayConfig, \
+    StrategyConfigError
 from src.utils.logger import LogFacade
 from src.utils.redis_backend import RedisBackend
 from src.telegram.bot import Bot
 from src.brokerapi.base_api import BrokerOrderApiError, BrokerApiError
+from src.control import CommandConsumer, Command, CommandType
 from dashboard.db import SessionLocal
 from dashboard.db.db_api import DBApi
 from dashboard.db.models import AlgoRunConfig
@@ -28,11 +34,32 @@ from dashboard.db.models import AlgoRunConfig
 
 logger: LogFacade = LogFacade.get_logger("strategy1")
 db = SessionLocal()
+metrics: MetricsRegistry = MetricsRegistry.get_instance()
+PNL = metrics.gauge("strategy_pnl", "Live pnl of the strategy", ("client_id",))
+EXIT_LATENCY_SECONDS = metrics.gauge(
+    "strategy_exit_latency_seconds",
+    "Time from the exit trigger to all the square off orders acknowledged",
+    ("client_id",)
+)
 
 
 class Strategy1(BaseStrategy):
     """ Expiry day strategy for shorting straddle """
     STRATEGY_CODE: str = "strategy1"
+    # Broker API connection is refreshed this many seconds before the entry time as the keep-alive
+    # connection opened by the warm up can be closed by the server by then
+    CONNECTION_WARM_SECONDS: int = 10
+    # The loop wakes on the ticks of the open legs and the index, on operator commands like a
+    # manual exit and on the timer events (entry, remaining lot and exit). Without any event it
+    # still runs every HEARTBEAT_INTERVAL sec in a trade and every IDLE_INTERVAL sec before it.
+    HEARTBEAT_INTERVAL: float = 2
+    IDLE_INTERVAL: float = 10
+    # A burst of ticks is handled at most once per MIN_EVENT_INTERVAL sec
+    MIN_EVENT_INTERVAL: float = 0.2
+    # PnL and risk are logged and written to redis at most once per PUBLISH_INTERVAL sec. The
+    # positions are reconciled with the broker orderbook and the risk is recalculated at the same
+    # interval. Between them, the pnl of a tick is calculated from the snapshot prices.
+    PUBLISH_INTERVAL: float = 2
 
     def __init__(
             self,
@@ -41,7 +68,7 @@ class Strategy1(BaseStrategy):
             password: str,
             totp_key: str,
             price_monitor: PriceMonitor,
-            config: ConfigReader,
+            config: StrategyConfigWatcher,
             bot: Optional[Bot],
             dry_run: bool = False
     ):
@@ -52,7 +79,9 @@ class Strategy1(BaseStrategy):
         self._straddle: PairInstrument = PairInstrument()
         self._hedging: PairInstrument = PairInstrument()
         self._price_monitor: PriceMonitor = price_monitor
-        self._config: ConfigReader = config
+        self._config: StrategyConfigWatcher = config
+        # Config of the trading day, refreshed from the watcher once per loop iteration
+        self._settings: Optional[Strategy1DayConfig] = None
         self._pnl: float = 0
         self._first_shifting: bool = False      # Indicate if first shifting is done
         self._straddle_strike: int = 0
@@ -78,6 +107,69 @@ class Strategy1(BaseStrategy):
         self._stop_shifting_hedges: bool = False
         self._ticker = StrategyTicker.get_instance().ticker
         self._quantity = StrategyTicker.get_instance().quantity
+        # Net greeks and scenario pnl of the open legs published for the dashboard
+        self._risk_aggregator = RiskAggregator(client_id, price_monitor, self._redis_backend)
+        self._warmed_up: bool = False
+        self._connection_warmed: bool = False
+        self._exit_latency_ms: Optional[float] = None    # Exit trigger to orders acknowledged
+        self._tick_events: TickEvents = TickEvents()
+        self._published_at: float = 0
+        # Realised pnl and open positions of the last orderbook reconciliation
+        self._realised_pnl: float = 0
+        self._open_positions: List[Instrument] = []
+        self._open_legs_key: Optional[Tuple] = None
+        # Symbols of the open positions that the market feed keeps subscribed
+        self._held_symbols: HeldSymbols = HeldSymbols(self._redis_backend)
+        self._held: List[str] = []
+        # Operator commands from the dashboard
+        self._commands: CommandConsumer = CommandConsumer(
+            client_id, on_command=lambda: self._tick_events.notify(TickEvents.CONTROL)
+        )
+        self._shifting_paused: bool = False
+
+    def skip_command_backlog(self) -> None:
+        self._commands.skip_backlog()
+
+    def warm_up(self, strikes_each_side: int = 10) -> None:
+        """
+        Pre-market warm up so that the first order at entry time has no setup latency. Login,
+        prefetch the capital (RMS limits), check the option chain is in redis and build the order
+        payloads of the strikes around the ATM and of the likely hedges for the initial lot size.
+        """
+        logger.info(f"Warming up {Strategy1.STRATEGY_CODE} for {self._client_id}")
+        self.setup_broking_api()
+        self._redis_backend.connect()
+        self._weekday = Weekdays(istnow().weekday())
+        self.refresh_settings()
+        logger.info(f"Initial Capital: {self.initial_capital}")
+        with self._price_monitor.use_snapshot() as snapshot:
+            strikes = [
+                snapshot.atm + x * PriceMonitor.STRIKE_STEP
+                for x in range(-strikes_each_side, strikes_each_side + 1)
+            ]
+            hedge_strikes = {
+                x: self._price_monitor.get_strike_by_with_less_price(price=5.5, option_type=x)
+                for x in ("CE", "PE")
+            }
+        # Straddle legs are sold at entry and bought back on a shift, hedges are the other way
+        quantity = self.initial_lot_size * self._quantity
+        for option_type in ("CE", "PE"):
+            for strike in strikes + [hedge_strikes[option_type]]:
+                for action in (Action.BUY, Action.SELL):
+                    instrument = Instrument(
+                        action=action,
+                        lot_size=quantity,
+                        expiry=self._price_monitor.expiry,
+                        option_type=option_type,
+                        strike=strike,
+                        index=self._ticker,
+                        entry=None,
+                        price=0,
+                        order_id=""
+                    )
+                    self._broker_api.get_order_template(instrument)
+        self._warmed_up = True
+        logger.info(f"Warm up completed for {self._client_id}")
 
     def entry(self) -> None:
         """ Entry logic """
@@ -154,27 +246,53 @@ class Strategy1(BaseStrategy):
             self._bot.send_notification(str(err))
             self._bot.send_notification(f"MANUAL EXIT")
 
-    def exit(self) -> None:
-        """ Exit logic """
-        logger.info(f"Stopping price monitoring")
+    def exit(self, reason: Optional[str] = None) -> None:
+        """
+        Exit logic. The square off orders are placed first, both straddle legs together and then
+        both hedge legs together. Selling the hedges before the straddle is bought back leaves
+        naked short legs which need more margin. Logging, notifications and the final pnl are
+        done after the orders are acknowledged.
+        """
+        trigger_time = time.perf_counter()
         self._price_monitor.stop_monitor = True
+        straddle_latency_ms = None
+        if self._straddle is not None:
+            legs = [
+                x for x in (self._straddle.ce_instrument, self._straddle.pe_instrument)
+                if x is not None
+            ]
+            for instrument in legs:
+                instrument.action = Action.BUY
+            self.place_instruments_order_concurrently(legs)
+            straddle_latency_ms = round((time.perf_counter() - trigger_time) * 1000, 2)
+        if self._hedging is not None:
+            legs = [
+                x for x in (self._hedging.ce_instrument, self._hedging.pe_instrument)
+                if x is not None
+            ]
+            for instrument in legs:
+                instrument.action = Action.SELL
+            self.place_instruments_order_concurrently(legs)
+        self._exit_latency_ms = round((time.perf_counter() - trigger_time) * 1000, 2)
+        EXIT_LATENCY_SECONDS.labels(self._client_id).set(self._exit_latency_ms / 1000)
+        if reason is not None:
+            logger.info(reason)
+            self._bot.send_notification(reason)
+        logger.info(f"Stopping price monitoring")
         logger.info(f"Exiting strategy")
         self._bot.send_notification(f"Exiting strategy")
         if self._straddle is not None:
-            logger.info(f"Squaring off straddle {self._straddle}")
-            self._bot.send_notification(f"Squaring off straddle {self._straddle}")
-            self._straddle.ce_instrument.action = Action.BUY
-            self._straddle.pe_instrument.action = Action.BUY
-            self.place_pair_instrument_order(self._straddle)
+            logger.info(f"Squared off straddle {self._straddle} in {straddle_latency_ms} ms")
+            self._bot.send_notification(f"Squared off straddle {self._straddle}")
         if self._hedging is not None:
-            logger.info(f"Squaring off hedges {self._hedging}")
-            self._bot.send_notification(f"Squaring off hedges {self._hedging}")
-            self._hedging.ce_instrument.action = Action.SELL
-            self._hedging.pe_instrument.action = Action.SELL
-            self.place_pair_instrument_order(self._hedging)
-        pnl = self.get_strategy_pnl()
+            logger.info(f"Squared off hedges {self._hedging}")
+            self._bot.send_notification(f"Squared off hedges {self._hedging}")
+        logger.info(f"Exit orders acknowledged in {self._exit_latency_ms} ms after the trigger")
+        # Positions are already squared off, so the pnl is only for display
+        pnl = self.get_strategy_pnl(display=True)
         logger.info(f"Final PnL: {pnl}")
         self._redis_backend.set("LIVE_PNL", str(pnl))
+        PNL.labels(self._client_id).set(pnl)
         self._bot.send_notification(f"PnL: {pnl}")
         self._entry_taken = False
 
@@ -183,54 +301,88 @@ class Strategy1(BaseStrategy):
         Monitor pnl to see if it hits the target or SL. Return True if target or SL hit else False
         """
         if pnl > self.target:
-            logger.info(f"Target {self.target} hit")
-            self._bot.send_notification(f"Target {self.target} hit")
-            self.exit()
+            self.exit(reason=f"Target {self.target} hit")
             return True
         if pnl < self.sl:
-            logger.info(f"SL {self.sl} hit")
-            self._bot.send_notification(f"SL {self.sl} hit")
-            self.exit()
+            self.exit(reason=f"SL {self.sl} hit")
             return True
         return False
 
+    def monitor_risk(self, pnl: float, risk: PortfolioRisk) -> bool:
+        """
+        Exit if the pnl after the worse of the +/- scenario_sl index moves is below the SL. Only
+        when risk.scenario_sl is set in the config. Return True if exited else False
+        """
+        scenario_sl = self._settings.scenario_sl
+        if scenario_sl is None:
+            return False
+        worst_pnl = pnl + min(
+            risk.scenario_pnl.get(RiskAggregator.get_scenario_name(scenario_sl), 0),
+            risk.scenario_pnl.get(RiskAggregator.get_scenario_name(-scenario_sl), 0)
+        )
+        if worst_pnl < self.sl:
+            self.exit(
+                reason=f"Risk SL {self.sl} hit. PnL {worst_pnl} after a {scenario_sl * 100:g}% "
+                       f"index move is below SL"
+            )
+            return True
+        return False
+
+    def get_open_legs(self) -> List[Instrument]:
+        """ Open straddle and hedge legs """
+        legs = []
+        for pair_instrument in (self._straddle, self._hedging):
+            if pair_instrument is None:
+                continue
+            for instrument in (pair_instrument.ce_instrument, pair_instrument.pe_instrument):
+                if instrument is not None:
+                    legs.append(instrument)
+        return legs
+
     def execute(self) -> None:
         """ Execute method with error handling to square off all open positions """
         try:
             self._execute()
         except PriceMonitorError as err:
+            # Square off first. Logging and notifications can wait.
+            if self._entry_taken:
+                self.exit_during_exception()
             logger.error(err)
             self._bot.send_notification(f"ALGO NOT WORKING. MARKET DATA FETCHING ISSUE.")
             self._bot.send_notification(str(err))
+        except PriceNotUpdatedError as err:
+            # Square off first. Logging and notifications can wait.
             if self._entry_taken:
                 self.exit_during_exception()
-        except PriceNotUpdatedError as err:
             logger.error(err)
             self._bot.send_notification(f"ALGO NOT WORKING. MARKET DATA NOT UPDATED.")
             self._bot.send_notification(str(err))
+        except BrokerOrderApiError as err:
+            # Square off first. Logging and notifications can wait.
             if self._entry_taken:
                 self.exit_during_exception()
-        except BrokerOrderApiError as err:
             logger.error(err)
             self._bot.send_notification(f"ALGO NOT WORKING. ORDER PUNCHING ISSUE.")
             self._bot.send_notification(str(err))
+        except BrokerApiError as err:
+            # Square off first. Logging and notifications can wait.
             if self._entry_taken:
                 self.exit_during_exception()
-        except BrokerApiError as err:
             logger.error(err)
             self._bot.send_notification(f"ALGO NOT WORKING. BROKER API ISSUE.")
             self._bot.send_notification(str(err))
+        except Exception as err:
             if self._entry_taken:
                 self.exit_during_exception()
-        except Exception as err:
             logger.error(err)
             logger.exception(traceback.print_exc())
             self._bot.send_notification(f"ALGO NOT WORKING. UNKNOWN EXCEPTION.")
             self._bot.send_notification(str(err))
-            if self._entry_taken:
-                self.exit_during_exception()
         logger.info(f"Stopping price monitoring")
         self._price_monitor.stop_monitor = True
+        self._tick_events.close()
+        self._commands.close()
+        self.release_open_symbols()
         logger.info(f"Execution completed")
 
     def _execute(self) -> None:
@@ -244,9 +396,12 @@ class Strategy1(BaseStrategy):
         self._bot.send_notification(
             f"Starting execution of strategy {Strategy1.STRATEGY_CODE} for {self._ticker}"
         )
-        super(Strategy1, self).execute()
+        # Login is already done by the warm up
+        if not self._warmed_up:
+            super(Strategy1, self).execute()
         now = istnow()
         self._weekday = Weekdays(now.weekday())
+        self.refresh_settings()
         logger.info(f"Trading day: {self._weekday.name}")
         # Check if Algo is ON for this day
         self._day_config = DBApi.get_run_config_by_day(db, day=self._weekday.name.lower())
@@ -260,56 +415,158 @@ class Strategy1(BaseStrategy):
         logger.info(f"Target percent: {self.target_percent}")
         logger.info(f"Expected margin per lot: {self.expected_margin_per_lot}")
         logger.info(f"Entry time: {self.entry_time}")
-        self._redis_backend.set("MANUAL_EXIT", "False")
+        self._tick_events.connect()
+        self._commands.connect()
+        risk: Optional[PortfolioRisk] = None
         while True:
+            iteration_start = time.monotonic()
+            self.refresh_settings()
             now = istnow()
+            if not self._entry_taken and not self._connection_warmed and \
+                    0 <= self.get_seconds_to_entry(now) < Strategy1.CONNECTION_WARM_SECONDS:
+                self._broker_api.warm_connection()
+                self._connection_warmed = True
+            # Prices of one iteration are read from a single snapshot of the option chain
             if self.check_entry_time(now) and not self._entry_taken:
-                # For Thursday check if straddle price is in between 70 and 110
-                if self._weekday == Weekdays.THURSDAY and self._changed_entry_time is None:
-                    straddle_price = self.get_current_straddle_price()
-                    if 60 <= straddle_price <= 110:
-                        self.entry()
+                with self._price_monitor.use_snapshot():
+                    # For Thursday check if straddle price is in between 70 and 110
+                    if self._weekday == Weekdays.THURSDAY and self._changed_entry_time is None:
+                        straddle_price = self.get_current_straddle_price()
+                        if 60 <= straddle_price <= 110:
+                            self.entry()
+                        else:
+                            logger.info(
+                                f"Straddle price {straddle_price} is outside range 60 - 110."
+                            )
+                            self._changed_entry_time = datetime.time(hour=10, minute=20)
+                            self._connection_warmed = False
+                            logger.info(f"Changing the entry time to {self._changed_entry_time}")
                     else:
-                        logger.info(f"Straddle price {straddle_price} is outside range 60 - 110.")
-                        self._changed_entry_time = datetime.time(hour=10, minute=20)
-                        logger.info(f"Changing the entry time to {self._changed_entry_time}")
-                else:
-                    self.entry()
+                        self.entry()
             if self.check_exit_time(now) and self._entry_taken:
                 self.exit()
                 break
             if self._entry_taken:
-                with self._lock:
-                    if self.time_to_trade_remaining_lot(now) and not self._remaining_lot_traded \
-                            and self.remaining_lot_size > 0:
-                        self.trade_remaining_lot()
-                if not self._first_shifting:
-                    # Logic for first shifting
-                    self.first_shifting_registration()
-                else:
-                    # Second shifting onwards
-                    self.second_shifting_registration()
-                if self._config["option_buying_shifting"][self._weekday.name.lower()] and \
-                        not self._stop_shifting_hedges:
-                    self.shift_hedging()
-                pnl = self.get_strategy_pnl()       # Fetching it every 2 secs
-                logger.info(f"Lot traded: {self._lot_size}")
-                logger.info(f"Strategy PnL: {pnl}")
-                self._redis_backend.set("LIVE_PNL", str(pnl))
-                target_sl_hit = self.monitor_pnl(pnl)
+                reconcile = iteration_start - self._published_at >= Strategy1.PUBLISH_INTERVAL
+                with self._price_monitor.use_snapshot():
+                    with self._lock:
+                        if self.time_to_trade_remaining_lot(now) and \
+                                not self._remaining_lot_traded and self.remaining_lot_size > 0:
+                            self.trade_remaining_lot()
+                    # Shifting can be paused by the operator
+                    if not self._shifting_paused:
+                        if not self._first_shifting:
+                            # Logic for first shifting
+                            self.first_shifting_registration()
+                        else:
+                            # Second shifting onwards
+                            self.second_shifting_registration()
+                        if self._settings.option_buying_shifting and \
+                                not self._stop_shifting_hedges:
+                            self.shift_hedging()
+                    pnl = self.get_live_pnl(reconcile=reconcile)
+                    self.hold_open_symbols()
+                    if reconcile or risk is None:
+                        risk = self._risk_aggregator.update(self.get_open_legs())
+                PNL.labels(self._client_id).set(pnl)
+                if reconcile:
+                    logger.info(f"Lot traded: {self._lot_size}")
+                    logger.info(f"Strategy PnL: {pnl}")
+                    logger.info(f"Strategy risk: {risk}")
+                    self._redis_backend.set("LIVE_PNL", str(pnl))
+                    self._risk_aggregator.publish(risk)
+                    self._published_at = iteration_start
+                target_sl_hit = self.monitor_pnl(pnl) or self.monitor_risk(pnl, risk)
                 if target_sl_hit:
                     break
-            # Check if manual exit is True
-            if self._redis_backend.get("MANUAL_EXIT") == "True":
-                logger.info(f"Manual exit triggered")
-                self._bot.send_notification(f"Manual exit triggered")
-                self.exit()
+            if self.handle_commands():
                 break
-            time.sleep(2)
+            self.wait_for_event(iteration_start)
         logger.info(f"Stopping price monitoring")
         self._price_monitor.stop_monitor = True
         logger.info(f"Execution completed")
 
+    def refresh_settings(self) -> None:
+        """
+        Use the latest config of the trading day. SL and target amounts are recalculated if their
+        percent changed. A changed entry time is picked up by entry_time.
+        """
+        config = self._config.config
+        settings = config.get_day(self._weekday)
+        if settings is self._settings:
+            return
+        previous, self._settings = self._settings, settings
+        if previous is None:
+            return
+        logger.info(f"Using config version {config.version}")
+        if settings.stop_loss_percent != previous.stop_loss_percent:
+            self._sl = None
+            logger.info(f"SL percent changed to {settings.stop_loss_percent}")
+        if settings.target_percent != previous.target_percent:
+            self._target = None
+            logger.info(f"Target percent changed to {settings.target_percent}")
+        if settings.entry_time != previous.entry_time and not self._entry_taken:
+            self._connection_warmed = False
+
+    def handle_commands(self) -> bool:
+        """
+        Handle the operator commands received. Return True if the strategy exited. A failed
+        command is acknowledged as failed and does not stop the strategy. Order errors of a
+        manual entry or exit are raised so that the open positions are squared off.
+        """
+        for command in self._commands.get_commands():
+            try:
+                exited = self.handle_command(command)
+            except (BrokerOrderApiError, BrokerApiError, PriceMonitorError,
+                    PriceNotUpdatedError) as err:
+                self._commands.ack(command, ok=False, message=str(err))
+                raise
+            except Exception as err:
+                logger.error(f"Command {command.command_type.value} failed. {err}")
+                self._commands.ack(command, ok=False, message=str(err))
+                continue
+            if exited:
+                return True
+        return False
+
+    def handle_command(self, command: Command) -> bool:
+        """ Handle and acknowledge one operator command. Return True if the strategy exited """
+        if command.command_type == CommandType.MANUAL_EXIT:
+            self.exit(reason=f"Manual exit triggered")
+            self._commands.ack(command)
+            return True
+        if command.command_type == CommandType.MANUAL_ENTRY:
+            if self._entry_taken:
+                self._commands.ack(command, ok=False, message="Entry is already taken")
+                return False
+            logger.info(f"Manual entry triggered")
+            with self._price_monitor.use_snapshot():
+                self.entry()
+            self._commands.ack(command)
+        elif command.command_type == CommandType.PAUSE_SHIFTING:
+            self._shifting_paused = True
+            logger.info(f"Straddle and hedge shifting paused")
+            self._commands.ack(command)
+        elif command.command_type == CommandType.RESUME_SHIFTING:
+            self._shifting_paused = False
+            logger.info(f"Straddle and hedge shifting resumed")
+            self._commands.ack(command)
+        elif command.command_type == CommandType.SET_SL:
+            self._sl = abs(command.value)
+            logger.info(f"SL changed to {self.sl}")
+            self._commands.ack(command, message=f"SL {self.sl}")
+        elif command.command_type == CommandType.SET_TARGET:
+            self._target = abs(command.value)
+            logger.info(f"Target changed to {self.target}")
+            self._commands.ack(command, message=f"Target {self.target}")
+        elif command.command_type == CommandType.RELOAD_CONFIG:
+            reloaded = self._config.reload()
+            self.refresh_settings()
+            self._commands.ack(
+                command, ok=reloaded, message=f"Config version {self._config.config.version}"
+            )
+        return False
+
     def first_shifting_registration(self):
         """ Straddle first shifting """
         if self._market_price > self._straddle_strike:
@@ -394,6 +651,11 @@ class Strategy1(BaseStrategy):
     def thread_safe_shift_straddle(self):
         """ Thread safe """
         with self._lock:
+            if self._shifting_paused:
+                # Register again with the same reference price once shifting is resumed
+                logger.info(f"Skipping straddle shift as shifting is paused")
+                self._price_monitor_register = False
+                return None
             self.shift_straddle()
             
     def shift_straddle(self):
@@ -497,26 +759,29 @@ class Strategy1(BaseStrategy):
     def shift_hedging(self):
         """ Shift hedging close to Rs 5 """
         now = istnow()
-        # Buy hedging
+        # Buy hedging. Far OTM strikes are illiquid, so select and price them using the best ask
+        # which is what a market buy order will actually pay.
         ce_buy_strike = self._price_monitor.get_strike_by_price(
-            price=self.ce_buy_price, option_type="CE"
+            price=self.ce_buy_price, option_type="CE", price_field="ask"
         )
         ce_buy_instrument = self.get_instrument(
             strike=ce_buy_strike,
             option_type="CE",
             action=Action.BUY,
             lot_size=self._lot_size,
-            entry=now
+            entry=now,
+            executable_price=True
         )
         pe_buy_strike = self._price_monitor.get_strike_by_price(
-            price=self.pe_buy_price, option_type="PE"
+            price=self.pe_buy_price, option_type="PE", price_field="ask"
         )
         pe_buy_instrument = self.get_instrument(
             strike=pe_buy_strike,
             option_type="PE",
             action=Action.BUY,
             lot_size=self._lot_size,
-            entry=now
+            entry=now,
+            executable_price=True
         )
         if ce_buy_strike == self._hedging.ce_instrument.strike:
             logger.info(
@@ -730,8 +995,12 @@ class Strategy1(BaseStrategy):
             action: Action,
             lot_size: int,
             entry: datetime.datetime,
+            executable_price: bool = False
     ):
-        """ Return a CE instrument """
+        """
+        Return a CE instrument. When executable_price is True, the instrument is priced at best
+        ask for BUY and best bid for SELL instead of ltp.
+        """
         instrument = Instrument(
             action=action,
             lot_size=lot_size * self._quantity,
@@ -743,32 +1012,75 @@ class Strategy1(BaseStrategy):
             price=0,
             order_id=""
         )
-        instrument.price = self._price_monitor.get_price_by_symbol(instrument.symbol)
+        if executable_price:
+            instrument.price = self._price_monitor.get_executable_price(instrument.symbol, action)
+        else:
+            instrument.price = self._price_monitor.get_price_by_symbol(instrument.symbol)
         return instrument
 
-    def get_strategy_pnl(self):
-        """ Get the strategy pnl """
+    def get_strategy_pnl(self, display: bool = False):
+        """
+        Get the strategy pnl. display uses the price monitor display freshness threshold for pnl
+        which is only reported and not used for a trading decision.
+        """
         if self._dry_run:
-            return self.get_dry_run_pnl()
+            return self.get_dry_run_pnl(display=display)
         orderbook = self.get_orderbook()
-        return self.get_pnl_from_orderbook(orderbook)
+        return self.get_pnl_from_orderbook(orderbook, display=display)
+
+    def get_live_pnl(self, reconcile: bool) -> float:
+        """
+        Strategy pnl of a loop iteration. The orderbook is fetched only to reconcile or when the
+        open legs changed since the last fetch. Otherwise the pnl is the realised pnl of the last
+        fetch plus the open positions at the snapshot prices, so a tick needs no broker call.
+        """
+        if self._dry_run:
+            return self.get_dry_run_pnl()
+        open_legs_key = tuple(
+            (x.symbol, x.action, x.lot_size, x.order_id) for x in self.get_open_legs()
+        )
+        if reconcile or open_legs_key != self._open_legs_key:
+            self._realised_pnl, self._open_positions = self.get_orderbook_positions(
+                self.get_orderbook()
+            )
+            self._open_legs_key = open_legs_key
+        return round(self._realised_pnl + self.get_unrealised_pnl(self._open_positions), 2)
 
-    def get_dry_run_pnl(self):
+    def hold_open_symbols(self) -> None:
+        """ Share the symbols of the open positions with the market feed when they change """
+        symbols = sorted(
+            {x.symbol for x in self.get_open_legs()} | {x.symbol for x in self._open_positions}
+        )
+        if symbols != self._held:
+            self._held_symbols.hold(self._client_id, symbols)
+            self._held = symbols
+
+    def release_open_symbols(self) -> None:
+        if not self._held:
+            return
+        try:
+            self._held_symbols.hold(self._client_id, [])
+            self._held = []
+        except Exception as err:
+            logger.error(f"Unable to release the held symbols. {err}")
+
+    def get_dry_run_pnl(self, display: bool = False):
         """ Return pnl when running in dry-run mode """
-        straddle_pnl = self.get_pair_instrument_pnl(self._straddle) if self._straddle else 0
-        hedging_pnl = self.get_pair_instrument_pnl(self._hedging) if self._hedging else 0
+        straddle_pnl = self.get_pair_instrument_pnl(self._straddle, display) \
+            if self._straddle else 0
+        hedging_pnl = self.get_pair_instrument_pnl(self._hedging, display) if self._hedging else 0
         return round(self._pnl + straddle_pnl + hedging_pnl, 2)
 
-    def get_pair_instrument_pnl(self, instrument: PairInstrument):
+    def get_pair_instrument_pnl(self, instrument: PairInstrument, display: bool = False):
         """ Calculate current straddle pnl """
-        ce_pnl = self.get_instrument_pnl(instrument.ce_instrument)
-        pe_pnl = self.get_instrument_pnl(instrument.pe_instrument)
+        ce_pnl = self.get_instrument_pnl(instrument.ce_instrument, display)
+        pe_pnl = self.get_instrument_pnl(instrument.pe_instrument, display)
         return round(ce_pnl + pe_pnl, 2)
 
-    def get_instrument_pnl(self, instrument: Instrument):
+    def get_instrument_pnl(self, instrument: Instrument, display: bool = False):
         """ Calculate pnl for an individual instrument """
         entry_price = instrument.price
-        current_price = self._price_monitor.get_price_by_symbol(instrument.symbol)
+        current_price = self._price_monitor.get_price_by_symbol(instrument.symbol, display)
         pnl = self.calc_pnl(entry_price, current_price, instrument.action)
         # instrument lot size is lot size * quantity
         return round(pnl * instrument.lot_size, 2)
@@ -797,10 +1109,15 @@ class Strategy1(BaseStrategy):
             order_id=orderbook_data["orderid"]
         )
 
-    def get_pnl_from_orderbook(self, orderbook: list) -> float:
+    def get_pnl_from_orderbook(self, orderbook: list, display: bool = False) -> float:
         """ Calculate pnl using orderbook """
+        total_realised_pnl, open_positions = self.get_orderbook_positions(orderbook)
+        total_unrealised_pnl = self.get_unrealised_pnl(open_positions, display)
+        return round(total_realised_pnl + total_unrealised_pnl, 2)
+
+    def get_orderbook_positions(self, orderbook: list) -> Tuple[float, List[Instrument]]:
+        """ Realised pnl and the open positions of the orderbook """
         total_realised_pnl = 0
-        total_unrealised_pnl = 0
         transactions = dict()
         for order in orderbook:
             instrument = self.orderbook_data_to_instrument(order)
@@ -823,16 +1140,21 @@ class Strategy1(BaseStrategy):
                     )
                     transactions[instrument.symbol] = transaction
                     total_realised_pnl += pnl
-        # Calculate unrealised pnl
-        for instrument in transactions.values():
-            current_price = self._price_monitor.get_price_by_symbol(instrument.symbol) * \
-                            instrument.lot_size
+        return total_realised_pnl, list(transactions.values())
+
+    def get_unrealised_pnl(self, open_positions: List[Instrument], display: bool = False) -> float:
+        """ Pnl of the open positions of the orderbook at the current prices """
+        total_unrealised_pnl = 0
+        for instrument in open_positions:
+            current_price = self._price_monitor.get_price_by_symbol(
+                instrument.symbol, display
+            ) * instrument.lot_size
             if instrument.action == "BUY":
                 # For BUY instrument we are saving the price in negative
                 total_unrealised_pnl += current_price + instrument.price
             else:
                 total_unrealised_pnl += instrument.price - current_price
-        return round(total_realised_pnl + total_unrealised_pnl, 2)
+        return total_unrealised_pnl
 
     @staticmethod
     def get_instrument_price_from_orderbook(data: dict) -> float:
@@ -893,6 +1215,49 @@ class Strategy1(BaseStrategy):
     def calc_pnl_orderbook(transaction1: Instrument, transaction2: Instrument):
         return transaction1.price + transaction2.price
 
+    def wait_for_event(self, iteration_start: float) -> Set[str]:
+        """
+        Block till a tick of a watched symbol, an operator command or the next timer event.
+        Return the events received, empty for a timer event or the heartbeat.
+        """
+        if self._entry_taken:
+            self._tick_events.watch(
+                [x.symbol for x in self.get_open_legs()] + [self._ticker]
+            )
+            elapsed = time.monotonic() - iteration_start
+            if elapsed < Strategy1.MIN_EVENT_INTERVAL:
+                # Ticks received meanwhile are coalesced into one event
+                time.sleep(Strategy1.MIN_EVENT_INTERVAL - elapsed)
+        return self._tick_events.wait(self.get_loop_interval(istnow()))
+
+    def get_loop_interval(self, dt: datetime.datetime) -> float:
+        """
+        Seconds to the next timer event, capped at the heartbeat. The timer events are the
+        connection warm up and the entry before the entry, and the remaining lot and the exit
+        after it. check_*_time need the time to be more than the event time, hence the 1 ms.
+        """
+        if self._entry_taken:
+            timers = [self.get_seconds_to_time(dt, self.exit_time) + 0.001]
+            if not self._remaining_lot_traded:
+                trade_time = self._entry_time + datetime.timedelta(minutes=25)
+                timers.append(self.get_seconds_to_time(dt, trade_time.time()) + 0.001)
+            interval = Strategy1.HEARTBEAT_INTERVAL
+        else:
+            seconds_to_entry = self.get_seconds_to_entry(dt)
+            timers = [seconds_to_entry + 0.001]
+            if not self._connection_warmed:
+                timers.append(seconds_to_entry - Strategy1.CONNECTION_WARM_SECONDS + 0.001)
+            interval = Strategy1.IDLE_INTERVAL
+        return min([x for x in timers if x >= 0] + [interval])
+
+    def get_seconds_to_entry(self, dt: datetime.datetime) -> float:
+        return self.get_seconds_to_time(dt, self.entry_time)
+
+    @staticmethod
+    def get_seconds_to_time(dt: datetime.datetime, event_time: datetime.time) -> float:
+        event_dt = datetime.datetime.combine(dt.date(), event_time, tzinfo=dt.tzinfo)
+        return (event_dt - dt).total_seconds()
+
     def check_entry_time(self, dt: datetime.datetime) -> bool:
         """ Return True if the time is more than entry time. Entry time is 9:50 AM """
         return dt.time() > self.entry_time
@@ -944,29 +1309,29 @@ class Strategy1(BaseStrategy):
 
     @property
     def sl_percent(self) -> float:
-        return float(self._config["stop_loss"][self._weekday.name.lower()])
+        return self._settings.stop_loss_percent
 
     @property
     def target_percent(self) -> float:
-        return float(self._config["target"][self._weekday.name.lower()])
+        return self._settings.target_percent
 
     @property
     def ce_buy_price(self) -> float:
-        return float(self._config["option_buying"][self._weekday.name.lower()]["CE"])
+        return self._settings.ce_buy_price
 
     @property
     def pe_buy_price(self) -> float:
-        return float(self._config["option_buying"][self._weekday.name.lower()]["PE"])
+        return self._settings.pe_buy_price
 
     @property
     def entry_time(self) -> datetime.time:
         if self._changed_entry_time is None:
-            return self._day_config.time or self._config["entry_time"][self._weekday.name.lower()]
+            return self._day_config.time or self._settings.entry_time
         return self._changed_entry_time
 
     @property
     def exit_time(self) -> datetime.time:
-        return self._config["exit_time"][self._weekday.name.lower()]
+        return self._settings.exit_time
 
     @property
     def sl(self) -> float:
@@ -980,13 +1345,18 @@ class Strategy1(BaseStrategy):
             self._target = self.target_percent * self.initial_capital / 100
         return self._target
 
+    @property
+    def exit_latency_ms(self) -> Optional[float]:
+        """ Time from the exit trigger to all the square off orders acknowledged """
+        return self._exit_latency_ms
+
     @property
     def initial_capital(self) -> float:
         """ Make API call to get initial capital in the account """
         if self._initial_capital is None:
             # API Call
             if self._dry_run:
-                self._initial_capital = self._config["dry_run"]["initial_capital"]
+                self._initial_capital = self._settings.dry_run_initial_capital
             else:
                 self._initial_capital = self.get_initial_capital()
         return self._initial_capital
@@ -994,20 +1364,23 @@ class Strategy1(BaseStrategy):
     @property
     def capital_to_trade(self) -> float:
         """ Calculate capital to trade which is 95% of initial capital """
-        return self._config["capital_to_trade_percent"][self._weekday.name.lower()] * \
-               self.initial_capital
+        if self._settings.capital_to_trade_percent is None:
+            raise StrategyConfigError(
+                f"capital_to_trade_percent is missing for {self._weekday.name}"
+            )
+        return self._settings.capital_to_trade_percent * self.initial_capital
 
     @property
     def expected_margin_per_lot(self) -> float:
         """ A rough estimate for margin per lot """
-        return self._config["margin"][self._weekday.name.lower()]
+        return self._settings.margin
 
     @property
     def actual_margin_per_lot(self) -> float:
         """ MAke API call to get actual margin used and divide it by initial lot """
         if self._actual_margin_per_lot is None:
             if self._dry_run:
-                self._actual_margin_per_lot = self._config["dry_run"]["actual_margin_per_lot"]
+                self._actual_margin_per_lot = self._settings.dry_run_actual_margin_per_lot
             else:
                 margin_used = self.get_used_margin()    # Get this using API call
                 self._actual_margin_per_lot = round(margin_used / self.initial_lot_size, 2)
@@ -1032,12 +1405,13 @@ class Strategy1(BaseStrategy):
 
 if __name__ == "__main__":
     from src import BASE_DIR
+    from src.utils.config_reader import ConfigReader
     price_monitor = PriceMonitor()
     price_monitor.setup()
     price_monitor.run_in_background()
     config_path = BASE_DIR / 'data' / 'config.json'
     config = ConfigReader(config_file_path=config_path)
-    strategy_config = config["strategies"][Strategy1.STRATEGY_CODE]
+    strategy_config = StrategyConfigWatcher(config_path, Strategy1.STRATEGY_CODE)
     trading_accounts = config["trading_accounts"]
     account = trading_accounts.pop()
     strategy = Strategy1(
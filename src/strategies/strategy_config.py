@@ -0,0 +1,202 @@
+"""
+File:           strategy_config.py
+Author:         Dibyaranjan Sathua
+Created on:     20/10/26, 1:30 am
+"""
+from typing import Optional, Dict
+from dataclasses import dataclass
+from pathlib import Path
+import datetime
+import json
+import os
+import threading
+
+from src.utils.config_reader import ConfigReader
+from src.utils.enum import Weekdays
+from src.utils.logger import LogFacade
+
+
+logger: LogFacade = LogFacade.get_logger("strategy_config")
+
+
+class StrategyConfigError(Exception):
+    """ Raised when the strategy config is missing a value or has an invalid one """
+    pass
+
+
+@dataclass(frozen=True)
+class Strategy1DayConfig:
+    """ Strategy1 config of one weekday, resolved from the per day dicts of the config file """
+    weekday: Weekdays
+    stop_loss_percent: float
+    target_percent: float
+    margin: float                                       # Expected margin per lot
+    ce_buy_price: float
+    pe_buy_price: float
+    option_buying_shifting: bool
+    entry_time: datetime.time
+    exit_time: datetime.time
+    capital_to_trade_percent: Optional[float]
+    scenario_sl: Optional[float]
+    dry_run_initial_capital: Optional[float]
+    dry_run_actual_margin_per_lot: Optional[float]
+
+
+@dataclass(frozen=True)
+class Strategy1Config:
+    """ Day configs of all the weekdays in the config. version is incremented on every reload """
+    days: Dict[Weekdays, Strategy1DayConfig]
+    version: int
+
+    def get_day(self, weekday: Weekdays) -> Strategy1DayConfig:
+        day_config = self.days.get(weekday)
+        if day_config is None:
+            raise StrategyConfigError(f"Strategy config is missing for {weekday.name}")
+        return day_config
+
+    @classmethod
+    def from_dict(cls, config: Dict, version: int = 0) -> "Strategy1Config":
+        """ Resolve and validate the day configs. Days are the ones with an entry time """
+        risk = config.get("risk") or dict()
+        dry_run = config.get("dry_run") or dict()
+        days = dict()
+        for day in config.get("entry_time", dict()):
+            try:
+                weekday = Weekdays[day.upper()]
+            except KeyError:
+                raise StrategyConfigError(f"Invalid weekday {day} in entry_time")
+            try:
+                capital_to_trade_percent = config.get("capital_to_trade_percent", dict()).get(day)
+                day_config = Strategy1DayConfig(
+                    weekday=weekday,
+                    stop_loss_percent=float(config["stop_loss"][day]),
+                    target_percent=float(config["target"][day]),
+                    margin=float(config["margin"][day]),
+                    ce_buy_price=float(config["option_buying"][day]["CE"]),
+                    pe_buy_price=float(config["option_buying"][day]["PE"]),
+                    option_buying_shifting=bool(config["option_buying_shifting"][day]),
+                    entry_time=config["entry_time"][day],
+                    exit_time=config["exit_time"][day],
+                    capital_to_trade_percent=None if capital_to_trade_percent is None
+                    else float(capital_to_trade_percent),
+                    scenario_sl=None if risk.get("scenario_sl") is None
+                    else float(risk["scenario_sl"]),
+                    dry_run_initial_capital=dry_run.get("initial_capital"),
+                    dry_run_actual_margin_per_lot=dry_run.get("actual_margin_per_lot")
+                )
+            except KeyError as err:
+                raise StrategyConfigError(f"{err} is missing for {day}")
+            except (TypeError, ValueError) as err:
+                raise StrategyConfigError(f"Invalid config for {day}. {err}")
+            cls.validate(day_config)
+            days[weekday] = day_config
+        if not days:
+            raise StrategyConfigError(f"Strategy config has no entry time")
+        return cls(days=days, version=version)
+
+    @staticmethod
+    def validate(day_config: Strategy1DayConfig) -> None:
+        day = day_config.weekday.name
+        for name in ("stop_loss_percent", "target_percent", "margin"):
+            if getattr(day_config, name) <= 0:
+                raise StrategyConfigError(f"{name} must be positive for {day}")
+        if day_config.ce_buy_price < 0 or day_config.pe_buy_price < 0:
+            raise StrategyConfigError(f"Option buying price must not be negative for {day}")
+        if not isinstance(day_config.entry_time, datetime.time) or \
+                not isinstance(day_config.exit_time, datetime.time):
+            raise StrategyConfigError(f"Entry and exit time must be HH:MM for {day}")
+        if day_config.entry_time >= day_config.exit_time:
+            raise StrategyConfigError(f"Entry time must be before exit time for {day}")
+        if day_config.capital_to_trade_percent is not None and \
+                not 0 < day_config.capital_to_trade_percent <= 1:
+            raise StrategyConfigError(f"capital_to_trade_percent must be in (0, 1] for {day}")
+        if day_config.scenario_sl is not None and day_config.scenario_sl <= 0:
+            raise StrategyConfigError(f"risk.scenario_sl must be positive")
+
+
+class StrategyConfigWatcher:
+    """
+    Typed strategy config with hot reload. The config is resolved and validated once at start.
+    A background thread reloads the config file when it is modified and swaps in the new config
+    only if it is valid, so an invalid edit keeps the running config. The strategies read config
+    once per loop iteration, so an iteration never mixes two versions.
+    """
+    WATCH_INTERVAL = 5
+
+    def __init__(self, config_file_path: Path, strategy_code: str):
+        self._config_file_path = config_file_path
+        self._strategy_code = strategy_code
+        self._lock = threading.Lock()
+        self._mtime: float = 0                              # Modified time of the loaded file
+        self._rejected_mtime: Optional[float] = None        # Of the last invalid file
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._config: Strategy1Config = self.load(version=0)
+
+    def start(self) -> None:
+        """ Watch the config file in the background """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._watch, name="config-watcher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def load(self, version: int) -> Strategy1Config:
+        """ Read and validate the strategy config from the file """
+        mtime = os.stat(self._config_file_path).st_mtime
+        with open(self._config_file_path, mode="r") as fp_:
+            try:
+                config = json.load(fp_, object_hook=ConfigReader.json_object_hook)
+            except ValueError as err:
+                raise StrategyConfigError(f"Error decoding config file. {err}")
+        try:
+            strategy_config = config["strategies"][self._strategy_code]
+        except KeyError:
+            raise StrategyConfigError(f"{self._strategy_code} is missing in the config file")
+        strategy1_config = Strategy1Config.from_dict(strategy_config, version=version)
+        self._mtime = mtime
+        return strategy1_config
+
+    def reload(self) -> bool:
+        """
+        Swap in the config from the file if the file is modified and valid. An unmodified file
+        is not loaded again, so a reload command received by every account loads it once.
+        Return False if the file is invalid and the running config is kept.
+        """
+        with self._lock:
+            mtime = None
+            try:
+                mtime = os.stat(self._config_file_path).st_mtime
+                if mtime == self._mtime:
+                    return True
+                config = self.load(version=self._config.version + 1)
+            except (OSError, StrategyConfigError) as err:
+                self._rejected_mtime = mtime
+                logger.error(f"Keeping config version {self._config.version}. {err}")
+                return False
+            self._config = config
+        logger.info(f"Loaded config version {config.version}")
+        return True
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.WATCH_INTERVAL):
+            try:
+                mtime = os.stat(self._config_file_path).st_mtime
+            except OSError as err:
+                logger.error(f"Unable to check the config file. {err}")
+                continue
+            # An invalid file is reported once, not on every check
+            if mtime != self._mtime and mtime != self._rejected_mtime:
+                logger.info(f"Config file modified")
+                self.reload()
+
+    @property
+    def config(self) -> Strategy1Config:
+        return self._config
@@ -3,6 +3,11 @@ File:           bot.py
 Author:         Dibyaranjan Sathua
 Created on:     01/04/23, 10:56 am
 """
+from typing import List, Optional, Tuple
+import queue
+import threading
+import time
+
 import requests
 
 from src.utils.config_reader import ConfigReader
@@ -12,41 +17,158 @@ logger: LogFacade = LogFacade.get_logger("bot")
 
 
 class Bot:
-    """ Telegram bot to send notification """
+    """
+    Telegram bot to send notification. send_notification only puts the message in a bounded
+    queue, a background thread sends it so that a slow telegram API never blocks trading.
+    Messages arriving within BATCH_WINDOW of each other are sent as one message.
+    """
+    QUEUE_SIZE = 100
+    BATCH_WINDOW = 0.5                  # Seconds to wait for more messages of a burst
+    MAX_BATCH_LENGTH = 4000             # Telegram rejects messages longer than 4096 characters
+    TIMEOUT = 5
+    MAX_RETRIES = 3
+    BACKOFF = 1                         # Seconds before the first retry, doubled on each retry
 
     def __init__(self, config: ConfigReader):
         self._config: ConfigReader = config
         self._token: str = self._config["token"]
         self._chat_id: int = self._config["chat_id"]
+        # Keep-alive session so that each notification does not open a new TLS connection
+        self._session: requests.Session = requests.Session()
+        self._queue: queue.Queue = queue.Queue(maxsize=Bot.QUEUE_SIZE)
+        self._worker: Optional[threading.Thread] = None
+        self._lock: threading.Lock = threading.Lock()
+        self._dropped: int = 0
 
     def send_notification(self, message: str):
+        """ Queue the message. The oldest message is dropped when the queue is full """
+        self.start()
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self._dropped += 1
+                    logger.warning(f"Notification queue is full. Dropped {self._dropped} messages")
+                except queue.Empty:
+                    pass
+
+    def start(self) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="telegram-bot", daemon=True
+                )
+                self._worker.start()
+
+    def flush(self, timeout: float = 10) -> bool:
+        """ Wait for the queued messages to be sent. Return False on timeout """
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if time.time() >= deadline:
+                logger.warning(f"{self._queue.unfinished_tasks} notifications are not sent")
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _run(self) -> None:
+        # Message taken from the queue that did not fit in the previous batch
+        pending: Optional[str] = None
+        while True:
+            messages, pending = self.get_batch(pending)
+            try:
+                for text in self.split_message("\n\n".join(messages)):
+                    self.send_with_retry(text)
+            except Exception as err:
+                logger.error(f"Error sending notification: {err}")
+            finally:
+                for _ in messages:
+                    self._queue.task_done()
+
+    def get_batch(self, pending: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+        """
+        Block for a message and collect the rest of the burst that fits in MAX_BATCH_LENGTH.
+        pending is sent first. Return the batch and the message that did not fit in it.
+        """
+        messages = [pending if pending is not None else self._queue.get()]
+        length = len(messages[0])
+        deadline = time.time() + Bot.BATCH_WINDOW
+        while True:
+            try:
+                message = self._queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                return messages, None
+            if length + len(message) + 2 > Bot.MAX_BATCH_LENGTH:
+                return messages, message
+            messages.append(message)
+            length += len(message) + 2
+
+    @staticmethod
+    def split_message(message: str) -> List[str]:
+        """ Split a message longer than MAX_BATCH_LENGTH, e.g. a long error, into parts """
+        return [
+            message[i:i + Bot.MAX_BATCH_LENGTH]
+            for i in range(0, max(len(message), 1), Bot.MAX_BATCH_LENGTH)
+        ]
+
+    def send_with_retry(self, message: str) -> bool:
+        """ Send the message, retrying with exponential backoff. Return False if dropped """
+        backoff = Bot.BACKOFF
+        for attempt in range(Bot.MAX_RETRIES + 1):
+            retry_after = self.post(message)
+            if retry_after is None:
+                return True
+            if attempt == Bot.MAX_RETRIES:
+                break
+            time.sleep(max(backoff, retry_after))
+            backoff *= 2
+        logger.error(f"Dropping notification after {Bot.MAX_RETRIES} retries: {message}")
+        return False
+
+    def post(self, message: str) -> Optional[float]:
+        """
+        Send the message. Return the seconds to wait before a retry or None when a retry is not
+        needed (sent) or would not help (client error like a wrong chat id)
+        """
         json_data = {
             "chat_id": self._chat_id,
             "text": message
         }
         try:
-            response = requests.post(
+            response = self._session.post(
                 url=self.send_message_endpoint,
-                json=json_data
+                json=json_data,
+                timeout=Bot.TIMEOUT
             )
-        except ConnectionError as err:
+        except requests.exceptions.RequestException as err:
             logger.error(f"Error sending notification: {err}")
-            return
+            return 0
 
         if not response.ok:
             logger.error(
                 f"Error sending notification to {self.send_message_endpoint} "
                 f"(HTTP {response.status_code}): {response.text}"
             )
-            return
+            if response.status_code == 429:
+                # Telegram tells how long to wait when rate limited
+                try:
+                    return response.json()["parameters"]["retry_after"]
+                except (ValueError, KeyError, TypeError):
+                    return 0
+            # Other client errors such as a bad token fail again on a retry
+            return None if 400 <= response.status_code < 500 else 0
         json_response = response.json()
         if not json_response.get("ok", False):
             logger.error(
                 f"Error sending notification to {self.send_message_endpoint} "
                 f"(HTTP {response.status_code}): {json_response}"
             )
-            return
+            return None
         logger.info(json_response)
+        return None
 
     @property
     def send_message_endpoint(self):
@@ -63,3 +185,4 @@ if __name__ == "__main__":
     telegram_config = config["telegram"]
     bot = Bot(config=telegram_config)
     bot.send_notification("Testing notification from SathuaLabs")
+    bot.flush()
@@ -3,61 +3,181 @@ File:           logger.py
 Author:         Dibyaranjan Sathua
 Created on:     05/08/22, 9:52 pm
 """
-from typing import Dict
+from typing import Dict, List, Optional
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
 
 from src import LOG_DIR
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. Fields passed as extra={"fields": {...}} are added to the object,
+    e.g. logger.info("Order placed", extra={"fields": {"order_id": order_id}})
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        data.update(getattr(record, "fields", None) or dict())
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket of rate records per second with bursts up to burst records. DEBUG records over
+    the limit are dropped. INFO and above always pass, as they record the trading decisions.
+    The number of dropped records is added to the next DEBUG record as the suppressed field.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        super(RateLimitFilter, self).__init__()
+        self._rate = rate
+        self._burst = burst or max(int(rate), 1)
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens < 1:
+                self._suppressed += 1
+                return False
+            self._tokens -= 1
+            suppressed, self._suppressed = self._suppressed, 0
+        if suppressed:
+            fields = getattr(record, "fields", None) or dict()
+            record.fields = {**fields, "suppressed": suppressed}
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler formats the message in the calling thread. Queue the record as it is so that
+    the formatting is also done by the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class LogRouter(logging.Handler):
+    """ Handler of the queue listener. Pass a record to the handlers of its logger """
+
+    def __init__(self):
+        super(LogRouter, self).__init__()
+        self._handlers: Dict[str, List[logging.Handler]] = dict()
+
+    def add_handler(self, name: str, handler: logging.Handler) -> None:
+        self._handlers.setdefault(name, []).append(handler)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        for handler in self._handlers.get(record.name, []):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
 class LogFacade:
-    """ Log module """
+    """
+    Log module. Loggers only put the records in a queue. A single listener thread formats them and
+    writes to the console and to logs/<name>.log, so logging I/O never blocks the price monitor
+    or the order placement. Set LOG_FORMAT=json for JSON lines in the log files.
+    Prefer lazy arguments on hot paths, logger.debug("Live price: %s", price), as the message is
+    then formatted only if the record is logged. Such arguments must not be mutated afterwards.
+    """
 
     __LOGGER_INSTANCES: Dict[str, "LogFacade"] = dict()
     FORMAT = "[%(levelname)s] %(asctime)s: %(message)s"
+    __QUEUE: queue.SimpleQueue = queue.SimpleQueue()
+    __ROUTER: LogRouter = LogRouter()
+    __LISTENER: Optional[logging.handlers.QueueListener] = None
 
-    def __init__(self, name: str, level=None):
+    def __init__(self, name: str, level=None, rate_limit: Optional[float] = None):
         self._name: str = name
         self._level = level or logging.INFO
         self._logger = logging.getLogger(name)
-        self._logger.setLevel(logging.DEBUG)
+        # Records below the handler level are dropped before they are created and queued
+        self._logger.setLevel(self._level)
+        self._logger.addHandler(LazyQueueHandler(LogFacade.__QUEUE))
+        if rate_limit is not None:
+            self._logger.addFilter(RateLimitFilter(rate=rate_limit))
         self.add_stream_handler()
         self.add_file_handler()
+        LogFacade.start_listener()
 
     def add_stream_handler(self):
         """ Add stream handler to logger """
         handler = logging.StreamHandler()
         handler.setLevel(self._level)
         handler.setFormatter(logging.Formatter(LogFacade.FORMAT))
-        self._logger.addHandler(handler)
+        LogFacade.__ROUTER.add_handler(self._name, handler)
 
     def add_file_handler(self):
         """ Add a file handler to logger """
         handler = logging.FileHandler(filename=LOG_DIR / f"{self._name}.log", mode="w")
         handler.setLevel(level=self._level)
-        handler.setFormatter(logging.Formatter(LogFacade.FORMAT))
-        self._logger.addHandler(handler)
+        if os.environ.get("LOG_FORMAT") == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(logging.Formatter(LogFacade.FORMAT))
+        LogFacade.__ROUTER.add_handler(self._name, handler)
+
+    @classmethod
+    def start_listener(cls):
+        """ Start the listener thread once per process. Queued records are flushed at exit """
+        if cls.__LISTENER is None:
+            cls.__LISTENER = logging.handlers.QueueListener(cls.__QUEUE, cls.__ROUTER)
+            cls.__LISTENER.start()
+            atexit.register(cls.stop_listener)
+
+    @classmethod
+    def stop_listener(cls):
+        if cls.__LISTENER is not None:
+            cls.__LISTENER.stop()
+            cls.__LISTENER = None
 
     @classmethod
-    def get_logger(cls, name: str, level=None):
-        """ Get logger instance """
+    def get_logger(cls, name: str, level=None, rate_limit: Optional[float] = None):
+        """
+        Get logger instance. rate_limit is the max DEBUG records per second for noisy loggers
+        """
         if name not in cls.__LOGGER_INSTANCES:
-            cls.__LOGGER_INSTANCES[name] = LogFacade(name=name, level=level)
+            cls.__LOGGER_INSTANCES[name] = LogFacade(name=name, level=level, rate_limit=rate_limit)
         return cls.__LOGGER_INSTANCES[name]
 
-    def error(self, msg):
-        self._logger.error(msg)
+    def error(self, msg, *args, **kwargs):
+        self._logger.error(msg, *args, **kwargs)
 
-    def info(self, msg):
-        self._logger.info(msg)
+    def info(self, msg, *args, **kwargs):
+        self._logger.info(msg, *args, **kwargs)
 
-    def warning(self, msg):
-        self._logger.warning(msg)
+    def warning(self, msg, *args, **kwargs):
+        self._logger.warning(msg, *args, **kwargs)
 
-    def debug(self, msg):
-        self._logger.debug(msg)
+    def debug(self, msg, *args, **kwargs):
+        self._logger.debug(msg, *args, **kwargs)
 
-    def critical(self, msg):
-        self._logger.critical(msg)
+    def critical(self, msg, *args, **kwargs):
+        self._logger.critical(msg, *args, **kwargs)
 
-    def exception(self, msg):
-        self._logger.exception(msg)
+    def exception(self, msg, *args, **kwargs):
+        self._logger.exception(msg, *args, **kwargs)
@@ -3,11 +3,12 @@ File:           redis_backend.py
 Author:         Dibyaranjan Sathua
 Created on:     18/08/22, 5:15 pm
 """
-from typing import Optional, Dict, Union
+from typing import Optional, Dict, Union, List, Tuple
 import os
 import json
 
 import redis
+import redis.asyncio
 from dotenv import load_dotenv
 
 from src import BASE_DIR
@@ -41,6 +42,97 @@ class RedisBackend:
             except json.decoder.JSONDecodeError:
                 return data.decode("utf-8")
 
+    def mget(self, keys: List[str]) -> List[Optional[Dict]]:
+        """ Get all the keys in a single MGET round trip. Missing keys are None """
+        values = []
+        for data in self._redis.mget(keys) if keys else []:
+            try:
+                values.append(json.loads(data) if data else None)
+            except json.decoder.JSONDecodeError:
+                values.append(data.decode("utf-8"))
+        return values
+
+    def set_and_publish(self, key: str, data: Union[Dict, str], channel: str) -> None:
+        """ Set the key and publish the key on the channel in a single round trip """
+        if isinstance(data, dict):
+            data = json.dumps(data)
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.set(key, data)
+        pipeline.publish(channel, key)
+        pipeline.execute()
+
+    def publish(self, channel: str, message: str) -> None:
+        self._redis.publish(channel, message)
+
+    def pubsub(self) -> redis.client.PubSub:
+        return self._redis.pubsub(ignore_subscribe_messages=True)
+
+    def delete(self, key: str) -> None:
+        self._redis.delete(key)
+
+    def hset(self, key: str, mapping: Dict) -> None:
+        self._redis.hset(key, mapping=mapping)
+
+    def hdel(self, key: str, *fields: str) -> None:
+        self._redis.hdel(key, *fields)
+
+    def hgetall(self, key: str) -> Dict[str, str]:
+        return {x.decode("utf-8"): y.decode("utf-8") for x, y in self._redis.hgetall(key).items()}
+
+    def xadd(self, stream: str, fields: Dict[str, str], maxlen: Optional[int] = None) -> str:
+        """ Append an entry to the stream. The stream is trimmed to about maxlen entries """
+        return self._redis.xadd(stream, fields, maxlen=maxlen, approximate=True).decode("utf-8")
+
+    def create_group(self, stream: str, group: str) -> None:
+        """
+        Create the consumer group at the end of the stream so that only the entries added from
+        now are read. An existing group is kept as it is.
+        """
+        try:
+            self._redis.xgroup_create(stream, group, id="$", mkstream=True)
+        except redis.exceptions.ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
+
+    def xreadgroup(
+            self,
+            stream: str,
+            group: str,
+            consumer: str,
+            count: int = 10,
+            block_ms: Optional[int] = 1000,
+            entry_id: str = ">"
+    ) -> List[Tuple[str, Dict[str, str]]]:
+        """
+        Block till there are new entries for the group, or return at once when block_ms is None.
+        With entry_id "0", the entries read by the consumer but not acked are returned instead.
+        Return (entry id, fields). Fields of an entry trimmed from the stream are empty.
+        """
+        response = self._redis.xreadgroup(group, consumer, {stream: entry_id}, count, block_ms)
+        entries = []
+        for _, stream_entries in response or []:
+            for entry_id, fields in stream_entries:
+                entries.append(
+                    (
+                        entry_id.decode("utf-8"),
+                        {x.decode("utf-8"): y.decode("utf-8") for x, y in (fields or {}).items()}
+                    )
+                )
+        return entries
+
+    def xack(self, stream: str, group: str, entry_id: str) -> None:
+        self._redis.xack(stream, group, entry_id)
+
+    def xrevrange(self, stream: str, count: int) -> List[Tuple[str, Dict[str, str]]]:
+        """ Last count entries of the stream, the latest first """
+        return [
+            (
+                entry_id.decode("utf-8"),
+                {x.decode("utf-8"): y.decode("utf-8") for x, y in fields.items()}
+            )
+            for entry_id, fields in self._redis.xrevrange(stream, count=count)
+        ]
+
     def cleanup(self, pattern="NIFTY*") -> None:
         """ Delete all keys matching the pattern so that everyday we have fresh data """
         for key in self._redis.scan_iter(pattern):
@@ -53,6 +145,57 @@ class RedisBackend:
             print(f"{key} --> {value}")
 
 
+class AsyncRedisBackend:
+    """ Asyncio redis backend used by the asyncio market feed """
+
+    def __init__(self):
+        self._host: str = os.environ.get("REDIS_HOST", "localhost")
+        self._port: int = int(os.environ.get("REDIS_PORT", 6379))
+        self._redis: Optional[redis.asyncio.Redis] = None
+
+    def connect(self) -> None:
+        self._redis = redis.asyncio.Redis(host=self._host, port=self._port)
+
+    async def set(self, key: str, data: Union[Dict, str]) -> None:
+        if isinstance(data, dict):
+            data = json.dumps(data)
+        await self._redis.set(key, data)
+
+    async def set_many(
+            self, data: Dict[str, Union[Dict, str]], channel_prefix: Optional[str] = None
+    ) -> None:
+        """
+        Set all the keys in a single MSET round trip. With channel_prefix each key is also
+        published on <channel_prefix><key> in the same round trip.
+        """
+        mapping = {
+            key: json.dumps(value) if isinstance(value, dict) else value
+            for key, value in data.items()
+        }
+        if channel_prefix is None:
+            await self._redis.mset(mapping)
+            return
+        pipeline = self._redis.pipeline(transaction=False)
+        pipeline.mset(mapping)
+        for key in mapping:
+            pipeline.publish(f"{channel_prefix}{key}", key)
+        await pipeline.execute()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        data = await self._redis.get(key)
+        if data:
+            try:
+                return json.loads(data)
+            except json.decoder.JSONDecodeError:
+                return data.decode("utf-8")
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(key)
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+
 if __name__ == "__main__":
     obj = RedisBackend()
     obj.connect()
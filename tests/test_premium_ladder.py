@@ -0,0 +1,48 @@
+"""
+File:           test_premium_ladder.py
+Author:         Dibyaranjan Sathua
+Created on:     19/10/26, 10:45 am
+"""
+from src.price_monitor.price_monitor import PremiumLadder
+
+
+STRIKES = [19850, 19900, 19950, 20000, 20050, 20100, 20150, 20200, 20250]
+
+
+def test_ladder_without_stale_strike():
+    ladder = PremiumLadder(20000, STRIKES, [380, 310, 250, 200, 160, 125, 95, 70, 50], "CE")
+    assert ladder.strikes == STRIKES
+    assert ladder.get_nearest(90) == 20150
+    assert ladder.get_first_below(100) == 20150
+
+
+def test_stale_strike_in_the_middle_is_skipped():
+    ladder = PremiumLadder(20000, STRIKES[3:], [200, 160, 40, 95, 70, 50], "CE")
+    assert ladder.strikes == [20000, 20050, 20150, 20200, 20250]
+    assert ladder.get_nearest(90) == 20150
+    assert ladder.get_nearest(45) == 20250
+
+
+def test_stale_strike_next_to_the_atm_is_skipped():
+    ladder = PremiumLadder(20000, STRIKES, [380, 310, 250, 200, 60, 125, 95, 70, 50], "CE")
+    assert ladder.strikes == [19850, 19900, 19950, 20000, 20100, 20150, 20200, 20250]
+    assert ladder.get_nearest(60) == 20200
+    assert ladder.get_first_below(150) == 20100
+
+
+def test_stale_itm_strike_next_to_the_atm_is_skipped():
+    ladder = PremiumLadder(20000, STRIKES, [380, 310, 190, 200, 160, 125, 95, 70, 50], "CE")
+    assert ladder.strikes == [19850, 19900, 20000, 20050, 20100, 20150, 20200, 20250]
+    assert ladder.get_first_below(320) == 19900
+
+
+def test_pe_stale_strike_is_skipped():
+    ladder = PremiumLadder(20000, STRIKES, [25, 35, 150, 60, 80, 105, 140, 185, 240], "PE")
+    assert ladder.strikes == [20250, 20200, 20150, 20100, 20050, 20000, 19900, 19850]
+    assert ladder.get_nearest(40) == 19900
+
+
+def test_atm_missing_gives_empty_ladder():
+    ladder = PremiumLadder(20000, [19950, 20050], [250, 160], "CE")
+    assert ladder.strikes == []
+    assert ladder.get_nearest(100) is None